@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the chunk streaming pipeline
+Usage: python benchmarks.py <benchmark> [args...]
+"""
+
+import sys
+import time
+
+RESOLUTIONS = {
+    '240p': (426, 240, 60),      # width, height, quality
+    '360p': (640, 360, 65),
+    '480p': (854, 480, 70),
+    '720p': (1280, 720, 75),
+    '1080p': (1920, 1080, 85)
+}
+
+
+def benchmark_ingest(video_file, frame_count=300):
+    """Compare OpenCV decode + resize cascade against the single-pass ffmpeg front end"""
+    from chunk_preprocessor import iter_ffmpeg_ladders, iter_opencv_ladders
+    from ffmpeg_ingest import ffmpeg_available
+    from resolution_ladder import ResizeTimings
+
+    import cv2
+    cap = cv2.VideoCapture(video_file)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    source_size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    cap.release()
+
+    job = {
+        'video_file_path': video_file,
+        'start_frame': 0,
+        'frame_count': frame_count,
+        'renditions': RESOLUTIONS,
+        'rungs': RESOLUTIONS,  # every rendition is a full-rate rung here
+        'fps': fps,
+        'source_size': source_size
+    }
+
+    backends = {'opencv': iter_opencv_ladders}
+    if ffmpeg_available():
+        backends['ffmpeg'] = iter_ffmpeg_ladders
+    else:
+        print("⚠️  ffmpeg not found in PATH, benchmarking OpenCV only")
+
+    print(f"📊 Ingest benchmark: {video_file} ({source_size[0]}x{source_size[1]}), "
+          f"{frame_count} frames, {len(RESOLUTIONS)} rungs")
+    for name, iter_ladders in backends.items():
+        timings = ResizeTimings()
+        start_time = time.perf_counter()
+        frames = sum(1 for _ in iter_ladders(job, timings))
+        elapsed = time.perf_counter() - start_time
+        print(f"  {name:>7}: {frames} frames in {elapsed:.2f}s = {frames / elapsed:.1f} frames/sec "
+              f"({elapsed * 1000 / max(1, frames):.2f} ms/frame)")
+
+
+ENCODER_VARIANTS = {
+    'opencv': ('opencv', {}),
+    'turbojpeg': ('turbojpeg', {'fast_dct': True, 'subsampling': '420'}),
+    'turbojpeg-accurate': ('turbojpeg', {'fast_dct': False, 'subsampling': '420'}),
+    'turbojpeg-444': ('turbojpeg', {'fast_dct': True, 'subsampling': '444'}),
+}
+
+
+def benchmark_encoders(video_file, frame_count=120):
+    """Compare JPEG encoder backends: encode ms/frame and bytes/frame per resolution"""
+    from frame_encoders import available_encoders, create_encoder
+    from resolution_ladder import build_ladder
+
+    import cv2
+    usable = available_encoders()
+    encoders = {}
+    for variant, (name, options) in ENCODER_VARIANTS.items():
+        if name in usable:
+            encoders[variant] = create_encoder(name, fallback=False, **options)
+    if 'turbojpeg' not in usable:
+        print("⚠️  PyTurboJPEG/libjpeg-turbo not available, benchmarking OpenCV only")
+
+    # {variant: {resolution: [seconds, bytes]}}
+    totals = {variant: {resolution: [0.0, 0] for resolution in RESOLUTIONS} for variant in encoders}
+    cap = cv2.VideoCapture(video_file)
+    frames = 0
+    while frames < frame_count:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        ladder = build_ladder(frame, RESOLUTIONS)
+        for variant, encoder in encoders.items():
+            for resolution, (_, _, quality) in RESOLUTIONS.items():
+                start_time = time.perf_counter()
+                data = encoder.encode(ladder[resolution], quality)
+                totals[variant][resolution][0] += time.perf_counter() - start_time
+                totals[variant][resolution][1] += len(data)
+        frames += 1
+    cap.release()
+
+    if not frames:
+        print(f"❌ Could not read frames from {video_file}")
+        return
+
+    print(f"📊 Encoder benchmark: {video_file}, {frames} frames")
+    print(f"  {'encoder':>18} {'resolution':>10} {'ms/frame':>9} {'bytes/frame':>12}")
+    for variant, per_resolution in totals.items():
+        for resolution, (seconds, size) in per_resolution.items():
+            print(f"  {variant:>18} {resolution:>10} {seconds * 1000 / frames:9.2f} {size // frames:12d}")
+        total_seconds = sum(seconds for seconds, _ in per_resolution.values())
+        print(f"  {variant:>18} {'all':>10} {total_seconds * 1000 / frames:9.2f} "
+              f"{sum(size for _, size in per_resolution.values()) // frames:12d}")
+
+
+def encode_chunk_frames(video_file, frame_count):
+    """JPEG frames of one chunk per resolution, {resolution: [frame bytes]}, or None if the video cannot be read"""
+    import cv2
+    from resolution_ladder import build_ladder
+
+    chunks = {resolution: [] for resolution in RESOLUTIONS}
+    cap = cv2.VideoCapture(video_file)
+    while len(chunks['240p']) < frame_count:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        for resolution, image in build_ladder(frame, RESOLUTIONS).items():
+            chunks[resolution].append(cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, RESOLUTIONS[resolution][2]])[1].tobytes())
+    cap.release()
+    if not chunks['240p']:
+        print(f"❌ Could not read frames from {video_file}")
+        return None
+    return chunks
+
+
+def benchmark_packets(video_file, frame_count=60, sends=20):
+    """Per-frame send CPU: building v2 packets for every send vs patching pre-built ones, as prepacketized serving does"""
+    import socket
+    from chunk_protocol import PROTOCOL_V2, send_packet, stamp_v2
+    from new_server import ChunkBasedVideoServer
+
+    chunks = encode_chunk_frames(video_file, frame_count)
+    if chunks is None:
+        return
+
+    server = ChunkBasedVideoServer(host='127.0.0.1')
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    address = receiver.getsockname()
+
+    print(f"📊 Packet benchmark: {video_file}, {len(chunks['240p'])} frames x {sends} sends, protocol v2, "
+          f"CPU time per frame sent")
+    print(f"  {'resolution':>10} {'build us':>9} {'stamp us':>9} {'build+send us':>14} {'stamp+send us':>14}")
+    for rendition_id, (resolution, frames) in enumerate(chunks.items()):
+        # Without a reusable buffer every frame gets its own (writable) headers
+        prebuilt = [
+            server.create_chunk_packets(0, frame_index, resolution, frame_data, 0, PROTOCOL_V2, rendition_id)
+            for frame_index, frame_data in enumerate(frames)
+        ]
+        results = []
+        for send in (False, True):
+            for stamp in (False, True):
+                start_time = time.process_time()
+                for _ in range(sends):
+                    for frame_index, frame_data in enumerate(frames):
+                        if stamp:
+                            packets = stamp_v2(prebuilt[frame_index], frame_index)
+                        else:
+                            packets = server.create_chunk_packets(0, frame_index, resolution, frame_data, frame_index,
+                                                                  PROTOCOL_V2, rendition_id, reuse_buffer=True)
+                        if send:
+                            for packet in packets:
+                                send_packet(server.video_socket, packet, address)
+                results.append((time.process_time() - start_time) * 1e6 / (sends * len(frames)))
+        print(f"  {resolution:>10} {results[0]:9.1f} {results[1]:9.1f} {results[2]:14.1f} {results[3]:14.1f}")
+    receiver.close()
+    server.cleanup()
+
+
+def benchmark_throughput(video_file, frame_count=60, sends=20, protocol=2, packet_size=None, rounds=3):
+    """Send throughput per core: packets joined into one buffer and sent with sendto vs gathered by sendmsg
+
+    Bytes/sec is bytes handed to the kernel per second of this process's CPU
+    time, packet building included. The benchmark is single-threaded, so
+    that is the rate one core sustains. Senders take turns for several
+    rounds and the best round counts. The saved copy grows with the
+    packet: try a packet_size of 60000, what server_chunk sends.
+    """
+    import socket
+    from chunk_protocol import HAVE_SENDMSG, send_packet
+    from new_server import ChunkBasedVideoServer
+
+    chunks = encode_chunk_frames(video_file, frame_count)
+    if chunks is None:
+        return
+
+    server = ChunkBasedVideoServer(host='127.0.0.1', **({'packet_size': packet_size} if packet_size else {}))
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    address = receiver.getsockname()
+    sock = server.video_socket
+
+    def send_joined(packet):
+        return sock.sendto(b''.join(packet), address)  # the payload copy every send used to make
+
+    def send_gathered(packet):
+        return send_packet(sock, packet, address)
+
+    senders = {'join+sendto': send_joined}
+    if HAVE_SENDMSG:
+        senders['sendmsg'] = send_gathered
+    else:
+        print("⚠️  socket.sendmsg is not available on this platform, benchmarking joined sends only")
+
+    print(f"📊 Throughput benchmark: {video_file}, {len(chunks['240p'])} frames x {sends} sends, protocol v{protocol}, "
+          f"{server.packet_size} byte packets, MB/s per core")
+    print(f"  {'resolution':>10} " + " ".join(f"{name:>12}" for name in senders) + f" {'speedup':>8}")
+    for rendition_id, (resolution, frames) in enumerate(chunks.items()):
+        rates = [0.0] * len(senders)
+        for _ in range(rounds):
+            for index, send in enumerate(senders.values()):
+                sent = 0
+                start_time = time.process_time()
+                for _ in range(sends):
+                    for frame_index, frame_data in enumerate(frames):
+                        for packet in server.create_chunk_packets(0, frame_index, resolution, frame_data, frame_index,
+                                                                  protocol, rendition_id, reuse_buffer=True):
+                            sent += send(packet)
+                rates[index] = max(rates[index], sent / (time.process_time() - start_time))
+        speedup = f"{rates[-1] / rates[0]:7.2f}x" if len(rates) > 1 else ''
+        print(f"  {resolution:>10} " + " ".join(f"{rate / 1e6:12.1f}" for rate in rates) + f" {speedup:>8}")
+    receiver.close()
+    server.cleanup()
+
+
+BENCHMARKS = {
+    'ingest': (benchmark_ingest, "ingest <video_file> [frames]"),
+    'encoders': (benchmark_encoders, "encoders <video_file> [frames]"),
+    'packets': (benchmark_packets, "packets <video_file> [frames] [sends]"),
+    'throughput': (benchmark_throughput, "throughput <video_file> [frames] [sends] [protocol] [packet_size]"),
+}
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print("Usage: python benchmarks.py <benchmark> [args...]")
+        for benchmark, usage in BENCHMARKS.values():
+            print(f"  python benchmarks.py {usage}")
+        return
+
+    benchmark, _ = BENCHMARKS[sys.argv[1]]
+    args = [int(arg) if arg.isdigit() else arg for arg in sys.argv[2:]]
+    benchmark(*args)
+
+
+if __name__ == "__main__":
+    main()
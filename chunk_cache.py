@@ -0,0 +1,209 @@
+"""
+Server-wide chunk cache
+Every client streaming the same chunk shares one loaded
+copy of its frames. Entries are evicted least-recently-used once the byte
+budget is exceeded, and clients that miss on a chunk another client is
+already loading wait for that load instead of starting their own.
+ChunkPrefetcher fills the cache ahead of the streaming loop on a
+background I/O thread.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_CACHE_MB = 256
+MAX_QUEUED_PREFETCHES = 16  # read-ahead keys waiting for the I/O thread; older ones are dropped
+
+
+class PendingLoad:
+    """A load in progress that other callers can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.frames = None
+        self.error = None
+
+
+class ChunkCache:
+    """LRU cache of chunk frame lists with a byte budget"""
+
+    def __init__(self, budget_bytes=DEFAULT_CACHE_MB * 1024 * 1024):
+        self.budget_bytes = budget_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # {key: (frames, size)}, least recently used first
+        self.pending = {}             # {key: PendingLoad}
+        self.size = 0
+
+        # Counters for capacity tuning
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0  # misses that waited for another caller's load
+        self.evictions = 0
+        self.prefetched = 0        # chunks loaded ahead of time by a prefetcher
+        self.io_wait_seconds = 0.0  # time get() callers spent waiting on a load
+
+    def get(self, key, loader):
+        """Frames cached under key, calling loader() to load them on a miss
+
+        Concurrent misses on the same key run loader() once. A load that
+        returns None or raises is not cached; every caller waiting on it gets
+        the same result.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+            pending = self.pending.get(key)
+            loading = pending is None
+            if loading:
+                pending = self.pending[key] = PendingLoad()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        start_time = time.perf_counter()
+        try:
+            if not loading:
+                pending.done.wait()
+                if pending.error is not None:
+                    raise pending.error
+                return pending.frames
+            return self.load(key, loader, pending)
+        finally:
+            waited = time.perf_counter() - start_time
+            with self.lock:
+                self.io_wait_seconds += waited
+
+    def prefetch(self, key, loader):
+        """Load key into the cache unless it is cached or already loading; does not count as a lookup"""
+        with self.lock:
+            if key in self.entries or key in self.pending:
+                return
+            pending = self.pending[key] = PendingLoad()
+            self.prefetched += 1
+        try:
+            self.load(key, loader, pending)
+        except Exception:
+            pass  # a caller that needs the chunk will retry the load and report the error
+
+    def load(self, key, loader, pending):
+        """Run loader() for a registered PendingLoad and publish the result"""
+        try:
+            pending.frames = loader()
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.pending[key]
+                if pending.frames is not None:
+                    self.insert(key, pending.frames)
+            pending.done.set()
+        return pending.frames
+
+    def insert(self, key, frames):
+        """Add an entry and evict down to the budget (lock held)"""
+        # A list of frames, or an object that knows its size (e.g. pre-built packets)
+        size = frames.nbytes if hasattr(frames, 'nbytes') else sum(len(frame) for frame in frames)
+        if size > self.budget_bytes:
+            return
+        self.entries[key] = (frames, size)
+        self.size += size
+        while self.size > self.budget_bytes:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+
+    def clear(self):
+        """Drop every entry (counters are kept)"""
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """Hit/miss/eviction counters and current occupancy"""
+        with self.lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'prefetched': self.prefetched,
+                # Lookups that had to wait for a load, and for how long in total
+                'io_waits': self.misses + self.coalesced,
+                'io_wait_seconds': round(self.io_wait_seconds, 3),
+                'entries': len(self.entries),
+                'size_bytes': self.size,
+                'budget_bytes': self.budget_bytes
+            }
+
+
+class ChunkPrefetcher:
+    """Load the chunks clients are about to need on a background I/O thread
+
+    schedule() queues the next depth chunks after the one a client has just
+    started; the thread loads each into the cache unless it is already there.
+    A key that is already queued is not queued twice, and once max_queued
+    keys are waiting the oldest are dropped: clients have moved past them.
+    """
+
+    def __init__(self, cache, loader, depth=2, max_queued=MAX_QUEUED_PREFETCHES):
+        self.cache = cache
+        self.loader = loader  # loader(*key) -> frames, key being a schedule() prefix plus the chunk id
+        self.depth = depth
+        self.max_queued = max_queued
+        self.pending = OrderedDict()  # queued keys, oldest first
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.dropped = 0
+
+    def start(self):
+        if self.depth <= 0 or self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def schedule(self, prefix, chunk_id, total_chunks):
+        """Queue the chunks after chunk_id (wrapping at the end) for read-ahead
+
+        prefix is the rest of the cache key, e.g. (resolution,), and is
+        prepended to each chunk id.
+        """
+        if not self.running or not total_chunks:
+            return
+        with self.condition:
+            for ahead in range(1, self.depth + 1):
+                key = prefix + ((chunk_id + ahead) % total_chunks,)
+                if key in self.pending:
+                    continue
+                self.pending[key] = None
+                if len(self.pending) > self.max_queued:
+                    self.pending.popitem(last=False)
+                    self.dropped += 1
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.running:
+                    break
+                key, _ = self.pending.popitem(last=False)
+            self.cache.prefetch(key, lambda: self.loader(*key))
+
+    def stop(self):
+        if self.running:
+            with self.condition:
+                self.running = False
+                self.pending.clear()
+                self.condition.notify()
+            self.thread.join(timeout=1.0)
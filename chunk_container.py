@@ -0,0 +1,108 @@
+"""
+Packed per-rendition chunk container
+Once every chunk of a rendition is encoded, its chunk_NNNN.bin files are
+packed into a single <rendition>.pack file:
+
+    header       magic, chunk count, frame count
+    chunk index  (first frame, frame count) per chunk
+    frame index  (offset, length) per frame, offsets from the start of the file
+    payload      the encoded frames back to back
+
+The file is opened once with mmap and chunks are served as memoryview
+slices of the mapping, so loading a chunk costs no syscalls and no copies.
+"""
+
+import mmap
+import os
+import struct
+
+PACK_MAGIC = b'CPK1'
+PACK_HEADER = struct.Struct('!4sII')  # magic, chunk count, frame count
+CHUNK_ENTRY = struct.Struct('!II')    # first frame, frame count
+FRAME_ENTRY = struct.Struct('!QI')    # offset, length
+
+
+def write_pack(pack_file, chunk_files, chunk_frame_sizes):
+    """Pack chunk files into one container and return its size
+
+    chunk_frame_sizes holds the frame sizes of every chunk file (as recorded
+    in the manifest); each file is checked against them while it is copied.
+    The container is written to a temporary file and renamed into place.
+    """
+    frame_count = sum(len(frame_sizes) for frame_sizes in chunk_frame_sizes)
+    index_size = PACK_HEADER.size + CHUNK_ENTRY.size * len(chunk_files) + FRAME_ENTRY.size * frame_count
+
+    index = bytearray(index_size)
+    PACK_HEADER.pack_into(index, 0, PACK_MAGIC, len(chunk_files), frame_count)
+    chunk_position = PACK_HEADER.size
+    frame_position = chunk_position + CHUNK_ENTRY.size * len(chunk_files)
+    first_frame = 0
+    offset = index_size
+    for frame_sizes in chunk_frame_sizes:
+        CHUNK_ENTRY.pack_into(index, chunk_position, first_frame, len(frame_sizes))
+        chunk_position += CHUNK_ENTRY.size
+        first_frame += len(frame_sizes)
+        for frame_size in frame_sizes:
+            FRAME_ENTRY.pack_into(index, frame_position, offset, frame_size)
+            frame_position += FRAME_ENTRY.size
+            offset += frame_size
+
+    tmp_file = pack_file + '.tmp'
+    try:
+        with open(tmp_file, 'wb') as f:
+            f.write(index)
+            for chunk_file, frame_sizes in zip(chunk_files, chunk_frame_sizes):
+                with open(chunk_file, 'rb') as chunk:
+                    data = memoryview(chunk.read())
+                if struct.unpack_from('!I', data)[0] != len(frame_sizes):
+                    raise ValueError(f"{chunk_file} does not match its manifest entry")
+                position = 4
+                for frame_size in frame_sizes:
+                    if struct.unpack_from('!I', data, position)[0] != frame_size:
+                        raise ValueError(f"{chunk_file} does not match its manifest entry")
+                    position += 4
+                    f.write(data[position:position + frame_size])
+                    position += frame_size
+            size = f.tell()
+        os.replace(tmp_file, pack_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return size
+
+
+class PackedRendition:
+    """Read-only, memory-mapped view of a packed rendition"""
+
+    def __init__(self, pack_file):
+        self.pack_file = pack_file
+        with open(pack_file, 'rb') as f:
+            # The mapping stays valid after the file is closed
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mmap)
+
+        magic, chunk_count, frame_count = PACK_HEADER.unpack_from(self.view)
+        if magic != PACK_MAGIC:
+            self.close()
+            raise ValueError(f"{pack_file} is not a chunk container")
+        frame_table = PACK_HEADER.size + CHUNK_ENTRY.size * chunk_count
+        self.chunks = list(CHUNK_ENTRY.iter_unpack(self.view[PACK_HEADER.size:frame_table]))
+        self.frames = list(FRAME_ENTRY.iter_unpack(self.view[frame_table:frame_table + FRAME_ENTRY.size * frame_count]))
+
+    @property
+    def chunk_count(self):
+        return len(self.chunks)
+
+    def load_chunk(self, chunk_id):
+        """Frames of a chunk as zero-copy memoryviews into the mapping"""
+        first_frame, frame_count = self.chunks[chunk_id]
+        view = self.view
+        return [view[offset:offset + length] for offset, length in self.frames[first_frame:first_frame + frame_count]]
+
+    def close(self):
+        """Unmap the file, unless frames handed out are still referenced"""
+        try:
+            self.view.release()
+            self.mmap.close()
+        except BufferError:
+            pass  # a slice is still in use (e.g. mid-send); the mapping goes when it is collected
@@ -0,0 +1,716 @@
+"""
+Parallel chunk preprocessing engine
+Fans (chunk_id, resolution) encode jobs out to a process pool so that
+preprocessing scales with the number of CPU cores
+"""
+
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import numpy as np
+
+from chunk_container import PackedRendition, write_pack
+from chunk_store import ChunkManifest, ChunkWriter, cache_key, read_chunk
+from rate_control import QualityController
+from frame_dedup import REPEAT_FRAME, StaticFrameDetector, frame_luma
+from ffmpeg_ingest import FFmpegLadderReader, ffmpeg_available
+from frame_encoders import DEFAULT_ENCODER, create_encoder, worker_encoder
+from resolution_ladder import ResizeTimings, build_ladder, fit_ladder, ladder_order, parse_variant, variant_name
+from video_segments import CHUNK_FORMATS, DEFAULT_PRESET, SegmentWriter
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+WORKER_BASE_MEMORY = 80 * 1024 * 1024  # interpreter + OpenCV + decoder state per worker
+SEGMENT_ENCODER_MEMORY = 40 * 1024 * 1024  # one ffmpeg encoder process per rendition in segment mode
+CHECKPOINT_INTERVAL = 5.0  # seconds between manifest checkpoints while encoding
+
+
+def _init_worker():
+    """Keep OpenCV single-threaded inside pool workers to avoid oversubscription"""
+    cv2.setNumThreads(1)
+
+
+def peak_rss_bytes():
+    """Peak resident set size of the current process, or None if unavailable"""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS reports bytes
+        return peak if sys.platform == 'darwin' else peak * 1024
+    if psutil is not None:
+        memory_info = psutil.Process().memory_info()
+        return getattr(memory_info, 'peak_wset', memory_info.rss)
+    return None
+
+
+def iter_opencv_ladders(job, timings):
+    """Decode the job's frames with OpenCV and cascade each one down the ladder"""
+    cap = cv2.VideoCapture(job['video_file_path'])
+    if not cap.isOpened():
+        return
+
+    if job['start_frame'] > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, job['start_frame'])
+
+    frame = None
+    try:
+        for _ in range(job['frame_count']):
+            # Reuse the previous frame buffer, nothing else holds on to it
+            ret, frame = cap.read(frame)
+            if not ret:
+                break
+            yield build_ladder(frame, job['rungs'], timings)
+    finally:
+        cap.release()
+
+
+def iter_ffmpeg_ladders(job, timings):
+    """Decode and scale the job's frames to every rung in a single ffmpeg pass"""
+    reader = FFmpegLadderReader(
+        job['video_file_path'],
+        job['rungs'],
+        start_time=job['start_frame'] / job['fps'],
+        frame_count=job['frame_count'],
+        source_size=job['source_size'],
+        threads=job.get('ffmpeg_threads')
+    )
+    try:
+        while True:
+            # Decoding and scaling are one native step, so time them together
+            start_time = time.perf_counter()
+            ladder = reader.read()
+            timings.add('ffmpeg decode+scale', time.perf_counter() - start_time)
+            if ladder is None:
+                break
+            yield ladder
+    finally:
+        reader.close()
+
+
+def open_chunk_writer(job, resolution):
+    """Open the chunk file writer for one rendition in the job's chunk format"""
+    chunk_file = os.path.join(job['storage_dir'], resolution, f"chunk_{job['chunk_id']:04d}.bin")
+    if job['chunk_format'] == 'jpeg':
+        return ChunkWriter(chunk_file)
+
+    width, height, quality = job['renditions'][resolution]
+    divisor = parse_variant(resolution)[1]
+    return SegmentWriter(chunk_file, job['chunk_format'], width, height, job['fps'] / divisor, quality,
+                         -(-job['frame_count'] // divisor), preset=job['segment_preset'], threads=job.get('ffmpeg_threads'))
+
+
+def encode_chunk_job(job):
+    """Encode one chunk for a set of resolutions (runs inside a pool worker)
+
+    Frames are streamed: each decoded frame is resized and encoded for every
+    resolution in the job, appended to that resolution's chunk_NNNN.bin and
+    then dropped, so memory stays at a few frames regardless of chunk length.
+    Renditions are cascaded down the ladder rather than each resized from
+    the source. Only the resolutions listed in the job are rebuilt. In
+    segment mode the resized frames go to one ffmpeg encoder per resolution
+    instead of the JPEG encoder. Frame-rate variants ('360p@d2') take every
+    Nth frame of their rung and get their own file. With static-frame dedup,
+    JPEG frames matching the last emitted frame are stored as repeat markers.
+    """
+    chunk_id = job['chunk_id']
+    segment_mode = job['chunk_format'] != 'jpeg'
+    encoder = None if segment_mode else worker_encoder(job['encoder'])
+    timings = ResizeTimings()
+    if job['ingest_backend'] == 'ffmpeg':
+        ladders = iter_ffmpeg_ladders(job, timings)
+    else:
+        ladders = iter_opencv_ladders(job, timings)
+
+    # Rate control: per-frame quality search against a per-chunk byte budget
+    variants = {resolution: parse_variant(resolution) for resolution in job['renditions']}
+    controllers = {}
+    if job.get('target_bitrates') and not segment_mode:
+        # A variant keeps the same byte budget per frame as its full-rate rung
+        controllers = {
+            resolution: QualityController(job['target_bitrates'][rung] / divisor, job['fps'] / divisor,
+                                          -(-job['frame_count'] // divisor), job['renditions'][resolution][2])
+            for resolution, (rung, divisor) in variants.items()
+        }
+
+    # One detector per frame rate, each compares against its own last emitted frame
+    divisors = sorted({divisor for _, divisor in variants.values()})
+    detectors = {}
+    if job.get('dedup_static') and not segment_mode:
+        detectors = {divisor: StaticFrameDetector() for divisor in divisors}
+        largest_rung = ladder_order(job['rungs'])[0]  # every smaller rung is scaled from it
+
+    writers = {}
+    frame_count = 0
+    for ladder in ladders:
+        if not writers:
+            writers = {resolution: open_chunk_writer(job, resolution) for resolution in job['renditions'].keys()}
+
+        repeats = set()
+        if detectors:
+            luma = frame_luma(ladder[largest_rung])
+            repeats = {divisor for divisor in divisors
+                       if frame_count % divisor == 0 and detectors[divisor].is_repeat(luma)}
+
+        encoded = {}  # fixed-quality JPEGs are shared between a rung and its variants
+        for resolution, (rung, divisor) in variants.items():
+            if frame_count % divisor:
+                continue
+            quality = job['renditions'][resolution][2]
+            if divisor in repeats:
+                writers[resolution].write_frame(REPEAT_FRAME)
+                if controllers:
+                    controllers[resolution].repeat()
+            elif segment_mode:
+                writers[resolution].write_frame(ladder[rung])
+            elif controllers:
+                writers[resolution].write_frame(controllers[resolution].encode(encoder, ladder[rung]))
+            else:
+                if rung not in encoded:
+                    encoded[rung] = encoder.encode(ladder[rung], quality)
+                writers[resolution].write_frame(encoded[rung])
+        frame_count += 1
+
+    renditions = {}
+    for resolution, writer in writers.items():
+        renditions[resolution] = {
+            'size': writer.close(),
+            'frame_count': writer.frame_count,
+            'frame_sizes': writer.frame_sizes
+        }
+        if resolution in controllers:
+            renditions[resolution]['rate_control'] = controllers[resolution].stats(job['fps'] / variants[resolution][1])
+
+    return {
+        'chunk_id': chunk_id,
+        'frame_count': frame_count,
+        'renditions': renditions,
+        'repeat_frames': detectors[1].repeats if detectors else 0,
+        'peak_rss': peak_rss_bytes(),
+        'resize_timings': timings.as_dict()
+    }
+
+
+class ChunkPreprocessor:
+    def __init__(self, video_file_path, resolutions, chunk_duration=2.0, storage_dir="video_chunks",
+                 max_workers=None, memory_limit_mb=None, ingest_backend='opencv', encoder=DEFAULT_ENCODER,
+                 encoder_options=None, chunk_format='jpeg', target_bitrates=None, frame_rate_divisors=(1,),
+                 dedup_static=False):
+        self.video_file_path = video_file_path
+        self.resolutions = resolutions          # {resolution: (width, height, quality)}, fitted to the source by prepare()
+        self.frame_rate_divisors = tuple(sorted(set(frame_rate_divisors) | {1}))  # e.g. (1, 2, 3)
+        self.renditions = self.variant_renditions()
+        self.chunk_duration = chunk_duration
+        self.storage_dir = storage_dir
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.memory_limit_mb = memory_limit_mb  # None = no ceiling on preprocessing memory
+        self.ingest_backend = ingest_backend    # 'opencv', 'ffmpeg' or 'auto'
+        self.encoder = create_encoder(encoder, **(encoder_options or {}))  # JPEG backend, see frame_encoders
+        self.chunk_format = chunk_format        # 'jpeg' (MJPEG) or an H.264/HEVC segment codec, see video_segments
+        self.target_bitrates = target_bitrates  # {resolution: bits/sec} for rate-controlled JPEG, None = fixed quality
+        self.dedup_static = dedup_static        # store static JPEG frames as repeat markers, see frame_dedup
+
+        # Results (shared with the server, updated in place as chunks complete)
+        self.original_fps = 30
+        self.total_frames = 0
+        self.frames_per_chunk = 0
+        self.total_chunks = 0
+        self.chunks_storage = {}   # {resolution: [chunk_files]}
+        self.chunk_metadata = {}   # {chunk_id: {duration, frame_count}}
+        self.packs = {}            # {resolution: PackedRendition}, once every chunk is encoded
+        self.manifest = None
+        self.jobs = []
+
+        # Progressive availability: chunks [0, available_chunks) are fully written
+        self.available_chunks = 0
+        self.is_complete = False
+        self.ready_chunks = set()
+        self.ready_condition = threading.Condition()
+
+        # Live progress, read by status requests while encoding runs in another thread
+        self.progress_lock = threading.Lock()
+        self.encode_start_time = None
+        self.encode_end_time = None    # set once this run's jobs are all done, so the rate stops decaying
+        self.frames_to_encode = 0      # source frames covered by this run's jobs
+        self.frames_encoded = 0
+        self.rendition_chunks_done = {}  # {resolution: chunks stored}
+
+    def variant_renditions(self):
+        """Every stored rendition: each rung at each frame rate, {'360p': ..., '360p@d2': ...}"""
+        return {
+            variant_name(resolution, divisor): settings
+            for resolution, settings in self.resolutions.items() for divisor in self.frame_rate_divisors
+        }
+
+    def fit_to_source(self, source_size):
+        """Drop or cap rungs above the source resolution, nothing is ever upscaled"""
+        ladder = fit_ladder(self.resolutions, source_size)
+        skipped = [resolution for resolution in self.resolutions if resolution not in ladder]
+        capped = [resolution for resolution in ladder if ladder[resolution] != self.resolutions[resolution]]
+        if skipped:
+            print(f"  Skipping rungs above the {source_size[0]}x{source_size[1]} source: {', '.join(skipped)}")
+        for resolution in capped:
+            print(f"  Capping {resolution} to {ladder[resolution][0]}x{ladder[resolution][1]}")
+
+        self.resolutions = ladder
+        self.renditions = self.variant_renditions()
+
+    def probe_source(self):
+        """Read frame rate and frame count of the source video"""
+        cap = cv2.VideoCapture(self.video_file_path)
+        if not cap.isOpened():
+            return None
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        cap.release()
+        return fps, total_frames, (width, height)
+
+    def build_jobs(self):
+        """Create one job per chunk covering the resolutions missing from the store"""
+        jobs = []
+        recovered = 0
+        for chunk_id in range(self.total_chunks):
+            chunk_info = self.manifest.chunks.get(chunk_id)
+            if chunk_info and not chunk_info['frame_count']:
+                # Frame count estimates can overshoot; this chunk is past the end of the source
+                continue
+
+            start_frame = chunk_id * self.frames_per_chunk
+            frame_count = min(self.frames_per_chunk, self.total_frames - start_frame)
+            missing = self.manifest.missing_renditions(chunk_id, self.renditions.keys())
+            for resolution in list(missing):
+                # Chunks finished after the last checkpoint of an interrupted run
+                expected_frames = -(-frame_count // parse_variant(resolution)[1])
+                if self.manifest.recover(resolution, chunk_id, frame_count, expected_frames):
+                    missing.remove(resolution)
+                    recovered += 1
+            for resolution in self.renditions:
+                if resolution not in missing:
+                    self.rendition_chunks_done[resolution] = self.rendition_chunks_done.get(resolution, 0) + 1
+            if not missing:
+                self.mark_chunk_ready(chunk_id)
+                continue
+
+            jobs.append({
+                'video_file_path': self.video_file_path,
+                'chunk_id': chunk_id,
+                'start_frame': start_frame,
+                'frame_count': frame_count,
+                'renditions': {resolution: self.renditions[resolution] for resolution in missing},
+                'rungs': {rung: self.resolutions[rung] for rung in {parse_variant(resolution)[0] for resolution in missing}},
+                'storage_dir': self.manifest.store_dir,
+                'ingest_backend': self.ingest_backend,
+                'fps': self.original_fps,
+                'source_size': self.manifest.source_size,
+                'ffmpeg_threads': 1,
+                'encoder': self.encoder.settings(),
+                'chunk_format': self.chunk_format,
+                'segment_preset': DEFAULT_PRESET,
+                'target_bitrates': self.target_bitrates,
+                'dedup_static': self.dedup_static
+            })
+
+        if recovered:
+            print(f"🩹 Recovered {recovered} chunk files written after the last checkpoint")
+            self.manifest.save()
+        return jobs
+
+    def open_store(self):
+        """Open (or create) the content-addressed store for this source and ladder"""
+        key = cache_key(self.video_file_path, self.resolutions, self.chunk_duration, self.encoding_settings())
+        store_dir = os.path.join(self.storage_dir, key)
+        for resolution in self.renditions.keys():
+            os.makedirs(os.path.join(store_dir, resolution), exist_ok=True)
+
+        self.manifest = ChunkManifest(store_dir, key)
+        if self.manifest.load():
+            print(f"📦 Found existing chunk store {key}")
+        else:
+            print(f"📦 Creating chunk store {key}")
+        removed = self.manifest.remove_partial_files()
+        if removed:
+            print(f"🧹 Removed {removed} partial chunk files from an interrupted run")
+
+    def select_ingest_backend(self):
+        """Resolve 'auto' and fall back to OpenCV when ffmpeg is not installed"""
+        if self.ingest_backend in ('ffmpeg', 'auto'):
+            if ffmpeg_available():
+                self.ingest_backend = 'ffmpeg'
+            else:
+                if self.ingest_backend == 'ffmpeg':
+                    print("⚠️  ffmpeg not found in PATH, falling back to OpenCV ingest")
+                self.ingest_backend = 'opencv'
+        elif self.ingest_backend != 'opencv':
+            raise ValueError(f"Unknown ingest backend: {self.ingest_backend}")
+
+    def select_chunk_format(self):
+        """Validate the chunk format, falling back to MJPEG when ffmpeg is not installed"""
+        if self.chunk_format not in CHUNK_FORMATS:
+            raise ValueError(f"Unknown chunk format: {self.chunk_format} (use one of {', '.join(CHUNK_FORMATS)})")
+        if self.chunk_format != 'jpeg' and not ffmpeg_available():
+            print(f"⚠️  ffmpeg not found in PATH, falling back to JPEG chunks instead of {self.chunk_format}")
+            self.chunk_format = 'jpeg'
+        if self.target_bitrates:
+            if self.chunk_format != 'jpeg':
+                print(f"⚠️  Rate control only applies to JPEG chunks, {self.chunk_format} segments use CRF")
+                self.target_bitrates = None
+            elif set(self.target_bitrates) < set(self.resolutions):
+                missing = ', '.join(sorted(set(self.resolutions) - set(self.target_bitrates)))
+                raise ValueError(f"No target bitrate for {missing}")
+
+    def encoding_settings(self):
+        """Settings that determine the encoded bytes of every chunk"""
+        if self.chunk_format == 'jpeg':
+            settings = self.encoder.settings()
+            if self.target_bitrates:
+                settings['target_bitrates'] = dict(sorted(self.target_bitrates.items()))
+            if self.dedup_static:
+                settings['dedup_static'] = True
+            return settings
+        return {'codec': self.chunk_format, 'preset': DEFAULT_PRESET}
+
+    def prepare(self):
+        """Open the chunk store and work out which chunks still need encoding"""
+        source = self.probe_source()
+        if source is None:
+            print("Error: Could not open video file")
+            return False
+        # The ladder is part of the store key, so fit it before opening the store
+        self.fit_to_source(source[2])
+
+        self.select_ingest_backend()
+        self.select_chunk_format()
+        self.open_store()
+
+        self.manifest.source_size = source[2]
+        if self.manifest.original_fps:
+            self.original_fps = self.manifest.original_fps
+            self.total_frames = self.manifest.total_frames
+        else:
+            self.original_fps, self.total_frames = source[:2]
+
+        duration = self.total_frames / self.original_fps
+
+        print(f"  Original FPS: {self.original_fps:.2f}")
+        print(f"  Total frames: {self.total_frames}")
+        print(f"  Duration: {duration:.2f} seconds")
+        print(f"  Ingest backend: {self.ingest_backend}")
+        if self.chunk_format == 'jpeg':
+            print(f"  JPEG encoder: {self.encoder.name}")
+            if self.target_bitrates:
+                print("  Rate control: per-frame quality search to hit each rung's target bitrate")
+            if self.dedup_static:
+                print("  Static-frame dedup: repeated frames stored as repeat markers")
+        else:
+            print(f"  Chunk format: {self.chunk_format} segments (closed GOP, one IDR per chunk)")
+        if len(self.frame_rate_divisors) > 1:
+            rates = ', '.join(f"{self.original_fps / divisor:.1f}" for divisor in self.frame_rate_divisors)
+            print(f"  Frame-rate variants: {rates} fps")
+
+        # Calculate chunk parameters
+        self.frames_per_chunk = int(self.original_fps * self.chunk_duration)
+        self.total_chunks = int(np.ceil(self.total_frames / self.frames_per_chunk))
+
+        self.manifest.original_fps = self.original_fps
+        self.manifest.total_frames = self.total_frames
+        self.manifest.total_chunks = self.total_chunks
+
+        # Chunk paths are deterministic, availability is tracked separately
+        self.rendition_chunks_done = {resolution: 0 for resolution in self.renditions}
+        self.chunks_storage.clear()
+        for resolution in self.renditions.keys():
+            self.chunks_storage[resolution] = [
+                self.manifest.chunk_file(resolution, chunk_id) for chunk_id in range(self.total_chunks)
+            ]
+
+        self.jobs = self.build_jobs()
+        missing_pairs = sum(len(job['renditions']) for job in self.jobs)
+
+        print(f"  Frames per chunk: {self.frames_per_chunk}")
+        print(f"  Total chunks: {self.total_chunks}")
+        print(f"  Missing (chunk, resolution) pairs: {missing_pairs}/{self.total_chunks * len(self.renditions)}")
+        print()
+        return True
+
+    def run(self):
+        """Pre-process the video into chunks, reusing any valid chunks already on disk"""
+        if not self.prepare():
+            return False
+        self.encode()
+        return True
+
+    def encode(self):
+        """Encode the missing chunks and finalize the chunk list"""
+        if self.jobs:
+            try:
+                self.encode_jobs(self.jobs)
+            finally:
+                # Also checkpoint on Ctrl+C or a failure so the next run resumes from here
+                self.manifest.save()
+        else:
+            print("♻️  All chunks already encoded, skipping preprocessing")
+        self.finalize()
+
+    def progress(self):
+        """Snapshot of preprocessing progress for status queries"""
+        with self.progress_lock:
+            end_time = self.encode_end_time or time.time()
+            elapsed = end_time - self.encode_start_time if self.encode_start_time else 0.0
+            fps = self.frames_encoded / elapsed if elapsed > 0 else 0.0
+            frames_left = self.frames_to_encode - self.frames_encoded
+            return {
+                'complete': self.is_complete,
+                'frames_done': self.frames_encoded,
+                'frames_total': self.frames_to_encode,
+                'frames_per_sec': round(fps, 1),
+                'elapsed': round(elapsed, 1),
+                'eta': round(frames_left / fps, 1) if fps > 0 and not self.is_complete else None,
+                'total_chunks': self.total_chunks,
+                'available_chunks': self.available_chunks,
+                'chunks_done': dict(self.rendition_chunks_done)
+            }
+
+    def mark_chunk_ready(self, chunk_id):
+        """Record that every resolution of a chunk is written and wake up waiters"""
+        chunk_info = self.manifest.chunks[chunk_id]
+        with self.ready_condition:
+            self.chunk_metadata[chunk_id] = {
+                'frame_count': chunk_info['frame_count'],
+                'duration': chunk_info['frame_count'] / self.original_fps,
+                # {resolution: {size, frame_sizes, avg_bitrate, peak_bitrate}}
+                'renditions': {resolution: chunk_info['renditions'][resolution] for resolution in self.renditions}
+            }
+            self.ready_chunks.add(chunk_id)
+            while self.available_chunks in self.ready_chunks:
+                self.available_chunks += 1
+            self.ready_condition.notify_all()
+
+    def wait_for_chunk(self, chunk_id, timeout=None):
+        """Block until a chunk is servable, returning False on timeout or if it never will be"""
+        with self.ready_condition:
+            self.ready_condition.wait_for(
+                lambda: chunk_id < self.available_chunks or self.is_complete, timeout
+            )
+            return chunk_id < self.available_chunks
+
+    def bitrate_summary(self):
+        """Average and peak bitrate per resolution over the chunks available so far"""
+        summary = {}
+        for resolution in self.renditions:
+            renditions = [self.chunk_metadata[chunk_id]['renditions'][resolution] for chunk_id in range(self.available_chunks)]
+            frame_count = sum(len(info['frame_sizes']) for info in renditions)
+            if not frame_count:
+                continue
+            total_bytes = sum(sum(info['frame_sizes']) for info in renditions)
+            summary[resolution] = {
+                'avg_bitrate': int(total_bytes * 8 * self.original_fps / parse_variant(resolution)[1] / frame_count),
+                'peak_bitrate': max(info['peak_bitrate'] for info in renditions)
+            }
+        return summary
+
+    def chunk_costs(self):
+        """Per-chunk byte sizes, bitrates and frame sizes of every rendition, column by column"""
+        chunk_ids = range(self.available_chunks)
+        costs = {}
+        for resolution in self.renditions:
+            renditions = [self.chunk_metadata[chunk_id]['renditions'][resolution] for chunk_id in chunk_ids]
+            costs[resolution] = {
+                'size': [info['size'] for info in renditions],
+                'avg_bitrate': [info['avg_bitrate'] for info in renditions],
+                'peak_bitrate': [info['peak_bitrate'] for info in renditions],
+                'frame_sizes': [info['frame_sizes'] for info in renditions]
+            }
+        return {
+            'fps': self.original_fps,
+            'chunk_duration': self.chunk_duration,
+            'available_chunks': len(chunk_ids),
+            'renditions': costs
+        }
+
+    def finalize(self):
+        """Trim the chunk list to the leading chunks that are complete and non-empty"""
+        with self.ready_condition:
+            total_chunks = 0
+            while total_chunks < self.available_chunks and self.chunk_metadata[total_chunks]['frame_count']:
+                total_chunks += 1
+            if total_chunks < self.total_chunks:
+                print(f"⚠️  Only the first {total_chunks} of {self.total_chunks} chunks are complete")
+
+            for chunk_files in self.chunks_storage.values():
+                del chunk_files[total_chunks:]
+            complete = total_chunks == self.total_chunks
+            self.total_chunks = total_chunks
+            self.available_chunks = total_chunks
+            self.is_complete = True
+            self.ready_condition.notify_all()
+
+        if complete and total_chunks:
+            self.pack_renditions()
+
+    def pack_renditions(self):
+        """Pack every rendition into one container and serve it through mmap from then on"""
+        packed = 0
+        for resolution in self.renditions:
+            if self.manifest.packs.get(resolution, {}).get('chunk_count') != self.total_chunks:
+                chunk_files = self.chunks_storage[resolution]
+                frame_sizes = [self.manifest.chunks[chunk_id]['renditions'][resolution]['frame_sizes']
+                               for chunk_id in range(self.total_chunks)]
+                pack_file = self.manifest.pack_file(resolution)
+                self.manifest.record_pack(resolution, write_pack(pack_file, chunk_files, frame_sizes), self.total_chunks)
+                packed += 1
+            self.packs[resolution] = PackedRendition(self.manifest.pack_file(resolution))
+
+        if packed:
+            self.manifest.save()
+            print(f"📦 Packed {packed} renditions into one container file each")
+        # Only after the containers are published, so in-flight loads either see the pack or the file
+        removed = self.manifest.remove_packed_chunk_files()
+        if removed:
+            print(f"🧹 Removed {removed} chunk files now held in containers")
+
+    def load_chunk(self, resolution, chunk_id):
+        """Frames of a chunk as memoryviews, from the rendition's container once it is packed"""
+        pack = self.packs.get(resolution)
+        if pack is None:
+            try:
+                return read_chunk(self.chunks_storage[resolution][chunk_id])
+            except FileNotFoundError:
+                pack = self.packs.get(resolution)  # packed and removed in the meantime
+                if pack is None:
+                    raise
+        return pack.load_chunk(chunk_id)
+
+    def close(self):
+        """Unmap the packed renditions"""
+        for pack in self.packs.values():
+            pack.close()
+        self.packs.clear()
+
+    def print_rate_control(self):
+        """Achieved vs target bitrate per rung over every rate-controlled chunk in the store"""
+        print("🎚️  Rate control (achieved / target):")
+        for resolution in self.renditions:
+            stats = [chunk_info['renditions'][resolution]['rate_control']
+                     for chunk_info in self.manifest.chunks.values()
+                     if 'rate_control' in chunk_info['renditions'].get(resolution, {})]
+            if not stats:
+                continue
+            achieved = sum(s['achieved_bitrate'] for s in stats) / len(stats)
+            rung, divisor = parse_variant(resolution)
+            target = self.target_bitrates[rung] / divisor
+            worst = max(s['achieved_bitrate'] for s in stats)
+            print(f"   {resolution}: {achieved / 1000:.0f}/{target / 1000:.0f} kbps "
+                  f"({achieved / target * 100:.0f}%, worst chunk {worst / target * 100:.0f}%), "
+                  f"quality {min(s['quality_min'] for s in stats)}-{max(s['quality_max'] for s in stats)}, "
+                  f"{sum(s['probes_per_frame'] for s in stats) / len(stats):.1f} probes/frame")
+
+    def estimate_worker_memory(self):
+        """Estimate the resident memory of one worker while it streams a chunk"""
+        width, height = self.manifest.source_size
+
+        # Decoder frame pool plus the reused decode buffer, and one resized frame per resolution
+        frame_bytes = 4 * width * height * 3
+        frame_bytes += sum(w * h * 3 for w, h, _ in self.resolutions.values())
+        if self.chunk_format != 'jpeg':
+            frame_bytes += SEGMENT_ENCODER_MEMORY * len(self.renditions)
+        return WORKER_BASE_MEMORY + frame_bytes
+
+    def pool_size(self):
+        """Number of worker processes that fit under the memory ceiling"""
+        if not self.memory_limit_mb:
+            return self.max_workers
+
+        budget = self.memory_limit_mb * 1024 * 1024 - (peak_rss_bytes() or 0)
+        workers = max(1, min(self.max_workers, budget // self.estimate_worker_memory()))
+        if workers < self.max_workers:
+            print(f"  Memory ceiling {self.memory_limit_mb} MB limits preprocessing to {workers} workers")
+        return workers
+
+    def encode_jobs(self, jobs):
+        """Run encode jobs on the process pool and record results in the manifest"""
+        start_time = time.time()
+        frames_done = 0
+        encoded_frames = 0
+        repeat_frames = 0
+        worker_peak_rss = 0
+        resize_timings = ResizeTimings()
+        workers = self.pool_size()
+        last_checkpoint = start_time
+        job_frames = {job['chunk_id']: job['frame_count'] for job in jobs}
+        with self.progress_lock:
+            self.encode_start_time = start_time
+            self.encode_end_time = None
+            self.frames_to_encode = sum(job['frame_count'] for job in jobs)
+            self.frames_encoded = 0
+
+        print(f"  Worker processes: {workers}")
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            # Jobs are submitted in chunk order so the servable prefix grows from chunk 0
+            futures = [executor.submit(encode_chunk_job, job) for job in jobs]
+            for jobs_done, future in enumerate(as_completed(futures), 1):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"❌ Chunk encode job failed: {e}")
+                    continue
+
+                chunk_id = result['chunk_id']
+                worker_peak_rss = max(worker_peak_rss, result['peak_rss'] or 0)
+                resize_timings.merge(result['resize_timings'])
+                self.manifest.record(chunk_id, result['frame_count'], result['renditions'])
+                if set(self.manifest.chunks[chunk_id]['renditions']) >= set(self.renditions):
+                    self.mark_chunk_ready(chunk_id)
+                if time.time() - last_checkpoint >= CHECKPOINT_INTERVAL:
+                    self.manifest.save()
+                    last_checkpoint = time.time()
+                frames_done += result['frame_count']
+                with self.progress_lock:
+                    # Jobs past the real end of the source finish short; count them as done
+                    self.frames_encoded += job_frames[chunk_id]
+                    for resolution in result['renditions']:
+                        self.rendition_chunks_done[resolution] += 1
+                repeat_frames += result['repeat_frames']
+                encoded_frames += result['frame_count'] * len(result['renditions'])
+
+                progress = self.progress()
+                eta = f", ETA {progress['eta']:.0f}s" if progress['eta'] is not None else ""
+                print(f"🔄 Chunk {chunk_id + 1}/{self.total_chunks} done "
+                      f"({jobs_done}/{len(jobs)}, {progress['frames_per_sec']:.1f} frames/sec, "
+                      f"{self.available_chunks} available{eta})")
+
+        end_time = time.time()
+        with self.progress_lock:
+            self.encode_end_time = end_time
+        elapsed = end_time - start_time
+        fps = frames_done / elapsed if elapsed > 0 else 0.0
+        encoded_fps = encoded_frames / elapsed if elapsed > 0 else 0.0
+        print(f"⚡ Encoded {frames_done} frames in {elapsed:.2f}s: {fps:.1f} source frames/sec, "
+              f"{encoded_fps:.1f} encoded frames/sec across {workers} workers")
+        print("📐 Resize timing per rung:")
+        for line in resize_timings.summary():
+            print(f"   {line}")
+        if self.target_bitrates:
+            self.print_rate_control()
+        if self.dedup_static:
+            print(f"🔁 Static frames: {repeat_frames}/{frames_done} stored as repeat markers")
+
+        server_peak_rss = peak_rss_bytes()
+        if server_peak_rss is not None:
+            total_peak_rss = server_peak_rss + workers * worker_peak_rss
+            print(f"🧠 Peak RSS: server {server_peak_rss / 1024 / 1024:.0f} MB, "
+                  f"worker {worker_peak_rss / 1024 / 1024:.0f} MB, "
+                  f"total at most {total_peak_rss / 1024 / 1024:.0f} MB")
+            if self.memory_limit_mb and total_peak_rss > self.memory_limit_mb * 1024 * 1024:
+                print(f"⚠️  Peak memory exceeded the {self.memory_limit_mb} MB ceiling")
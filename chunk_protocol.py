@@ -0,0 +1,234 @@
+"""
+Chunk packet wire formats
+v1, the original format, packs each header field separately and repeats
+the rendition name as a length-prefixed string in every fragment. v2 is a
+single fixed-layout header:
+
+    version(1) rendition id(1) sequence(4) timestamp ns(8)
+    chunk id(4) frame index(4) fragment count(2) fragment index(2) fragment size(2)
+    FEC group size(1) FEC parity count(1)
+
+With FEC (see fragment_fec) the data fragments of a frame are followed by
+parity fragments, numbered from the fragment count on: group g's parity r
+has fragment index fragment count + g * parity count + r.
+
+Rendition ids and the server's clock offset are sent in the registration
+ack. The timestamp is the server's monotonic clock, and the client adds
+the offset to compare it with wall-clock time. Clients list the versions
+they speak in their register message and the ack carries the one chosen.
+Clients that do not register get v1.
+
+Frames are cut into datagrams that fit the path MTU (DEFAULT_PACKET_SIZE,
+lowered per client by a path-MTU probe at connect time) so the kernel never
+IP-fragments them: a lost IP fragment drops its whole datagram.
+
+Packets are built as (header, payload) pairs, the payload a slice of the
+frame itself, and sent with send_packet: sendmsg gathers both into one
+datagram, so payload bytes are never copied in Python.
+
+v2 clients can ask for lost fragments again with NACKs on the control
+connection. A NACK names a frame send by its base sequence (the sequence
+of fragment 0) and the missing fragments by a bitmap, see nack_bitmap.
+"""
+
+import base64
+import socket
+import struct
+import sys
+import time
+
+from fragment_fec import ROW_LENGTH, encode_parity, group_layout
+
+PROTOCOL_V1 = 1
+PROTOCOL_V2 = 2
+SUPPORTED_PROTOCOLS = (PROTOCOL_V2, PROTOCOL_V1)  # most preferred first
+
+HEADER_V2 = struct.Struct('!BBIQIIHHHBB')
+V2_STAMP = struct.Struct('!IQ')  # v2 sequence number + timestamp, patched into pre-built packets
+V2_STAMP_OFFSET = 2              # after version and rendition id
+MAX_FRAGMENTS = 0xFFFF
+MAX_RENDITIONS = 0x100
+
+# Datagram sizes (UDP payload, headers included): 1400 leaves room for tunnel and VPN
+# overhead on a 1500-byte Ethernet MTU; 1200 fits virtually any path
+DEFAULT_PACKET_SIZE = 1400
+MIN_PACKET_SIZE = 1200  # used when no probe comes back
+
+PROBE_MAGIC = b'MTUP'
+PROBE_HEADER = struct.Struct('!4sH')  # magic, probe size
+PROBE_SIZES = (1472, 1400, 1350, 1280, 1200, 1024, 548)  # 1472 fills a 1500-byte MTU
+PROBE_COPIES = 2  # each size is sent twice so one random loss does not lower the result
+
+# Linux options the socket module does not export: set DF and ignore the cached path MTU
+IP_MTU_DISCOVER = getattr(socket, 'IP_MTU_DISCOVER', 10)
+IP_PMTUDISC_PROBE = getattr(socket, 'IP_PMTUDISC_PROBE', 3)
+
+HAVE_SENDMSG = hasattr(socket.socket, 'sendmsg')  # not on Windows
+
+
+def negotiate(offered):
+    """Highest protocol version both sides speak; v1 when the client offered none"""
+    for version in SUPPORTED_PROTOCOLS:
+        if version in (offered or ()):
+            return version
+    return PROTOCOL_V1
+
+
+def rendition_ids(renditions):
+    """One-byte ids for a title's renditions, in rendition order"""
+    if len(renditions) > MAX_RENDITIONS:
+        raise ValueError(f"{len(renditions)} renditions do not fit a one-byte rendition id")
+    return {rendition: rendition_id for rendition_id, rendition in enumerate(renditions)}
+
+
+def clock_offset():
+    """Seconds to add to a monotonic timestamp to get wall-clock time on this host"""
+    return time.time() - time.monotonic_ns() / 1e9
+
+
+def pack_frame_v2(frame_data, rendition_id, sequence_number, chunk_id, frame_index, max_packet_size, buffer=None,
+                  fec_group_size=0, fec_parity=0):
+    """Cut a frame into v2 packets, returned as (buffer, packets)
+
+    Every packet is a (header, payload) pair for send_packet: headers are
+    memoryview slices of one buffer, payloads slices of frame_data itself
+    (parity payloads are new bytes), so no frame byte is copied. A buffer
+    passed in is reused when it is large enough, so the packets are only
+    valid until the same buffer is packed again; pass None to get packets
+    that can be kept (for as long as frame_data is). A repeat marker (empty
+    frame) is one header-only packet with a fragment count of 0. With
+    fec_parity, every group of fec_group_size data packets is followed by
+    that many parity packets.
+    """
+    # Leave room for the length prefix parity rows carry, so parity packets fit max_packet_size too
+    max_payload = max_packet_size - HEADER_V2.size - ROW_LENGTH.size
+    frame = memoryview(frame_data)
+    frame_size = len(frame)
+    total_fragments = (frame_size + max_payload - 1) // max_payload
+    if not total_fragments or not fec_group_size:
+        fec_group_size = fec_parity = 0  # repeat markers have nothing to protect
+    groups = group_layout(total_fragments, fec_group_size) if fec_parity else []
+    if total_fragments + len(groups) * fec_parity > MAX_FRAGMENTS:
+        raise ValueError(f"Frame of {frame_size} bytes needs more than {MAX_FRAGMENTS} fragments")
+    fragment_count = max(1, total_fragments)
+
+    needed = HEADER_V2.size * (fragment_count + len(groups) * fec_parity)
+    if buffer is None or len(buffer) < needed:
+        # A new buffer rather than a resize: packets from the last frame may still reference the old one
+        buffer = bytearray(max(needed, 2 * len(buffer)) if buffer is not None else needed)
+    view = memoryview(buffer)
+
+    timestamp = time.monotonic_ns()
+    packets = []
+    for fragment_index in range(fragment_count):
+        start = fragment_index * max_payload
+        fragment = frame[start:start + max_payload]
+        position = len(packets) * HEADER_V2.size
+        HEADER_V2.pack_into(buffer, position, PROTOCOL_V2, rendition_id, sequence_number + fragment_index, timestamp,
+                            chunk_id, frame_index, total_fragments, fragment_index, len(fragment),
+                            fec_group_size, fec_parity)
+        packets.append((view[position:position + HEADER_V2.size], fragment))
+
+    for group_index, (first, count) in enumerate(groups):
+        data = [payload for _, payload in packets[first:first + count]]
+        for parity_index, parity in enumerate(encode_parity(data, fec_parity)):
+            fragment_index = total_fragments + group_index * fec_parity + parity_index
+            position = len(packets) * HEADER_V2.size
+            HEADER_V2.pack_into(buffer, position, PROTOCOL_V2, rendition_id, sequence_number + fragment_index, timestamp,
+                                chunk_id, frame_index, total_fragments, fragment_index, len(parity),
+                                fec_group_size, fec_parity)
+            packets.append((view[position:position + HEADER_V2.size], parity))
+    return buffer, packets
+
+
+def stamp_v2(packets, sequence_number):
+    """Patch sequence numbers and the send time into the headers of pre-built v2 packets in place"""
+    timestamp = time.monotonic_ns()
+    for fragment_index, (header, _) in enumerate(packets):
+        V2_STAMP.pack_into(header, V2_STAMP_OFFSET, sequence_number + fragment_index, timestamp)
+    return packets
+
+
+def send_packet(sock, packet, address):
+    """Send a (header, payload) packet as one datagram without joining the two
+
+    sendmsg gathers the buffers in the kernel. Where it is missing they are
+    joined, which copies the payload once.
+    """
+    if HAVE_SENDMSG:
+        return sock.sendmsg(packet, (), 0, address)
+    return sock.sendto(b''.join(packet), address)
+
+
+def unpack_v2(data):
+    """Header fields of a v2 packet plus its payload as a memoryview
+
+    Returns (rendition id, sequence, timestamp ns, chunk id, frame index,
+    fragment count, fragment index, payload, FEC group size, FEC parity count).
+    """
+    view = memoryview(data)
+    (version, rendition_id, sequence_number, timestamp, chunk_id, frame_index,
+     total_fragments, fragment_index, fragment_size, fec_group_size, fec_parity) = HEADER_V2.unpack_from(view)
+    if version != PROTOCOL_V2:
+        raise ValueError(f"Not a v2 chunk packet (version {version})")
+    payload = view[HEADER_V2.size:HEADER_V2.size + fragment_size]
+    return (rendition_id, sequence_number, timestamp, chunk_id, frame_index, total_fragments, fragment_index, payload,
+            fec_group_size, fec_parity)
+
+
+def nack_bitmap(fragment_indices):
+    """Missing fragment indices as a NACK bitmap: base64 bytes, bit i (LSB first) set for fragment i"""
+    bits = bytearray(max(fragment_indices) // 8 + 1)
+    for fragment_index in fragment_indices:
+        bits[fragment_index // 8] |= 1 << (fragment_index % 8)
+    return base64.b64encode(bits).decode()
+
+
+def nack_indices(bitmap):
+    """Fragment indices set in a NACK bitmap, in order"""
+    return [byte_index * 8 + bit
+            for byte_index, byte in enumerate(base64.b64decode(bitmap)) if byte
+            for bit in range(8) if byte >> bit & 1]
+
+
+def probe_socket():
+    """UDP socket for path-MTU probes, with DF set where the platform allows it
+
+    Without DF an oversized probe is IP-fragmented and still arrives, so the
+    probe can only confirm sizes up to the configured packet size.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if sys.platform.startswith('linux'):
+        try:
+            sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_PROBE)
+        except OSError:
+            pass
+    return sock
+
+
+def probe_packets(max_size):
+    """Probe datagrams, largest first: max_size itself and every smaller probe size"""
+    sizes = sorted({max_size} | {size for size in PROBE_SIZES if size < max_size}, reverse=True)
+    return [
+        PROBE_HEADER.pack(PROBE_MAGIC, size) + bytes(size - PROBE_HEADER.size)
+        for size in sizes
+        for _ in range(PROBE_COPIES)
+    ]
+
+
+def reported_packet_size(reported, max_size):
+    """Packet size to send once a client reports the largest probe that arrived, within [MIN_PACKET_SIZE, max_size]
+
+    The report is client input: anything but a positive integer counts as no probe arriving.
+    """
+    if type(reported) is not int or reported <= 0:
+        reported = MIN_PACKET_SIZE
+    return min(max(reported, MIN_PACKET_SIZE), max_size)
+
+
+def probe_size(data):
+    """Size of a probe datagram, or None for any other packet"""
+    if len(data) < PROBE_HEADER.size or bytes(data[:len(PROBE_MAGIC)]) != PROBE_MAGIC:
+        return None
+    magic, size = PROBE_HEADER.unpack_from(data)
+    return size if size == len(data) else None  # truncated on the way: not a valid probe
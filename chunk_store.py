@@ -0,0 +1,309 @@
+"""
+Persistent, content-addressed chunk store
+Chunks are kept under a directory named after a hash of the source file and
+the encoding settings, with a manifest recording every written chunk file.
+Complete renditions are packed into one container file each, see
+chunk_container.
+"""
+
+import hashlib
+import json
+import os
+import struct
+
+from resolution_ladder import parse_variant
+
+MANIFEST_VERSION = 1
+FINGERPRINT_SAMPLE_SIZE = 1024 * 1024  # bytes hashed at the start, middle and end of the source
+
+
+def source_fingerprint(video_file_path):
+    """Hash the source size plus samples of its content
+
+    Hashing a multi-GB source in full would take longer than the restart we
+    are trying to save, so the start, middle and end are sampled instead.
+    """
+    file_size = os.path.getsize(video_file_path)
+    digest = hashlib.sha256(struct.pack('!Q', file_size))
+
+    with open(video_file_path, 'rb') as f:
+        for offset in (0, file_size // 2, max(0, file_size - FINGERPRINT_SAMPLE_SIZE)):
+            f.seek(offset)
+            digest.update(f.read(FINGERPRINT_SAMPLE_SIZE))
+
+    return digest.hexdigest()
+
+
+def cache_key(video_file_path, resolutions, chunk_duration, encoder_settings=None):
+    """Key a chunk store by source content, resolution ladder, chunk duration and encoder"""
+    settings = {
+        'resolutions': {name: list(settings) for name, settings in sorted(resolutions.items())},
+        'chunk_duration': chunk_duration
+    }
+    if encoder_settings:
+        settings['encoder'] = encoder_settings
+    digest = hashlib.sha256(source_fingerprint(video_file_path).encode())
+    digest.update(json.dumps(settings, sort_keys=True).encode())
+    return digest.hexdigest()[:16]
+
+
+class ChunkWriter:
+    """Stream encoded frames into a chunk file without holding the chunk in memory
+
+    The frame count is patched into the header on close() and the file is
+    renamed into place, so a chunk that is being served while later chunks
+    encode is never partial.
+    """
+
+    def __init__(self, chunk_file):
+        self.chunk_file = chunk_file
+        self.tmp_file = chunk_file + '.tmp'
+        self.frame_count = 0
+        self.frame_sizes = []  # encoded size of every frame, for the bitrate manifest
+        self.file = open(self.tmp_file, 'wb')
+        self.file.write(struct.pack('!I', 0))  # frame count placeholder
+
+    def write_frame(self, frame_data):
+        """Append one encoded frame with its size"""
+        self.file.write(struct.pack('!I', len(frame_data)))
+        self.file.write(frame_data)
+        self.frame_count += 1
+        self.frame_sizes.append(len(frame_data))
+
+    def close(self):
+        """Patch the frame count, rename into place and return the file size"""
+        self.file.seek(0)
+        self.file.write(struct.pack('!I', self.frame_count))
+        size = self.file.seek(0, os.SEEK_END)
+        self.file.close()
+        os.replace(self.tmp_file, self.chunk_file)
+        return size
+
+
+def read_chunk_frame_count(chunk_file):
+    """Read the frame count stored in a chunk file header"""
+    with open(chunk_file, 'rb') as f:
+        header = f.read(4)
+    if len(header) < 4:
+        return None
+    return struct.unpack('!I', header)[0]
+
+
+def read_chunk(chunk_file):
+    """Read a chunk file in one go and return its frames as memoryviews into the buffer"""
+    with open(chunk_file, 'rb') as f:
+        data = memoryview(f.read())
+    frames = []
+    position = 4
+    for _ in range(struct.unpack_from('!I', data)[0]):
+        frame_size = struct.unpack_from('!I', data, position)[0]
+        position += 4
+        frames.append(data[position:position + frame_size])
+        position += frame_size
+    return frames
+
+
+def read_chunk_frame_sizes(chunk_file):
+    """Read the size of every frame in a chunk file by walking its frame headers"""
+    frame_sizes = []
+    with open(chunk_file, 'rb') as f:
+        frame_count = struct.unpack('!I', f.read(4))[0]
+        for _ in range(frame_count):
+            frame_size = struct.unpack('!I', f.read(4))[0]
+            frame_sizes.append(frame_size)
+            f.seek(frame_size, os.SEEK_CUR)
+    return frame_sizes
+
+
+def bitrate_stats(frame_sizes, fps):
+    """Average and peak bitrate (bits/sec) of a run of frames
+
+    The peak is taken over a sliding one-second window, or over the whole
+    run when it is shorter than a second.
+    """
+    if not frame_sizes:
+        return 0, 0
+    window = max(1, min(len(frame_sizes), int(round(fps))))
+    window_bytes = peak_bytes = sum(frame_sizes[:window])
+    for i in range(window, len(frame_sizes)):
+        window_bytes += frame_sizes[i] - frame_sizes[i - window]
+        peak_bytes = max(peak_bytes, window_bytes)
+
+    avg_bitrate = sum(frame_sizes) * 8 * fps / len(frame_sizes)
+    peak_bitrate = peak_bytes * 8 * fps / window
+    return int(avg_bitrate), int(peak_bitrate)
+
+
+class ChunkManifest:
+    def __init__(self, store_dir, key):
+        self.store_dir = store_dir
+        self.key = key
+        self.path = os.path.join(store_dir, 'manifest.json')
+
+        self.original_fps = None
+        self.total_frames = 0
+        self.source_size = None    # (width, height) of the source video
+        self.total_chunks = 0
+        # {chunk_id: {'frame_count', 'renditions': {resolution: {'size', 'frame_count', 'frame_sizes',
+        #                                                        'avg_bitrate', 'peak_bitrate'}}}}
+        self.chunks = {}
+        self.packs = {}  # {resolution: {'size', 'chunk_count'}} for renditions packed into one container
+
+    def chunk_file(self, resolution, chunk_id):
+        """Path of the chunk file for a (resolution, chunk_id) pair"""
+        return os.path.join(self.store_dir, resolution, f"chunk_{chunk_id:04d}.bin")
+
+    def pack_file(self, resolution):
+        """Path of the packed container of a rendition"""
+        return os.path.join(self.store_dir, f"{resolution}.pack")
+
+    def load(self):
+        """Load the manifest from disk, returning False if missing or stale"""
+        if not os.path.exists(self.path):
+            return False
+
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Ignoring unreadable chunk manifest: {e}")
+            return False
+
+        if data.get('version') != MANIFEST_VERSION or data.get('key') != self.key:
+            return False
+
+        self.original_fps = data['original_fps']
+        self.total_frames = data['total_frames']
+        self.total_chunks = data['total_chunks']
+        self.source_size = tuple(data['source_size']) if data.get('source_size') else None
+        self.chunks = {int(chunk_id): info for chunk_id, info in data['chunks'].items()}
+        self.packs = {
+            resolution: info for resolution, info in data.get('packs', {}).items()
+            if os.path.exists(self.pack_file(resolution)) and os.path.getsize(self.pack_file(resolution)) == info['size']
+        }
+        self.backfill_frame_sizes()
+        return True
+
+    def backfill_frame_sizes(self):
+        """Add frame sizes and bitrates to entries written before they were recorded"""
+        for chunk_id, chunk_info in self.chunks.items():
+            for resolution, info in chunk_info['renditions'].items():
+                if 'frame_sizes' in info or not self.is_valid(resolution, chunk_id):
+                    continue
+                self.set_frame_sizes(resolution, info, read_chunk_frame_sizes(self.chunk_file(resolution, chunk_id)))
+
+    def set_frame_sizes(self, resolution, info, frame_sizes):
+        """Store per-frame sizes and the bitrates derived from them in a rendition entry"""
+        fps = (self.original_fps or 30) / parse_variant(resolution)[1]
+        info['frame_sizes'] = list(frame_sizes)
+        info['avg_bitrate'], info['peak_bitrate'] = bitrate_stats(frame_sizes, fps)
+
+    def save(self):
+        """Atomically write the manifest to disk"""
+        data = {
+            'version': MANIFEST_VERSION,
+            'key': self.key,
+            'original_fps': self.original_fps,
+            'total_frames': self.total_frames,
+            'total_chunks': self.total_chunks,
+            'source_size': self.source_size,
+            'chunks': {str(chunk_id): info for chunk_id, info in sorted(self.chunks.items())},
+            'packs': self.packs
+        }
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def record(self, chunk_id, frame_count, renditions):
+        """Record the chunk files written for one chunk"""
+        chunk_info = self.chunks.setdefault(chunk_id, {'frame_count': frame_count, 'renditions': {}})
+        chunk_info['frame_count'] = frame_count
+        for resolution, info in renditions.items():
+            chunk_info['renditions'][resolution] = {
+                'size': info['size'],
+                'frame_count': info['frame_count']
+            }
+            self.set_frame_sizes(resolution, chunk_info['renditions'][resolution], info['frame_sizes'])
+            if 'rate_control' in info:
+                # Achieved vs target bitrate and the qualities chosen by rate control
+                chunk_info['renditions'][resolution]['rate_control'] = info['rate_control']
+
+    def record_pack(self, resolution, size, chunk_count):
+        """Record that the first chunk_count chunks of a rendition now live in its container"""
+        self.packs[resolution] = {'size': size, 'chunk_count': chunk_count}
+
+    def is_packed(self, resolution, chunk_id):
+        """Check whether a chunk is served from its rendition's container"""
+        return chunk_id < self.packs.get(resolution, {}).get('chunk_count', 0)
+
+    def is_valid(self, resolution, chunk_id):
+        """Check that a recorded chunk file (or container entry) exists and is complete"""
+        info = self.chunks.get(chunk_id, {}).get('renditions', {}).get(resolution)
+        if not info:
+            return False
+        if self.is_packed(resolution, chunk_id):
+            return True  # the container size was checked on load
+
+        chunk_file = self.chunk_file(resolution, chunk_id)
+        try:
+            if os.path.getsize(chunk_file) != info['size']:
+                return False
+            return read_chunk_frame_count(chunk_file) == info['frame_count']
+        except OSError:
+            return False
+
+    def recover(self, resolution, chunk_id, chunk_frame_count, frame_count):
+        """Adopt a complete chunk file that an interrupted run wrote but never recorded
+
+        Chunk files are renamed into place only once complete, so a file whose
+        frame headers add up to its size and the expected frame count is safe
+        to keep. Returns True if the file was recorded.
+        """
+        chunk_file = self.chunk_file(resolution, chunk_id)
+        try:
+            size = os.path.getsize(chunk_file)
+            frame_sizes = read_chunk_frame_sizes(chunk_file)
+        except (OSError, struct.error):
+            return False
+        if len(frame_sizes) != frame_count or size != 4 + 4 * len(frame_sizes) + sum(frame_sizes):
+            return False
+
+        self.record(chunk_id, chunk_frame_count, {
+            resolution: {'size': size, 'frame_count': frame_count, 'frame_sizes': frame_sizes}
+        })
+        return True
+
+    def remove_partial_files(self):
+        """Delete temporary chunk and container files left behind by an interrupted run"""
+        removed = 0
+        for name in os.listdir(self.store_dir):
+            path = os.path.join(self.store_dir, name)
+            if name.endswith('.pack.tmp'):
+                os.remove(path)
+                removed += 1
+            elif os.path.isdir(path):
+                for chunk_name in os.listdir(path):
+                    if chunk_name.endswith('.tmp'):
+                        os.remove(os.path.join(path, chunk_name))
+                        removed += 1
+        return removed
+
+    def remove_packed_chunk_files(self):
+        """Delete chunk files whose frames are in a container, returns the number removed
+
+        Files that are still open elsewhere (Windows) are left for the next run.
+        """
+        removed = 0
+        for resolution, info in self.packs.items():
+            for chunk_id in range(info['chunk_count']):
+                try:
+                    os.remove(self.chunk_file(resolution, chunk_id))
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+    def missing_renditions(self, chunk_id, resolutions):
+        """Return the resolutions that still need to be built for a chunk"""
+        return [resolution for resolution in resolutions if not self.is_valid(resolution, chunk_id)]
@@ -0,0 +1,161 @@
+"""
+FFmpeg ingest front end for chunk preprocessing
+One ffmpeg process decodes the source and scales it to every rung of the
+resolution ladder in a single native pass. The rungs are packed side by side
+into one rawvideo canvas, read straight into a preallocated NumPy buffer and
+handed out as views, so no per-frame allocation happens in Python.
+"""
+
+import shutil
+import subprocess
+
+import numpy as np
+
+from resolution_ladder import ladder_order
+
+_ffmpeg_available = None
+
+
+def ffmpeg_available():
+    """Check once whether an ffmpeg binary is on PATH"""
+    global _ffmpeg_available
+    if _ffmpeg_available is None:
+        _ffmpeg_available = shutil.which('ffmpeg') is not None
+    return _ffmpeg_available
+
+
+def pack_ladder(rungs):
+    """Shelf-pack the rungs into one canvas
+
+    Returns ({resolution: (x, y)}, (canvas_width, canvas_height)). Rungs are
+    placed largest first, left to right, starting a new shelf when the next
+    rung does not fit the width of the largest one.
+    """
+    order = ladder_order(rungs)
+    canvas_width = max(rungs[resolution][0] for resolution in order)
+    positions = {}
+    x = shelf_y = shelf_height = 0
+
+    for resolution in order:
+        width, height = rungs[resolution][:2]
+        if x + width > canvas_width:
+            shelf_y += shelf_height
+            x = shelf_height = 0
+        positions[resolution] = (x, shelf_y)
+        x += width
+        shelf_height = max(shelf_height, height)
+
+    return positions, (canvas_width, shelf_y + shelf_height)
+
+
+def build_filter_graph(rungs, positions, source_size=None):
+    """Build a split/scale/xstack filter graph that cascades down the ladder
+
+    Like resolution_ladder.build_ladder, each rung is scaled from the
+    next-higher rung unless that rung had to be upscaled from the source.
+    Returns (filter_graph, output_label).
+    """
+    order = ladder_order(rungs)
+    source_width, source_height = source_size or (None, None)
+
+    # Work out which node every rung is scaled from
+    parents = {}
+    previous = None
+    for index, resolution in enumerate(order):
+        width, height = rungs[resolution][:2]
+        if previous is not None and width <= rungs[order[previous]][0] and height <= rungs[order[previous]][1]:
+            parents[index] = previous
+        else:
+            parents[index] = 'src'
+        if source_size is None or (width <= source_width and height <= source_height):
+            previous = index
+
+    filters = []
+
+    def fan_out(label, name, consumers):
+        """Give every consumer of a node its own pad, splitting when needed"""
+        if len(consumers) == 1:
+            return {consumers[0]: label}
+        pads = {consumer: f"[{name}_{i}]" for i, consumer in enumerate(consumers)}
+        filters.append(f"{label}split={len(consumers)}{''.join(pads.values())}")
+        return pads
+
+    pads = fan_out('[0:v]', 'src', [index for index in parents if parents[index] == 'src'])
+    stack_inputs = []
+    for index, resolution in enumerate(order):
+        width, height = rungs[resolution][:2]
+        filters.append(f"{pads[index]}scale={width}:{height}:flags=area[s{index}]")
+        consumers = ['stack'] + [child for child in parents if parents[child] == index]
+        outputs = fan_out(f"[s{index}]", f"s{index}", consumers)
+        pads.update({consumer: pad for consumer, pad in outputs.items() if consumer != 'stack'})
+        stack_inputs.append(outputs['stack'])
+
+    # Convert to BGR per rung so odd rung sizes and offsets never hit chroma subsampling
+    for index, pad in enumerate(stack_inputs):
+        filters.append(f"{pad}format=bgr24[b{index}]")
+
+    if len(order) == 1:
+        return ';'.join(filters), '[b0]'
+
+    layout = '|'.join(f"{positions[resolution][0]}_{positions[resolution][1]}" for resolution in order)
+    inputs = ''.join(f"[b{index}]" for index in range(len(order)))
+    filters.append(f"{inputs}xstack=inputs={len(order)}:layout={layout}[out]")
+    return ';'.join(filters), '[out]'
+
+
+class FFmpegLadderReader:
+    """Decode a range of source frames and scale them to every rung in one ffmpeg pass"""
+
+    def __init__(self, video_file_path, rungs, start_time=0.0, frame_count=None, source_size=None, threads=None):
+        self.rungs = rungs  # {resolution: (width, height, ...)}
+        positions, (canvas_width, canvas_height) = pack_ladder(rungs)
+        filter_graph, output_label = build_filter_graph(rungs, positions, source_size)
+
+        cmd = ['ffmpeg', '-v', 'error', '-nostdin']
+        if threads:
+            # Pool workers already use one process per core
+            cmd += ['-threads', str(threads), '-filter_threads', str(threads)]
+        if start_time > 0:
+            cmd += ['-ss', f"{start_time:.6f}"]  # input seeking is frame-accurate when decoding
+        cmd += ['-i', video_file_path, '-filter_complex', filter_graph, '-map', output_label]
+        if frame_count is not None:
+            cmd += ['-frames:v', str(frame_count)]
+        cmd += ['-f', 'rawvideo', '-pix_fmt', 'bgr24', '-']
+
+        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+        # Every frame lands in the same buffer; the rung views alias it
+        self.canvas = np.empty((canvas_height, canvas_width, 3), dtype=np.uint8)
+        self.canvas_view = memoryview(self.canvas).cast('B')
+        self.views = {
+            resolution: self.canvas[y:y + rungs[resolution][1], x:x + rungs[resolution][0]]
+            for resolution, (x, y) in positions.items()
+        }
+
+    def read(self):
+        """Read the next frame, returning {resolution: view} or None at end of stream
+
+        The views are only valid until the next call to read().
+        """
+        filled = 0
+        total = len(self.canvas_view)
+        while filled < total:
+            count = self.process.stdout.readinto(self.canvas_view[filled:])
+            if not count:
+                return None
+            filled += count
+        return self.views
+
+    def __iter__(self):
+        while True:
+            ladder = self.read()
+            if ladder is None:
+                break
+            yield ladder
+
+    def close(self):
+        """Stop ffmpeg and release the pipe"""
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.stdout.close()
+        self.process.wait()
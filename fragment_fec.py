@@ -0,0 +1,148 @@
+"""
+Forward error correction for frame fragments
+A frame's fragments are split into groups of up to K data fragments, and
+each group gets M parity fragments: a systematic Reed-Solomon erasure code
+over GF(256). Any K of a group's K + M fragments rebuild the group, so the
+client recovers up to M lost fragments per group without a retransmission.
+With M = 1 the parity is the plain XOR of the group.
+
+Rows are coded with a 2-byte length prefix and zero padding to the
+group's longest fragment, so a recovered last fragment comes back at its
+exact size. GF(256) arithmetic is vectorized with a 256x256 product table.
+"""
+
+import math
+import struct
+
+import numpy as np
+
+FEC_GROUP_SIZE = 16     # data fragments per parity group (K)
+MAX_FEC_PARITY = 4      # parity fragments per group at most (M)
+FEC_TARGET_LOSS = 0.01  # residual chance a group stays unrecoverable that parity_count() aims for
+
+ROW_LENGTH = struct.Struct('!H')  # prefix holding a data fragment's real length
+
+# GF(256) with the primitive polynomial x^8 + x^4 + x^3 + x^2 + 1 (0x11d)
+GF_EXP = np.zeros(512, dtype=np.uint8)
+GF_LOG = np.zeros(256, dtype=np.int32)
+_value = 1
+for _power in range(255):
+    GF_EXP[_power] = _value
+    GF_LOG[_value] = _power
+    _value <<= 1
+    if _value & 0x100:
+        _value ^= 0x11d
+GF_EXP[255:510] = GF_EXP[:255]
+
+# GF_MUL[a, b] = a * b, so a coefficient times a whole row is one fancy-indexing lookup
+_logs = GF_LOG[1:, None] + GF_LOG[None, 1:]
+GF_MUL = np.zeros((256, 256), dtype=np.uint8)
+GF_MUL[1:, 1:] = GF_EXP[_logs]
+GF_INV = np.zeros(256, dtype=np.uint8)
+GF_INV[1:] = GF_EXP[255 - GF_LOG[1:]]
+
+
+def parity_matrix(data_count, parity_count):
+    """Coefficients of the parity rows: all ones (XOR) for one row, a Cauchy matrix for more
+
+    Stacked under the identity, any data_count rows of the result are
+    invertible, which is what lets any data_count fragments rebuild a group.
+    """
+    if parity_count == 1:
+        return np.ones((1, data_count), dtype=np.uint8)
+    x = np.arange(parity_count, dtype=np.uint8)[:, None]
+    y = np.arange(parity_count, parity_count + data_count, dtype=np.uint8)[None, :]
+    return GF_INV[x ^ y]
+
+
+def group_layout(total_fragments, group_size):
+    """(first data fragment, data fragment count) of every parity group of a frame"""
+    return [(first, min(group_size, total_fragments - first)) for first in range(0, total_fragments, group_size)]
+
+
+def data_rows(fragments, row_length):
+    """Length-prefixed, zero-padded data fragments as a (count, row_length) array"""
+    rows = np.zeros((len(fragments), row_length), dtype=np.uint8)
+    for row, fragment in zip(rows, fragments):
+        ROW_LENGTH.pack_into(row, 0, len(fragment))
+        row[ROW_LENGTH.size:ROW_LENGTH.size + len(fragment)] = np.frombuffer(fragment, dtype=np.uint8)
+    return rows
+
+
+def encode_parity(fragments, parity_count):
+    """Parity fragments for one group of data fragments"""
+    row_length = ROW_LENGTH.size + max(len(fragment) for fragment in fragments)
+    rows = data_rows(fragments, row_length)
+    coefficients = parity_matrix(len(fragments), parity_count)
+    # (parity, data, bytes) products, XOR-summed over the data rows
+    products = GF_MUL[coefficients[:, :, None], rows[None, :, :]]
+    return [parity.tobytes() for parity in np.bitwise_xor.reduce(products, axis=1)]
+
+
+def invert(matrix):
+    """Inverse of a square GF(256) matrix by Gauss-Jordan elimination"""
+    size = len(matrix)
+    work = np.concatenate([matrix.astype(np.uint8), np.eye(size, dtype=np.uint8)], axis=1)
+    for column in range(size):
+        pivot = column + int(np.flatnonzero(work[column:, column])[0])
+        work[[column, pivot]] = work[[pivot, column]]
+        work[column] = GF_MUL[GF_INV[work[column, column]], work[column]]
+        for row in np.flatnonzero(work[:, column]):
+            if row != column:
+                work[row] ^= GF_MUL[work[row, column], work[column]]
+    return work[:, size:]
+
+
+def recover(data_count, parity_count, received):
+    """Rebuild a group's missing data fragments from any data_count of its fragments
+
+    received maps row index to payload: 0..data_count-1 for data fragments,
+    data_count.. for parity fragments. Returns {data row: fragment}, or None
+    while too few fragments have arrived or no parity has.
+    """
+    missing = [row for row in range(data_count) if row not in received]
+    parity_rows = [row for row in received if row >= data_count]
+    if not missing or not parity_rows or len(received) < data_count:
+        return {} if not missing else None
+
+    row_length = len(received[parity_rows[0]])
+    used = sorted(received)[:data_count]
+    generator = np.concatenate([np.eye(data_count, dtype=np.uint8), parity_matrix(data_count, parity_count)])
+    decode = invert(generator[used])
+
+    values = np.zeros((data_count, row_length), dtype=np.uint8)
+    for position, row in enumerate(used):
+        payload = received[row]
+        if row < data_count:
+            values[position] = data_rows([payload], row_length)[0]
+        else:
+            values[position] = np.frombuffer(payload, dtype=np.uint8)
+
+    recovered = {}
+    for row in missing:
+        products = GF_MUL[decode[row][:, None], values]
+        coded = np.bitwise_xor.reduce(products, axis=0).tobytes()
+        length = ROW_LENGTH.unpack_from(coded)[0]
+        recovered[row] = coded[ROW_LENGTH.size:ROW_LENGTH.size + length]
+    return recovered
+
+
+def parity_count(loss_rate, group_size=FEC_GROUP_SIZE, target=FEC_TARGET_LOSS, max_parity=MAX_FEC_PARITY):
+    """Fewest parity fragments per group that keep a group recoverable at this fragment loss rate
+
+    loss_rate is a fraction (0-1). A group of group_size + M fragments is
+    lost when more than M of them are; with no measured loss no parity is
+    sent.
+    """
+    if loss_rate <= 0:
+        return 0
+    loss_rate = min(loss_rate, 0.5)
+    for parity in range(max_parity + 1):
+        fragments = group_size + parity
+        recoverable = sum(
+            math.comb(fragments, lost) * loss_rate ** lost * (1 - loss_rate) ** (fragments - lost)
+            for lost in range(parity + 1)
+        )
+        if 1 - recoverable <= target:
+            return parity
+    return max_parity
@@ -0,0 +1,59 @@
+"""
+Static-frame detection for chunk preprocessing
+Screen recordings and lectures hold long runs of identical frames. A frame
+whose luma matches the last emitted frame is stored as a repeat marker (a
+zero-length frame in the chunk file) instead of a full JPEG, and sent as a
+header-only packet. Dedup is lossy, so frames are compared pixel by pixel
+at full resolution: a downscaled comparison averages a small moving object
+(a cursor, a ticker) away and the client would replay a stale frame.
+Comparing against the last emitted frame rather than the previous one
+keeps slow drift from accumulating.
+"""
+
+import cv2
+
+STATIC_MEAN_DIFF = 0.1      # mean absolute luma difference (0-255) at most: decoder noise on a static picture
+STATIC_MAX_DIFF = 8         # any pixel changing more than this is a real change, however small the object
+
+REPEAT_FRAME = b''  # marker stored in place of a repeated frame
+
+
+def frame_luma(frame):
+    """Full-resolution luma of a BGR frame"""
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+
+class StaticFrameDetector:
+    """Decide per frame whether it repeats the last emitted frame"""
+
+    def __init__(self, mean_threshold=STATIC_MEAN_DIFF, max_threshold=STATIC_MAX_DIFF):
+        self.mean_threshold = mean_threshold
+        self.max_threshold = max_threshold
+        self.reference = None  # luma of the last emitted frame
+        self.repeats = 0
+
+    def is_repeat(self, luma):
+        """Return True if the frame with this frame_luma() can be replaced by a repeat marker
+
+        The first frame seen is never a repeat, so every chunk (one detector
+        per chunk) starts with a real frame.
+        """
+        if self.reference is not None:
+            diff = cv2.absdiff(luma, self.reference)
+            # The mean rejects most changed frames before the full max scan
+            if cv2.mean(diff)[0] <= self.mean_threshold and diff.max() <= self.max_threshold:
+                self.repeats += 1
+                return True
+        self.reference = luma
+        return False
+
+
+def reference_frame(frames, frame_index):
+    """Data a repeat marker at frame_index stands for: the last real frame before it
+
+    Needed when a client starts mid-chunk on a repeat marker and has never
+    received the frame it repeats. Frame 0 of a chunk is always real.
+    """
+    while frame_index > 0 and not len(frames[frame_index]):
+        frame_index -= 1
+    return frames[frame_index]
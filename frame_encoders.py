@@ -0,0 +1,123 @@
+"""
+Pluggable JPEG frame encoders
+Servers and the chunk preprocessor encode through a JpegEncoder instead of
+calling cv2.imencode directly, so the backend can be chosen per server.
+The TurboJPEG backend (PyTurboJPEG + libjpeg-turbo) is optional and falls
+back to OpenCV when the library is not installed.
+"""
+
+from abc import ABC, abstractmethod
+
+import cv2
+
+try:
+    import turbojpeg
+except ImportError:
+    turbojpeg = None
+
+DEFAULT_ENCODER = 'opencv'
+
+
+class JpegEncoder(ABC):
+    """Encode BGR frames to JPEG
+
+    encode() accepts any uint8 HxWx3 NumPy array, including row-strided views
+    such as a rung of the ffmpeg ingest canvas, and returns a bytes-like
+    object (bytes or a 1-D uint8 array) that can be written or sent directly.
+    """
+
+    name = None
+
+    def __init__(self, **options):
+        self.options = options
+
+    @abstractmethod
+    def encode(self, frame, quality):
+        """JPEG bytes of frame at quality (0-100)"""
+
+    def settings(self):
+        """Backend name and options; encoded output depends on these"""
+        return {'encoder': self.name, **self.options}
+
+
+class OpenCVJpegEncoder(JpegEncoder):
+    """cv2.imencode backend (always available)"""
+
+    name = 'opencv'
+
+    def encode(self, frame, quality):
+        # imencode reads row-strided views in place, no copy is made
+        _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        return buffer
+
+
+class TurboJpegEncoder(JpegEncoder):
+    """libjpeg-turbo backend with optional fast DCT and configurable chroma subsampling"""
+
+    name = 'turbojpeg'
+
+    SUBSAMPLING = {
+        '444': 'TJSAMP_444',
+        '422': 'TJSAMP_422',
+        '420': 'TJSAMP_420',
+        'gray': 'TJSAMP_GRAY',
+    }
+
+    def __init__(self, fast_dct=True, subsampling='420'):
+        if subsampling not in self.SUBSAMPLING:
+            raise ValueError(f"Unknown chroma subsampling: {subsampling} (use one of {', '.join(self.SUBSAMPLING)})")
+        super().__init__(fast_dct=fast_dct, subsampling=subsampling)
+        if turbojpeg is None:
+            raise RuntimeError("PyTurboJPEG is not installed")
+        self.jpeg = turbojpeg.TurboJPEG()  # raises RuntimeError if libturbojpeg is missing
+        self.jpeg_subsample = getattr(turbojpeg, self.SUBSAMPLING[subsampling])
+        self.flags = turbojpeg.TJFLAG_FASTDCT if fast_dct else 0
+
+    def encode(self, frame, quality):
+        # Contiguous frames are handed to libjpeg-turbo as-is; PyTurboJPEG copies
+        # row-strided views into a contiguous buffer first
+        return self.jpeg.encode(frame, quality=quality, jpeg_subsample=self.jpeg_subsample, flags=self.flags)
+
+
+ENCODERS = {
+    'opencv': OpenCVJpegEncoder,
+    'turbojpeg': TurboJpegEncoder,
+}
+
+
+def create_encoder(name=DEFAULT_ENCODER, fallback=True, **options):
+    """Create an encoder by name, falling back to OpenCV if the backend is unavailable"""
+    if name not in ENCODERS:
+        raise ValueError(f"Unknown JPEG encoder: {name} (use one of {', '.join(ENCODERS)})")
+
+    try:
+        return ENCODERS[name](**options)
+    except RuntimeError as e:
+        if not fallback:
+            raise
+        print(f"⚠️  {name} encoder unavailable ({e}), falling back to OpenCV")
+        return OpenCVJpegEncoder()
+
+
+def available_encoders():
+    """Names of the encoder backends that can be created on this machine"""
+    names = []
+    for name, encoder_class in ENCODERS.items():
+        try:
+            encoder_class()
+        except RuntimeError:
+            continue
+        names.append(name)
+    return names
+
+
+_worker_encoders = {}
+
+
+def worker_encoder(settings):
+    """Per-process encoder cache for pool workers, keyed by settings()"""
+    key = tuple(sorted(settings.items()))
+    if key not in _worker_encoders:
+        options = dict(settings)
+        _worker_encoders[key] = create_encoder(options.pop('encoder'), **options)
+    return _worker_encoders[key]
@@ -1,3 +1,4 @@
+import queue
 import socket
 import threading
 import time
@@ -8,6 +9,20 @@ import numpy as np
 from collections import deque
 import statistics
 from config import INITIAL_RESOLUTION, SERVER_IP, CLIENT_IP
+from chunk_protocol import PROTOCOL_V1, PROTOCOL_V2, SUPPORTED_PROTOCOLS, nack_bitmap, probe_size, unpack_v2
+from fragment_fec import recover
+from resolution_ladder import parse_variant, variant_name
+from video_segments import SegmentDecoder
+
+FRAME_TIMEOUT = 0.5  # seconds after its first fragment that an incomplete frame is given up as lost
+MTU_PROBE_WAIT = 0.5  # seconds to collect path-MTU probes after the server has sent them
+RECEIVE_BUFFER_BYTES = 4 * 1024 * 1024  # a large frame arrives as a burst of hundreds of MTU-sized packets
+COMPLETED_FRAME_MEMORY = 256  # recently completed frames whose late fragments (e.g. unneeded parity) are ignored
+NACK_DELAY = 0.005  # seconds without packets after which the last frame's burst is over and its gaps are NACKed
+NACK_RETRY_INTERVAL = 0.02  # seconds before fragments still missing are NACKed again
+MAX_NACK_ROUNDS = 2  # NACKs per frame at most
+CONTROL_REPLY_TIMEOUT = 5.0  # seconds to wait for the server to answer a control request
+CONTROL_REPLIES = ('registration_ack', 'resolution_ack', 'status', 'manifest', 'mtu_probe_sent')
 
 class ChunkNetworkMonitor:
     def __init__(self, window_size=100, throughput_window_seconds=1.0):
@@ -32,6 +47,12 @@ class ChunkNetworkMonitor:
         self.last_chunk_id = -1
         self.chunk_switches = 0
         
+        # Frame-level loss: a frame missing any one fragment is lost, so it runs higher than fragment loss
+        self.frame_results = deque(maxlen=window_size)  # True per completed frame, False per frame given up
+        self.frame_loss_rate = 0.0
+        self.frames_completed = 0
+        self.frames_lost = 0
+        
     def add_packet(self, sequence_num, timestamp, packet_size, chunk_id, frame_index):
         """Add packet information for analysis"""
         current_time = time.time()
@@ -42,7 +63,8 @@ class ChunkNetworkMonitor:
         self.packet_times.append(current_time)
         self.packet_sizes.append(packet_size)
         self.sequence_numbers.append(sequence_num)
-        self.latencies.append(latency)
+        if sequence_num > self.last_sequence:
+            self.latencies.append(latency)  # a resent packet keeps its first send time
         self.chunk_info.append((chunk_id, frame_index))
         
         # Track chunk switches
@@ -59,9 +81,19 @@ class ChunkNetworkMonitor:
                 self.lost_packets += lost
                 print(f"📦 Packet loss detected: {lost} packets lost")
         
-        self.last_sequence = sequence_num
+        # Resent (or reordered) packets arrive behind the newest one and were already counted as lost
+        self.last_sequence = max(self.last_sequence, sequence_num)
         self.update_metrics()
     
+    def add_frame(self, complete):
+        """Record a frame that was reassembled (True) or given up with fragments missing (False)"""
+        self.frame_results.append(complete)
+        if complete:
+            self.frames_completed += 1
+        else:
+            self.frames_lost += 1
+        self.frame_loss_rate = self.frame_results.count(False) / len(self.frame_results) * 100
+    
     def update_metrics(self):
         """Update network performance metrics"""
         if len(self.packet_times) < 2:
@@ -111,7 +143,8 @@ class ChunkNetworkMonitor:
         return {
             'latency': self.average_latency,
             'jitter': self.jitter,
-            'packet_loss': self.packet_loss_rate,
+            'packet_loss': self.packet_loss_rate,  # per fragment (datagram)
+            'frame_loss': self.frame_loss_rate,    # frames with at least one fragment missing
             'throughput': self.throughput,
             'chunk_switches': self.chunk_switches
         }
@@ -153,13 +186,74 @@ class ChunkResolutionEngine:
             }
         }
         
+        # Real chunk costs from the server manifest replace the table above once known
+        self.source_fps = 30             # frame rate the bitrates were measured at
+        self.send_fps = 30               # frame rate the server sends at
+        self.rendition_bitrates = {}     # {resolution: {'avg_bitrate', 'peak_bitrate'}} in bits/sec
+        self.chunk_bitrates = {}         # {resolution: [avg_bitrate per chunk]} in bits/sec
+        self.current_chunk = None
+        self.frame_rate_divisors = [1]   # frame-rate variants offered by the server (1 = full rate)
+        # Ladder offered by the server, smallest first; rungs above the source are left out
+        self.resolutions = ['240p', '360p', '480p', '720p', '1080p']
+        self.resolution_sizes = {
+            '240p': (426, 240), '360p': (640, 360), '480p': (854, 480), '720p': (1280, 720), '1080p': (1920, 1080)
+        }
+        self.throughput_low_margin = 0.8    # receiving less than this share of the chunk's rate = falling behind
+        self.throughput_high_margin = 0.95  # receiving this share = the full rendition gets through
+        
         self.last_adaptation_time = 0
         self.adaptation_cooldown = 7.0  # seconds
         self.last_trigger = "None"  # Track what triggered the last resolution change
     
-    def should_adapt_resolution(self, metrics):
+    def set_rendition_bitrates(self, bitrates, source_fps, send_fps):
+        """Use the per-resolution bitrate summary from the registration ack"""
+        self.rendition_bitrates = bitrates
+        self.source_fps = source_fps or self.source_fps
+        self.send_fps = send_fps or self.send_fps
+    
+    def set_ladder(self, resolutions):
+        """Use the ladder from the registration ack, {resolution: [width, height]} smallest first"""
+        self.resolutions = list(resolutions)
+        self.resolution_sizes = {resolution: tuple(size) for resolution, size in resolutions.items()}
+        if parse_variant(self.current_resolution)[0] not in self.resolution_sizes:
+            self.current_resolution = self.resolutions[-1]
+    
+    def set_chunk_costs(self, manifest):
+        """Use the per-chunk bitrates from the server manifest"""
+        self.source_fps = manifest.get('fps') or self.source_fps
+        self.chunk_bitrates = {
+            resolution: costs['avg_bitrate'] for resolution, costs in manifest['renditions'].items()
+        }
+    
+    def expected_throughput(self, resolution, chunk_id=None):
+        """Bytes/sec the server sends for a resolution (and chunk if known), or None without a manifest"""
+        chunk_bitrates = self.chunk_bitrates.get(resolution, [])
+        if chunk_id is not None and 0 <= chunk_id < len(chunk_bitrates):
+            bitrate = chunk_bitrates[chunk_id]
+        elif resolution in self.rendition_bitrates:
+            bitrate = self.rendition_bitrates[resolution]['avg_bitrate']
+        else:
+            return None
+        # Bitrates are measured at the rendition's own frame rate, the server paces frames at send_fps
+        return bitrate / 8 * self.send_fps / self.source_fps
+    
+    def get_thresholds(self, resolution, chunk_id=None):
+        """Throughput thresholds for a resolution, from real chunk costs when available"""
+        expected = self.expected_throughput(resolution, chunk_id)
+        if expected is None:
+            return self.resolution_throughput_thresholds.get(
+                resolution,
+                self.resolution_throughput_thresholds[INITIAL_RESOLUTION]  # fallback
+            )
+        return {
+            'throughput_low': expected * self.throughput_low_margin,
+            'throughput_high': expected * self.throughput_high_margin
+        }
+    
+    def should_adapt_resolution(self, metrics, chunk_id=None):
         """Determine if resolution should be changed for chunk streaming with adaptive thresholds"""
         current_time = time.time()
+        self.current_chunk = chunk_id
         
         # Prevent too frequent adaptations
         if current_time - self.last_adaptation_time < self.adaptation_cooldown:
@@ -171,10 +265,7 @@ class ChunkResolutionEngine:
         throughput = metrics.get('throughput', 0)
         
         # Get adaptive thresholds for current resolution
-        current_thresholds = self.resolution_throughput_thresholds.get(
-            self.current_resolution, 
-            self.resolution_throughput_thresholds[INITIAL_RESOLUTION]  # fallback
-        )
+        current_thresholds = self.get_thresholds(self.current_resolution, chunk_id)
         
         new_resolution = self.current_resolution
         trigger_reason = "None"
@@ -205,32 +296,32 @@ class ChunkResolutionEngine:
             elif throughput_poor:
                 trigger_reason = "Low Throughput"
             
-            # Network conditions are poor, decrease resolution
-            if self.current_resolution == '1080p':
-                new_resolution = '720p'
-            elif self.current_resolution == '720p':
-                new_resolution = '480p'
-            elif self.current_resolution == '480p':
-                new_resolution = '360p'
-            elif self.current_resolution == '360p':
-                new_resolution = '240p'
+            resolution, divisor = parse_variant(self.current_resolution)
+            rung = self.resolutions.index(resolution)
+            lower_rates = [d for d in self.frame_rate_divisors if d > divisor]
+            if lower_rates:
+                # Network conditions are poor, reduce frame rate before resolution
+                new_resolution = variant_name(resolution, min(lower_rates))
+            elif rung > 0:
+                # Network conditions are poor, decrease resolution
+                new_resolution = variant_name(self.resolutions[rung - 1], divisor)
             
         elif good_network_conditions:
             trigger_reason = "Good Network"
             
-            # Network conditions are good, increase resolution
-            if self.current_resolution == '240p':
-                new_resolution = '360p'
-            elif self.current_resolution == '360p':
-                new_resolution = '480p'
-            elif self.current_resolution == '480p':
-                new_resolution = '720p'
-            elif self.current_resolution == '720p':
-                new_resolution = '1080p'
+            resolution, divisor = parse_variant(self.current_resolution)
+            rung = self.resolutions.index(resolution)
+            higher_rates = [d for d in self.frame_rate_divisors if d < divisor]
+            if higher_rates:
+                # Network conditions are good, restore frame rate before resolution
+                new_resolution = variant_name(resolution, max(higher_rates))
+            elif rung < len(self.resolutions) - 1:
+                # Network conditions are good, increase resolution (never past the top rung the server has)
+                new_resolution = self.resolutions[rung + 1]
         
         if new_resolution != self.current_resolution:
             old_thresholds = current_thresholds
-            new_thresholds = self.resolution_throughput_thresholds.get(new_resolution, {})
+            new_thresholds = self.get_thresholds(new_resolution, chunk_id)
             
             print(f"🎯 Adaptive resolution change: {self.current_resolution} → {new_resolution}")
             print(f"📊 Current Metrics: Latency={latency:.1f}ms, Jitter={jitter:.1f}ms, "
@@ -240,6 +331,8 @@ class ChunkResolutionEngine:
             print(f"🔧 New thresholds: Low={new_thresholds.get('throughput_low', 0)/1000:.0f}KB/s, "
                   f"High={new_thresholds.get('throughput_high', 0)/1000:.0f}KB/s")
             
+            self.report_bandwidth_change(self.current_resolution, new_resolution, chunk_id)
+            
             # Store the trigger reason
             self.last_trigger = trigger_reason
             
@@ -255,22 +348,32 @@ class ChunkResolutionEngine:
         
         return self.current_resolution
     
+    def report_bandwidth_change(self, old_resolution, new_resolution, chunk_id=None):
+        """Print how much bandwidth a rendition change saves (or costs), when chunk costs are known"""
+        old_rate = self.expected_throughput(old_resolution, chunk_id)
+        new_rate = self.expected_throughput(new_resolution, chunk_id)
+        if not old_rate or new_rate is None:
+            return
+        old_fps = self.send_fps / parse_variant(old_resolution)[1]
+        new_fps = self.send_fps / parse_variant(new_resolution)[1]
+        change = "saves" if new_rate <= old_rate else "costs"
+        print(f"💾 {old_resolution} ({old_fps:.0f}fps) → {new_resolution} ({new_fps:.0f}fps) {change} "
+              f"{abs(old_rate - new_rate)/1000:.1f}KB/s ({abs(old_rate - new_rate) / old_rate * 100:.0f}%)")
+    
     def get_current_thresholds(self):
         """Get the current adaptive thresholds for the active resolution"""
-        return self.resolution_throughput_thresholds.get(
-            self.current_resolution, 
-            self.resolution_throughput_thresholds[INITIAL_RESOLUTION]  # fallback
-        )
+        return self.get_thresholds(self.current_resolution, self.current_chunk)
     
     def get_last_trigger(self):
         """Get the last trigger reason for resolution change"""
         return self.last_trigger
 
 class ChunkBasedClient:
-    def __init__(self, server_host=SERVER_IP, video_port=8890, control_port=8889):
+    def __init__(self, server_host=SERVER_IP, video_port=8890, control_port=8889, title=None):
         self.server_host = server_host
         self.video_port = video_port
         self.control_port = control_port
+        self.title = title  # catalog title to watch, None = the server's default
         
         # Components
         self.network_monitor = ChunkNetworkMonitor()
@@ -278,7 +381,11 @@ class ChunkBasedClient:
         
         # Sockets
         self.video_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.video_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_BYTES)
         self.control_socket = None
+        # Only the control reader thread reads the control socket; it hands each reply to its requester
+        self.control_replies = {reply_type: queue.Queue() for reply_type in CONTROL_REPLIES}
+        self.request_locks = {reply_type: threading.Lock() for reply_type in CONTROL_REPLIES}
         
         # State
         self.is_running = False
@@ -286,12 +393,42 @@ class ChunkBasedClient:
         self.current_chunk = 0
         self.total_chunks = 0
         self.chunk_duration = 2.0  # Updated to match server's 2-second chunks
+        self.available_chunks = 0  # Chunks the server has finished encoding
+        self.codec = 'jpeg'  # Chunk format advertised by the server
+        self.protocol = PROTOCOL_V1  # packet wire format negotiated at registration
+        self.rendition_names = {}  # {rendition id: name} for v2 packets
+        self.clock_offset = 0.0  # server wall-clock time minus its monotonic clock, for v2 timestamps
+        self.segment_decoder = None  # Decoder for h264/hevc segment chunks
+        self.last_frame = None  # Last decoded frame, shown again for repeat markers
+        self.pending_switch = None  # (resolution or None, chunk_id or None, request time) until the first frame arrives
+        self.repeat_frames = 0
         
         # Chunk tracking
         self.received_frames = {}  # {chunk_id: [frames]}
         self.chunk_complete = set()  # Set of completed chunk IDs
-        self.frame_fragments = {}  # {(chunk_id, frame_index): {fragment_index: data}}
-        self.frame_fragment_counts = {}  # {(chunk_id, frame_index): total_fragments}
+        self.frame_fragments = {}  # {(resolution, chunk_id, frame_index): {fragment_index: data}}, oldest first
+        self.frame_fragment_counts = {}  # {(resolution, chunk_id, frame_index): total_fragments}
+        self.frame_started = {}  # {(resolution, chunk_id, frame_index): arrival time of its first fragment}
+        # Each send of a frame is told apart by its base sequence (the sequence of fragment 0), so a
+        # frame sent again after a seek or loop is not mistaken for stragglers of the last send
+        self.frame_sequences = {}  # {(resolution, chunk_id, frame_index): base sequence being reassembled}
+        self.completed_frames = {}  # {frame key: base sequence} of recently completed frames, oldest first
+        self.fec_recovered_fragments = 0  # data fragments rebuilt from parity
+        self.fec_recovered_frames = 0  # frames that could only be completed thanks to FEC
+        self.fec_frames = set()  # incomplete frames with at least one fragment rebuilt from parity
+        self.packet_size = None  # datagram size the server sends, from the path-MTU probe
+        
+        # Selective retransmission: missing fragments are NACKed while the frame can still be shown,
+        # which is until a newer frame is on screen
+        self.retransmit = False  # the server resends NACKed fragments
+        self.playout_sequence = -1  # base sequence of the newest frame shown
+        self.frame_nacks = {}  # {frame key: {'requested', 'rounds', 'sent_at', 'first_at'}} of incomplete frames
+        self.nack_messages = 0
+        self.fragments_nacked = 0
+        self.fragments_retransmitted = 0  # NACKed fragments that arrived
+        self.retransmit_recovered_frames = 0  # frames completed by resent fragments in time to be shown
+        self.retransmit_late_frames = 0  # frames completed by resent fragments after a newer frame was shown
+        self.retransmit_recovery_times = deque(maxlen=100)  # seconds from a frame's first NACK to its completion
         
         print(f"🎬 Chunk-based client initialized for server {server_host}:{video_port}")
         print(f"🌐 Client IP configured as: {CLIENT_IP}")
@@ -307,14 +444,57 @@ class ChunkBasedClient:
             self.control_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.control_socket.connect((self.server_host, self.control_port))
             print(f"🔗 Connected to control server at {self.server_host}:{self.control_port}")
+            control_thread = threading.Thread(target=self.read_control_replies)
+            control_thread.daemon = True
+            control_thread.start()
             
-            # Wait for registration acknowledgment
-            response = self.control_socket.recv(1024).decode()
-            ack = json.loads(response)
-            if ack['type'] == 'registration_ack' and ack['status'] == 'success':
+            # Pick a title, then wait for registration acknowledgment
+            register = {'type': 'register', 'title': self.title, 'protocols': list(SUPPORTED_PROTOCOLS),
+                        'nack': True, 'repeat_markers': True, 'timestamp': time.time()}
+            ack = self.request_reply(register, 'registration_ack')
+            if ack is None:
+                print("❌ No registration acknowledgment from server")
+                return False
+            if ack['status'] != 'success':
+                print(f"❌ Registration failed: {ack.get('message')}")
+                if ack.get('titles'):
+                    print(f"📚 Available titles: {', '.join(ack['titles'])}")
+                return False
+            if ack['status'] == 'success':
+                self.title = ack.get('title', self.title)
+                if self.title:
+                    print(f"🎞️  Watching '{self.title}'")
                 self.total_chunks = ack['total_chunks']
                 self.chunk_duration = ack['chunk_duration']
-                print(f"✅ Registered! Total chunks: {self.total_chunks}, Duration: {self.chunk_duration}s each")
+                self.available_chunks = ack.get('available_chunks', self.total_chunks)
+                self.codec = ack.get('codec', 'jpeg')
+                self.protocol = ack.get('protocol', PROTOCOL_V1)
+                self.rendition_names = {rendition_id: rendition for rendition, rendition_id in ack.get('rendition_ids', {}).items()}
+                self.clock_offset = ack.get('clock_offset', 0.0)
+                self.retransmit = ack.get('retransmit', False)
+                if self.codec != 'jpeg':
+                    try:
+                        self.segment_decoder = SegmentDecoder(self.codec)
+                    except (RuntimeError, ValueError) as e:
+                        print(f"❌ Cannot decode {self.codec} chunks: {e}")
+                        return False
+                self.adaptation_engine.set_rendition_bitrates(ack.get('bitrates', {}), ack.get('fps'), ack.get('send_fps'))
+                self.adaptation_engine.frame_rate_divisors = ack.get('frame_rate_divisors', [1])
+                if ack.get('resolutions'):
+                    self.adaptation_engine.current_resolution = ack.get('resolution', self.current_resolution)
+                    self.adaptation_engine.set_ladder(ack['resolutions'])
+                    self.current_resolution = self.adaptation_engine.current_resolution
+                    print(f"🪜 Server ladder: {', '.join(self.adaptation_engine.resolutions)}")
+                print(f"✅ Registered! Total chunks: {self.total_chunks}, Duration: {self.chunk_duration}s each, Codec: {self.codec}, Protocol: v{self.protocol}")
+                if not ack.get('preprocessing_complete', True):
+                    print(f"⏳ Server is still encoding: {self.available_chunks}/{self.total_chunks} chunks available")
+                if 'packet_size' in ack:
+                    self.probe_path_mtu()
+                if self.retransmit:
+                    # Wake up when a frame's burst is over to NACK its gaps
+                    self.video_socket.settimeout(NACK_DELAY)
+                if ack.get('bitrates'):
+                    self.send_manifest_request()
                 return True
             
             return False
@@ -323,6 +503,90 @@ class ChunkBasedClient:
             print(f"❌ Error connecting to server: {e}")
             return False
     
+    def read_control_replies(self):
+        """Read the server's control replies and hand each to the thread waiting for it
+
+        This is the only thread that reads the control socket. Replies are
+        JSON objects sent back to back, except the manifest, which is
+        length-prefixed. The server's JSON is ASCII, so latin-1 decoding
+        keeps character and byte offsets equal.
+        """
+        decoder = json.JSONDecoder()
+        buffer = b''
+        while True:
+            try:
+                data = self.control_socket.recv(65536)
+            except OSError:
+                break
+            if not data:
+                break
+            buffer += data
+            while buffer:
+                if buffer[:1] == b'{':
+                    try:
+                        reply, end = decoder.raw_decode(buffer.decode('latin-1'))
+                    except json.JSONDecodeError:
+                        break  # the rest of the reply is still on its way
+                    buffer = buffer[end:]
+                else:
+                    if len(buffer) < 4:
+                        break
+                    manifest_size = struct.unpack('!I', buffer[:4])[0]
+                    if len(buffer) < 4 + manifest_size:
+                        break
+                    reply = json.loads(buffer[4:4 + manifest_size].decode())
+                    buffer = buffer[4 + manifest_size:]
+                replies = self.control_replies.get(reply.get('type'))
+                if replies is not None:
+                    replies.put(reply)
+        # Wake up any thread still waiting for a reply
+        for replies in self.control_replies.values():
+            replies.put(None)
+    
+    def request_reply(self, message, reply_type, timeout=CONTROL_REPLY_TIMEOUT):
+        """Send a control request and wait for its reply, None if the server did not answer in time"""
+        replies = self.control_replies[reply_type]
+        with self.request_locks[reply_type]:
+            # Drop replies to earlier requests whose caller gave up waiting
+            while not replies.empty():
+                replies.get_nowait()
+            self.control_socket.send(json.dumps(message).encode())
+            try:
+                return replies.get(timeout=timeout)
+            except queue.Empty:
+                return None
+    
+    def probe_path_mtu(self):
+        """Have the server send path-MTU probes and report the largest that arrived
+
+        The server then fragments frames to that size, so no datagram depends
+        on IP fragmentation. Video packets arriving meanwhile are dropped.
+        """
+        try:
+            reply = self.request_reply({'type': 'mtu_probe_request', 'timestamp': time.time()}, 'mtu_probe_sent')
+            if reply is None:
+                raise ConnectionError("no reply to the MTU probe request")
+            largest = None
+            timeout = self.video_socket.gettimeout()
+            deadline = time.time() + MTU_PROBE_WAIT
+            try:
+                while reply.get('probes') and time.time() < deadline:
+                    self.video_socket.settimeout(max(0.01, deadline - time.time()))
+                    try:
+                        data, _ = self.video_socket.recvfrom(65536)
+                    except socket.timeout:
+                        break
+                    size = probe_size(data)
+                    if size is not None:
+                        largest = max(largest or 0, size)
+            finally:
+                self.video_socket.settimeout(timeout)
+            self.packet_size = largest
+            self.control_socket.send(json.dumps({'type': 'mtu_report', 'packet_size': largest}).encode())
+            print(f"📏 Path MTU probe: largest datagram received {largest or 'none'} bytes")
+        except Exception as e:
+            print(f"❌ Error probing path MTU: {e}")
+    
     def send_resolution_request(self, resolution):
         """Send resolution change request to server"""
         if self.control_socket:
@@ -332,12 +596,11 @@ class ChunkBasedClient:
                     'resolution': resolution,
                     'timestamp': time.time()
                 }
-                self.control_socket.send(json.dumps(message).encode())
+                self.pending_switch = (resolution, None, time.time())
                 
                 # Wait for acknowledgment
-                response = self.control_socket.recv(1024).decode()
-                ack = json.loads(response)
-                if ack['type'] == 'resolution_ack':
+                ack = self.request_reply(message, 'resolution_ack')
+                if ack is not None:
                     print(f"🎯 Resolution change acknowledged: {ack['resolution']}")
                     return True
                     
@@ -346,54 +609,279 @@ class ChunkBasedClient:
         
         return False
     
-    def send_chunk_request(self, chunk_id):
-        """Request specific chunk from server"""
+    def send_chunk_request(self, chunk_id, frame_index=0):
+        """Request specific chunk from server, starting at a source frame within it"""
         if self.control_socket:
             try:
                 message = {
                     'type': 'chunk_request',
                     'chunk_id': chunk_id,
+                    'frame_index': frame_index,
                     'timestamp': time.time()
                 }
+                self.pending_switch = (None, chunk_id, time.time())
                 self.control_socket.send(json.dumps(message).encode())
                 return True
             except Exception as e:
                 print(f"❌ Error sending chunk request: {e}")
         return False
     
-    def reassemble_frame(self, chunk_id, frame_index, fragment_data, total_fragments, fragment_index):
-        """Reassemble fragmented frame data"""
-        frame_key = (chunk_id, frame_index)
+    def send_loss_report(self):
+        """Report cumulative fragment counts so the server can size FEC parity to the measured loss"""
+        if self.control_socket:
+            try:
+                monitor = self.network_monitor
+                message = {
+                    'type': 'loss_report',
+                    'packets': monitor.total_packets,
+                    'lost': monitor.lost_packets,
+                    'fec_recovered': self.fec_recovered_frames,
+                    'unrecoverable': monitor.frames_lost,
+                    'timestamp': time.time()
+                }
+                self.control_socket.send(json.dumps(message).encode())
+                return True
+            except Exception as e:
+                print(f"❌ Error sending loss report: {e}")
+        return False
+    
+    def send_nacks(self):
+        """NACK the missing data fragments of frames whose packets have stopped arriving
+
+        Called once a frame's burst is over: when the socket goes quiet or the
+        next frame starts. Frames a newer frame has replaced on screen are not
+        worth resending. Parity is never asked for, resent data is enough.
+        """
+        if not self.retransmit or not self.control_socket:
+            return False
+        now = time.time()
+        entries = []
+        for frame_key, fragments in self.frame_fragments.items():
+            base_sequence = self.frame_sequences[frame_key]
+            if base_sequence is None or base_sequence < self.playout_sequence:
+                continue
+            nack = self.frame_nacks.get(frame_key)
+            if nack and (nack['rounds'] >= MAX_NACK_ROUNDS or now - nack['sent_at'] < NACK_RETRY_INTERVAL):
+                continue
+            missing = [i for i in range(self.frame_fragment_counts[frame_key]) if i not in fragments]
+            if not missing:
+                continue
+            if nack is None:
+                nack = self.frame_nacks[frame_key] = {'requested': set(), 'rounds': 0, 'first_at': now}
+            nack['requested'].update(missing)
+            nack['rounds'] += 1
+            nack['sent_at'] = now
+            self.fragments_nacked += len(missing)
+            _, chunk_id, frame_index = frame_key
+            entries.append([chunk_id, frame_index, base_sequence, nack_bitmap(missing)])
+        if not entries:
+            return False
+        try:
+            self.control_socket.send(json.dumps({'type': 'nack', 'frames': entries}).encode())
+            self.nack_messages += 1
+            return True
+        except Exception as e:
+            print(f"❌ Error sending NACK: {e}")
+        return False
+    
+    def retransmit_stats(self):
+        """Client-side NACK and late-recovery counters"""
+        times = self.retransmit_recovery_times
+        return {
+            'nacks': self.nack_messages,
+            'fragments_nacked': self.fragments_nacked,
+            'fragments_retransmitted': self.fragments_retransmitted,
+            'frames_recovered': self.retransmit_recovered_frames,
+            'frames_late': self.retransmit_late_frames,
+            'avg_recovery_ms': sum(times) / len(times) * 1000 if times else None
+        }
+    
+    def send_status_request(self):
+        """Ask the server how far chunk preprocessing has progressed"""
+        if self.control_socket:
+            try:
+                message = {
+                    'type': 'status_request',
+                    'timestamp': time.time()
+                }
+                status = self.request_reply(message, 'status')
+                if status is not None:
+                    self.total_chunks = status['total_chunks']
+                    self.available_chunks = status['available_chunks']
+                    return status
+                    
+            except Exception as e:
+                print(f"❌ Error sending status request: {e}")
+        
+        return None
+    
+    def send_manifest_request(self):
+        """Fetch per-chunk sizes and bitrates so adaptation can use real chunk costs"""
+        if self.control_socket:
+            try:
+                message = {
+                    'type': 'manifest_request',
+                    'timestamp': time.time()
+                }
+                manifest = self.request_reply(message, 'manifest')
+                if manifest is not None:
+                    self.adaptation_engine.set_chunk_costs(manifest)
+                    print(f"📑 Chunk manifest: {manifest['available_chunks']} chunks")
+                    return manifest
+                    
+            except Exception as e:
+                print(f"❌ Error sending manifest request: {e}")
+        
+        return None
+    
+    def reassemble_frame(self, chunk_id, frame_index, fragment_data, total_fragments, fragment_index, resolution,
+                         fec_group_size=0, fec_parity=0, sequence_num=None):
+        """Reassemble fragmented frame data, rebuilding lost fragments from FEC parity when possible
+
+        Fragment indices from total_fragments on are parity fragments.
+        """
+        # Mid-chunk switches can send the same (chunk, frame) in two renditions
+        frame_key = (resolution, chunk_id, frame_index)
+        base_sequence = sequence_num - fragment_index if sequence_num is not None else None
+        if frame_key in self.completed_frames:
+            if self.completed_frames[frame_key] == base_sequence:
+                return None  # parity or a straggler for a frame already shown
+            del self.completed_frames[frame_key]
+        
+        if frame_key in self.frame_fragments and self.frame_sequences[frame_key] != base_sequence:
+            self.drop_incomplete_frame(frame_key)  # superseded by a new send, whose FEC layout may differ
         
         # Initialize fragment storage for this frame
         if frame_key not in self.frame_fragments:
+            if base_sequence is not None and base_sequence < self.playout_sequence:
+                return None  # a resend for a frame given up on, or already replaced on screen
+            self.expire_incomplete_frames()
+            self.send_nacks()  # the frames before this one have been sent in full
             self.frame_fragments[frame_key] = {}
             self.frame_fragment_counts[frame_key] = total_fragments
+            self.frame_started[frame_key] = time.time()
+            self.frame_sequences[frame_key] = base_sequence
         
         # Store fragment
-        self.frame_fragments[frame_key][fragment_index] = fragment_data
+        fragments = self.frame_fragments[frame_key]
+        nack = self.frame_nacks.get(frame_key)
+        if nack and fragment_index in nack['requested'] and fragment_index not in fragments:
+            self.fragments_retransmitted += 1
+        fragments[fragment_index] = fragment_data
+        if fec_parity and self.recover_fragments(fragments, total_fragments, fragment_index, fec_group_size, fec_parity):
+            self.fec_frames.add(frame_key)
         
         # Check if frame is complete
-        if len(self.frame_fragments[frame_key]) == total_fragments:
-            # Reassemble frame by concatenating fragments in order
-            complete_frame_data = b''
-            for i in range(total_fragments):
-                if i in self.frame_fragments[frame_key]:
-                    complete_frame_data += self.frame_fragments[frame_key][i]
-                else:
-                    # Missing fragment, frame incomplete
-                    return None
+        if len(fragments) >= total_fragments:
+            # Reassemble frame by concatenating fragments in order (one join: MTU-sized frames have many fragments)
+            if any(i not in fragments for i in range(total_fragments)):
+                # Missing fragment, frame incomplete
+                return None
+            complete_frame_data = b''.join(fragments[i] for i in range(total_fragments))
             
             # Clean up fragment storage
             del self.frame_fragments[frame_key]
             del self.frame_fragment_counts[frame_key]
+            del self.frame_started[frame_key]
+            del self.frame_sequences[frame_key]
+            self.completed_frames[frame_key] = base_sequence
+            if len(self.completed_frames) > COMPLETED_FRAME_MEMORY:
+                del self.completed_frames[next(iter(self.completed_frames))]
+            if frame_key in self.fec_frames:
+                self.fec_frames.discard(frame_key)
+                self.fec_recovered_frames += 1
+            
+            # A frame completed after a newer one was shown is too late to show
+            late = base_sequence is not None and base_sequence < self.playout_sequence
+            nack = self.frame_nacks.pop(frame_key, None)
+            if nack and late:
+                self.retransmit_late_frames += 1
+            elif nack:
+                self.retransmit_recovered_frames += 1
+                self.retransmit_recovery_times.append(time.time() - nack['first_at'])
+            self.network_monitor.add_frame(not late)
+            if late:
+                return None
+            if base_sequence is not None:
+                self.playout_sequence = base_sequence
             
             return complete_frame_data
         
         return None  # Frame not yet complete
     
+    def recover_fragments(self, fragments, total_fragments, fragment_index, fec_group_size, fec_parity):
+        """Rebuild the lost data fragments of the FEC group fragment_index belongs to, once enough have arrived
+
+        Returns how many fragments were rebuilt.
+        """
+        if fragment_index < total_fragments:
+            group = fragment_index // fec_group_size
+        else:
+            group = (fragment_index - total_fragments) // fec_parity
+        first = group * fec_group_size
+        data_count = min(fec_group_size, total_fragments - first)
+        parity_first = total_fragments + group * fec_parity
+        
+        received = {row: fragments[first + row] for row in range(data_count) if first + row in fragments}
+        if len(received) == data_count:
+            return 0  # nothing lost in this group
+        for row in range(fec_parity):
+            if parity_first + row in fragments:
+                received[data_count + row] = fragments[parity_first + row]
+        
+        recovered = recover(data_count, fec_parity, received) or {}
+        for row, fragment in recovered.items():
+            fragments[first + row] = fragment
+        self.fec_recovered_fragments += len(recovered)
+        return len(recovered)
+    
+    def expire_incomplete_frames(self):
+        """Give up frames still missing fragments FRAME_TIMEOUT after their first one arrived"""
+        cutoff = time.time() - FRAME_TIMEOUT
+        for frame_key, started in list(self.frame_started.items()):
+            if started > cutoff:
+                break  # later frames started later
+            self.drop_incomplete_frame(frame_key)
+    
+    def drop_incomplete_frame(self, frame_key):
+        """Give up a frame that is missing fragments and count it as lost"""
+        del self.frame_fragments[frame_key]
+        del self.frame_fragment_counts[frame_key]
+        del self.frame_started[frame_key]
+        del self.frame_sequences[frame_key]
+        self.fec_frames.discard(frame_key)
+        self.frame_nacks.pop(frame_key, None)
+        self.network_monitor.add_frame(False)
+    
+    def check_switch_latency(self, resolution, chunk_id, frame_index):
+        """Report how long a rendition switch or seek took once its first frame arrives"""
+        if self.pending_switch is None:
+            return
+        target_resolution, target_chunk, requested_at = self.pending_switch
+        if target_resolution not in (None, resolution) or target_chunk not in (None, chunk_id):
+            return
+        self.pending_switch = None
+        print(f"⏱️  {resolution} chunk {chunk_id} frame {frame_index} arrived "
+              f"{(time.time() - requested_at) * 1000:.0f} ms after the request")
+    
+    def decode_frame(self, chunk_id, frame_index, frame_data):
+        """Decode a reassembled frame (JPEG or segment access unit) to a BGR image"""
+        if not frame_data:
+            # Repeat marker: the server detected a static frame
+            self.repeat_frames += 1
+            return self.last_frame
+        if self.segment_decoder is not None:
+            frame = self.segment_decoder.decode(chunk_id, frame_index, frame_data)
+        else:
+            frame = cv2.imdecode(np.frombuffer(frame_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is not None:
+            self.last_frame = frame
+        return frame
+    
     def parse_chunk_packet(self, data):
         """Parse incoming chunk packet with fragmentation support"""
+        if self.protocol == PROTOCOL_V2:
+            return self.parse_chunk_packet_v2(data)
         try:
             offset = 0
             
@@ -428,19 +916,41 @@ class ChunkBasedClient:
             # Extract fragment data
             fragment_data = data[offset:offset+fragment_size]
             
-            return sequence_num, timestamp, chunk_id, frame_index, resolution, fragment_data, total_fragments, fragment_index
+            return (sequence_num, timestamp, chunk_id, frame_index, resolution, fragment_data, total_fragments, fragment_index,
+                    0, 0)  # v1 packets carry no FEC
             
         except Exception as e:
             print(f"❌ Error parsing chunk packet: {e}")
-            return None, None, None, None, None, None, None, None
+            return None, None, None, None, None, None, None, None, None, None
+    
+    def parse_chunk_packet_v2(self, data):
+        """Parse a v2 chunk packet: one fixed-layout header, decoded in a single unpack"""
+        try:
+            (rendition_id, sequence_num, timestamp_ns, chunk_id, frame_index,
+             total_fragments, fragment_index, fragment_data, fec_group_size, fec_parity) = unpack_v2(data)
+            resolution = self.rendition_names.get(rendition_id, str(rendition_id))
+            timestamp = timestamp_ns / 1e9 + self.clock_offset  # server wall-clock time, as in v1
+            return (sequence_num, timestamp, chunk_id, frame_index, resolution, fragment_data, total_fragments, fragment_index,
+                    fec_group_size, fec_parity)
+        
+        except Exception as e:
+            print(f"❌ Error parsing chunk packet: {e}")
+            return None, None, None, None, None, None, None, None, None, None
     
     def handle_terminal_input(self):
         """Handle terminal input for manual control"""
-        available_resolutions = ['240p', '360p', '480p', '720p', '1080p']
+        available_resolutions = list(self.adaptation_engine.resolutions)
+        # Frame-rate variants, e.g. 360p@d2 for 360p at half the frame rate
+        available_resolutions += [variant_name(r, d) for d in self.adaptation_engine.frame_rate_divisors[1:]
+                                  for r in available_resolutions]
         
         print("\n🎮 Manual Control Commands:")
-        print("  - Type resolution: 240p, 360p, 480p, 720p, 1080p")
-        print("  - Type 'chunk X' to jump to chunk X")
+        print(f"  - Type resolution: {', '.join(self.adaptation_engine.resolutions)}")
+        if len(self.adaptation_engine.frame_rate_divisors) > 1:
+            divisors = ', '.join(f"@d{d}" for d in self.adaptation_engine.frame_rate_divisors[1:])
+            print(f"  - Add {divisors} for 1/N frame rate (e.g. 360p@d2)")
+        print("  - Type 'chunk X [F]' to jump to chunk X (at frame F)")
+        print("  - Type 'seek S' to jump to S seconds")
         print("  - Type 'status' for current metrics")
         print("  - Type 'help' for this help")
         print("  - Type 'quit' to stop")
@@ -456,16 +966,47 @@ class ChunkBasedClient:
                     break
                 elif command == 'help':
                     print(f"📋 Available resolutions: {', '.join(available_resolutions)}")
-                    print("📦 Commands: chunk X, status, help, quit")
+                    print("📦 Commands: chunk X [F], seek S, status, help, quit")
                 elif command == 'status':
                     metrics = self.network_monitor.get_metrics()
                     current_thresholds = self.adaptation_engine.get_current_thresholds()
                     print(f"📊 Current Status:")
                     print(f"   Resolution: {self.current_resolution}")
                     print(f"   Current Chunk: {self.current_chunk}/{self.total_chunks}")
+                    manifest_chunks = self.available_chunks
+                    server_status = self.send_status_request()
+                    if server_status and not server_status['preprocessing_complete']:
+                        print(f"   Encoded Chunks: {self.available_chunks}/{self.total_chunks}")
+                        progress = server_status.get('progress')
+                        if progress:
+                            eta = f"{progress['eta']:.0f}s" if progress['eta'] is not None else "unknown"
+                            print(f"   Encoding: {progress['frames_done']}/{progress['frames_total']} frames, "
+                                  f"{progress['frames_per_sec']:.1f} frames/sec, ETA {eta}")
+                    if server_status and server_status.get('switch_latency'):
+                        latency = server_status['switch_latency']
+                        print(f"   Switch Latency: {latency['avg_ms']:.0f}ms avg, {latency['max_ms']:.0f}ms max "
+                              f"over {latency['count']} switches (server side)")
+                    if self.available_chunks > manifest_chunks:
+                        self.send_manifest_request()  # pick up the costs of newly encoded chunks
                     print(f"   Latency: {metrics['latency']:.1f}ms")
                     print(f"   Jitter: {metrics['jitter']:.1f}ms")
-                    print(f"   Loss: {metrics['packet_loss']:.1f}%")
+                    print(f"   Loss: {metrics['packet_loss']:.1f}% of fragments, {metrics['frame_loss']:.1f}% of frames")
+                    if self.packet_size:
+                        print(f"   Packet size: {self.packet_size} bytes (path MTU probe)")
+                    print(f"   FEC: {self.fec_recovered_fragments} fragments recovered, "
+                          f"{self.fec_recovered_frames} frames saved, {self.network_monitor.frames_lost} frames unrecoverable")
+                    if self.retransmit:
+                        retransmit = self.retransmit_stats()
+                        recovery = (f", {retransmit['avg_recovery_ms']:.0f}ms avg"
+                                    if retransmit['avg_recovery_ms'] is not None else "")
+                        print(f"   Retransmit: {retransmit['fragments_nacked']} fragments NACKed in {retransmit['nacks']} NACKs, "
+                              f"{retransmit['fragments_retransmitted']} resent fragments arrived")
+                        print(f"   Late Recovery: {retransmit['frames_recovered']} frames recovered in time{recovery}, "
+                              f"{retransmit['frames_late']} completed too late to show")
+                    if server_status and server_status.get('retransmit'):
+                        resent = server_status['retransmit']
+                        print(f"   Server Resent: {resent['resent']}/{resent['requested']} fragments "
+                              f"({resent['expired']} past deadline, {resent['evicted']} no longer buffered)")
                     print(f"   Throughput: {metrics['throughput']/1000:.1f} KB/s")
                     print(f"   Chunk Switches: {metrics['chunk_switches']}")
                     print(f"🎯 Adaptive Thresholds for {self.current_resolution}:")
@@ -473,14 +1014,28 @@ class ChunkBasedClient:
                     print(f"   Upgrade Threshold: {current_thresholds['throughput_high']/1000:.0f} KB/s")
                 elif command.startswith('chunk '):
                     try:
-                        chunk_num = int(command.split()[1])
+                        parts = command.split()
+                        chunk_num = int(parts[1])
+                        frame_num = int(parts[2]) if len(parts) > 2 else 0
                         if 0 <= chunk_num < self.total_chunks:
-                            print(f"📦 Requesting jump to chunk {chunk_num}")
-                            self.send_chunk_request(chunk_num)
+                            print(f"📦 Requesting jump to chunk {chunk_num} frame {frame_num}")
+                            self.send_chunk_request(chunk_num, frame_num)
                         else:
                             print(f"❌ Invalid chunk number. Range: 0-{self.total_chunks-1}")
                     except ValueError:
                         print("❌ Invalid chunk number format")
+                elif command.startswith('seek '):
+                    try:
+                        seconds = float(command.split()[1])
+                        chunk_num = int(seconds // self.chunk_duration)
+                        frame_num = int((seconds - chunk_num * self.chunk_duration) * self.adaptation_engine.source_fps)
+                        if 0 <= chunk_num < self.total_chunks:
+                            print(f"⏩ Seeking to {seconds:.2f}s (chunk {chunk_num} frame {frame_num})")
+                            self.send_chunk_request(chunk_num, frame_num)
+                        else:
+                            print(f"❌ Invalid position. Range: 0-{self.total_chunks * self.chunk_duration:.0f}s")
+                    except ValueError:
+                        print("❌ Invalid seek position format")
                 elif command in [r.lower() for r in available_resolutions]:
                     resolution = next(r for r in available_resolutions if r.lower() == command)
                     print(f"🎯 Requesting resolution change to {resolution}...")
@@ -528,9 +1083,10 @@ class ChunkBasedClient:
                 
                 # Get current network metrics
                 metrics = self.network_monitor.get_metrics()
+                self.send_loss_report()
                 
                 # Check if resolution should be adapted
-                new_resolution = self.adaptation_engine.should_adapt_resolution(metrics)
+                new_resolution = self.adaptation_engine.should_adapt_resolution(metrics, self.current_chunk)
                 
                 if new_resolution != self.current_resolution:
                     print(f"🔄 Auto-adapting resolution: {self.current_resolution} → {new_resolution}")
@@ -555,21 +1111,31 @@ class ChunkBasedClient:
         
         while self.is_running:
             try:
-                data, addr = self.video_socket.recvfrom(65536)
+                try:
+                    data, addr = self.video_socket.recvfrom(65536)
+                except socket.timeout:
+                    self.send_nacks()  # the last frame's burst is over
+                    continue
                 
                 # Parse chunk packet (now with fragmentation support)
                 result = self.parse_chunk_packet(data)
-                if len(result) == 8:  # Fragmented packet
-                    seq_num, timestamp, chunk_id, frame_index, resolution, fragment_data, total_fragments, fragment_index = result
+                if len(result) == 10:  # Fragmented packet
+                    (seq_num, timestamp, chunk_id, frame_index, resolution, fragment_data, total_fragments, fragment_index,
+                     fec_group_size, fec_parity) = result
                     
                     if fragment_data is not None:
                         # Update network monitoring with fragment info
                         self.network_monitor.add_packet(seq_num, timestamp, len(data), chunk_id, frame_index)
                         
-                        # Try to reassemble the complete frame
-                        complete_frame_data = self.reassemble_frame(
-                            chunk_id, frame_index, fragment_data, total_fragments, fragment_index
-                        )
+                        # Try to reassemble the complete frame (a repeat marker has no fragments)
+                        if total_fragments == 0:
+                            complete_frame_data = b''
+                            self.playout_sequence = max(self.playout_sequence, seq_num)
+                        else:
+                            complete_frame_data = self.reassemble_frame(
+                                chunk_id, frame_index, fragment_data, total_fragments, fragment_index, resolution,
+                                fec_group_size, fec_parity, seq_num
+                            )
                         
                         if complete_frame_data is not None:
                             # Frame is complete, process it
@@ -581,9 +1147,10 @@ class ChunkBasedClient:
                             
                             self.received_frames[chunk_id][frame_index] = complete_frame_data
                             self.current_chunk = chunk_id
+                            self.check_switch_latency(resolution, chunk_id, frame_index)
                             
                             # Decode and display frame
-                            frame = cv2.imdecode(np.frombuffer(complete_frame_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+                            frame = self.decode_frame(chunk_id, frame_index, complete_frame_data)
                             
                             if frame is not None:
                                 # Always upscale to display size
@@ -617,15 +1184,9 @@ class ChunkBasedClient:
         metrics = self.network_monitor.get_metrics()
         current_thresholds = self.adaptation_engine.get_current_thresholds()
         
-        # Resolution dimensions
-        resolution_map = {
-            '240p': '426x240',
-            '360p': '640x360',
-            '480p': '854x480',
-            '720p': '1280x720',
-            '1080p': '1920x1080'
-        }
-        stream_resolution = resolution_map.get(resolution, 'unknown')
+        # Resolution dimensions (capped rungs are smaller than their name suggests)
+        size = self.adaptation_engine.resolution_sizes.get(parse_variant(resolution)[0])
+        stream_resolution = f"{size[0]}x{size[1]}" if size else 'unknown'
         
         y_offset = 30
         
@@ -668,7 +1229,7 @@ class ChunkBasedClient:
                    (10, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
         y_offset += 20
         
-        cv2.putText(frame, f"Loss: {metrics['packet_loss']:.1f}%", 
+        cv2.putText(frame, f"Loss: {metrics['packet_loss']:.1f}% frag, {metrics['frame_loss']:.1f}% frame", 
                    (10, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
         y_offset += 20
         
@@ -726,7 +1287,8 @@ def main():
     print(f"🌐 Connecting to server: {SERVER_IP}")
     print(f"🖥️  Client IP configured as: {CLIENT_IP}")
     
-    client = ChunkBasedClient()
+    title = input("🎞️  Title to watch (Enter for the server default): ").strip() or None
+    client = ChunkBasedClient(title=title)
     try:
         client.start_streaming()
     except KeyboardInterrupt:
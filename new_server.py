@@ -1,21 +1,78 @@
 import socket
 import threading
 import time
-import cv2
 import json
 import struct
 import os
-import shutil
 from typing import Dict, List, Tuple
-import numpy as np
+from collections import deque
+from chunk_cache import DEFAULT_CACHE_MB, ChunkCache, ChunkPrefetcher
+from chunk_protocol import (DEFAULT_PACKET_SIZE, PROTOCOL_V1, PROTOCOL_V2, clock_offset,
+                            nack_indices, negotiate, pack_frame_v2, probe_packets, probe_socket, rendition_ids,
+                            reported_packet_size, send_packet, stamp_v2)
+from chunk_preprocessor import ChunkPreprocessor
+from fragment_fec import FEC_GROUP_SIZE, parity_count
+from frame_dedup import reference_frame
+from resolution_ladder import ladder_order, parse_variant, variant_name
+from retransmit_buffer import RETRANSMIT_RING_PACKETS, RetransmitBuffer
+from video_catalog import VideoCatalog
 from config import INITIAL_RESOLUTION, SERVER_IP
 
+REGISTRATION_TIMEOUT = 0.3  # seconds to wait for a register message; older clients send none and wait this long for their ack
+LOSS_SMOOTHING = 0.3  # weight of the latest loss report in a client's smoothed fragment loss
+MAX_PENDING_MESSAGE = 8192  # an undecodable control message longer than this is an error, not a partial read
+
+
+def decode_messages(text):
+    """JSON control messages in text, plus the incomplete message at its end (if any)
+
+    The control connection is a byte stream, so messages sent back to back
+    can arrive together or split across reads.
+    """
+    decoder = json.JSONDecoder()
+    messages = []
+    position = 0
+    while True:
+        while position < len(text) and text[position].isspace():
+            position += 1
+        if position == len(text):
+            return messages, ''
+        try:
+            message, position = decoder.raw_decode(text, position)
+        except json.JSONDecodeError:
+            if len(text) - position > MAX_PENDING_MESSAGE:
+                raise
+            return messages, text[position:]
+        messages.append(message)
+
+
+class PacketizedChunk:
+    """A chunk with every frame already cut into v2 packets, see ChunkBasedVideoServer.packetize_chunk
+
+    Only v2 clients are sent these; v1 clients always get packets built per send.
+    """
+
+    def __init__(self, frames, packets, packet_size):
+        self.frames = frames      # frame data: the packets' payloads, and needed for repeat-marker lookups
+        self.packets = packets    # per frame: (header, payload) packets, sequence/timestamp stamped into the header at send time
+        self.packet_size = packet_size  # datagram size of the packets; clients on another path MTU get per-send packets
+        # Payloads are views of the frames, so only the headers add to the frames' size
+        self.nbytes = (sum(len(frame) for frame in frames)
+                       + sum(len(header) for frame_packets in packets for header, _ in frame_packets))
+
+
 class ChunkBasedVideoServer:
-    def __init__(self, host=SERVER_IP, video_port=8888, control_port=8889, video_file_path=None):
+    def __init__(self, host=SERVER_IP, video_port=8888, control_port=8889, video_file_path=None, preprocess_workers=None, progressive=False,
+                 preprocess_memory_mb=None, ingest_backend='opencv', encoder='opencv', encoder_options=None,
+                 chunk_format='jpeg', target_bitrates=None, frame_rate_divisors=(1,), dedup_static=False,
+                 chunk_cache_mb=DEFAULT_CACHE_MB, prefetch_depth=2, prepacketize=False, catalog_dir=None, storage_dir=None,
+                 packet_size=DEFAULT_PACKET_SIZE, fec=True, retransmit=True, retransmit_packets=RETRANSMIT_RING_PACKETS,
+                 registration_timeout=REGISTRATION_TIMEOUT):
         self.host = host
         self.video_port = video_port
         self.control_port = control_port
         self.video_file_path = video_file_path
+        self.catalog_dir = catalog_dir  # serve every video in this directory instead of a single file
         
         # Video settings for different resolutions
         self.resolutions = {
@@ -28,148 +85,203 @@ class ChunkBasedVideoServer:
         
         # Chunk settings
         self.chunk_duration = 2.0  # seconds per chunk (smaller chunks for better control)
-        self.chunks_storage = {}   # {resolution: [chunk_files]}
-        self.chunk_metadata = {}   # {chunk_id: {duration, frame_count, etc}}
-        self.total_chunks = 0
-        self.original_fps = 30
+        self.frame_rate = 30  # frames sent per second to each client
+        self.preprocess_workers = preprocess_workers  # None = one worker per CPU core
+        self.progressive = progressive  # serve chunks while later chunks are still encoding
+        self.preprocess_memory_mb = preprocess_memory_mb  # memory ceiling for preprocessing (None = unlimited)
+        self.ingest_backend = ingest_backend  # 'opencv', 'ffmpeg' (single-pass decode+scale) or 'auto'
+        self.encoder = encoder  # JPEG backend: 'opencv' or 'turbojpeg'
+        self.encoder_options = encoder_options  # e.g. {'fast_dct': True, 'subsampling': '420'} for turbojpeg
+        self.chunk_format = chunk_format  # 'jpeg' (MJPEG chunks), 'h264' or 'hevc' (closed-GOP segments)
+        self.target_bitrates = target_bitrates  # {resolution: bits/sec} to rate-control JPEG quality, None = fixed quality
+        self.frame_rate_divisors = frame_rate_divisors  # e.g. (1, 2, 3) adds '360p@d2' and '360p@d3' renditions
+        self.dedup_static = dedup_static  # send static frames as header-only repeat markers to clients that handle them
+        self.initial_resolution = INITIAL_RESOLUTION  # lowered per title when its source is smaller than this rung
+        
+        # Titles: a catalog directory, or the single video file as a catalog of one
+        if catalog_dir:
+            self.catalog = VideoCatalog.from_directory(catalog_dir, self.preprocess_video)
+            self.default_title = None  # clients must pick a title when registering
+        else:
+            title_name = os.path.splitext(os.path.basename(video_file_path or ''))[0]
+            self.catalog = VideoCatalog({title_name: video_file_path}, self.preprocess_video)
+            self.default_title = title_name
+        # Stores are keyed by content, so every title can share one storage directory
+        self.storage_dir = storage_dir or (os.path.join(catalog_dir, 'video_chunks') if catalog_dir else 'video_chunks')
+        self.encode_lock = threading.Lock()  # titles encode one at a time, each already uses every core
+        self.chunk_cache = ChunkCache(chunk_cache_mb * 1024 * 1024)  # shared by every client and title, LRU over the byte budget
+        self.prefetcher = ChunkPrefetcher(self.chunk_cache, self.read_ahead_chunk, prefetch_depth)  # 0 = no read-ahead
+        self.prepacketize = prepacketize  # cache chunks as pre-built packets, only sequence/timestamp patched per send
+        self.send_buffer = None  # reused by the streaming loop for v2 packets
+        self.packet_size = packet_size  # largest datagram sent; a client's path-MTU probe can lower it
+        self.fec = fec  # parity fragments for v2 clients, sized to the loss each one reports
+        self.retransmit = retransmit  # resend fragments v2 clients NACK, from a per-client ring of sent packets
+        self.retransmit_packets = retransmit_packets  # ring size per client
+        self.registration_timeout = registration_timeout  # raise on slow links where register messages arrive late
         
         # Client tracking
-        self.clients = {}  # {addr: {resolution, current_chunk}}
+        self.clients = {}  # {addr: {title, protocol, packet_size, fec_parity, sequence, retransmit_buffer, resolution, ...}}
+        self.clients_lock = threading.Lock()  # orders repositioning against end-of-chunk advances
+        self.switch_latencies = deque(maxlen=100)  # seconds from a seek/switch request to its first frame sent
         self.is_streaming = False
         
         # Socket setup
         self.video_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.probe_socket = probe_socket()  # path-MTU probes, sent with DF set
         self.control_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.control_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         
         print(f"Chunk-based server initialized on {host}:{video_port} (video) and {control_port} (control)")
     
-    def preprocess_video(self):
-        """Pre-process video into chunks at different resolutions"""
-        if not self.video_file_path or not os.path.exists(self.video_file_path):
+    def preprocess_video(self, title):
+        """Pre-process a title's video into chunks at different resolutions, or open its finished store"""
+        if not title.video_file_path or not os.path.exists(title.video_file_path):
             print("Error: No valid video file provided")
             return False
         
-        print(f"📁 Pre-processing video: {os.path.basename(self.video_file_path)}")
+        print(f"📁 Pre-processing video: {os.path.basename(title.video_file_path)}")
         print(f"⏱️  Using 2-second chunks for better streaming control")
         
-        # Create storage directory
-        storage_dir = "video_chunks"
-        if os.path.exists(storage_dir):
-            shutil.rmtree(storage_dir)
-        os.makedirs(storage_dir)
-        
-        # Open video file
-        cap = cv2.VideoCapture(self.video_file_path)
-        if not cap.isOpened():
-            print("Error: Could not open video file")
+        # Fan (chunk_id, resolution) encode jobs out to a process pool
+        preprocessor = ChunkPreprocessor(
+            title.video_file_path,
+            self.resolutions,
+            chunk_duration=self.chunk_duration,
+            storage_dir=self.storage_dir,
+            max_workers=self.preprocess_workers,
+            memory_limit_mb=self.preprocess_memory_mb,
+            ingest_backend=self.ingest_backend,
+            encoder=self.encoder,
+            encoder_options=self.encoder_options,
+            chunk_format=self.chunk_format,
+            target_bitrates=self.target_bitrates,
+            frame_rate_divisors=self.frame_rate_divisors,
+            dedup_static=self.dedup_static
+        )
+        if not preprocessor.prepare():
             return False
+        title.preprocessor = preprocessor  # chunk lists and metadata are filled in as chunks complete
+        title.chunk_format = preprocessor.chunk_format  # may have fallen back to jpeg
+        title.original_fps = preprocessor.original_fps
         
-        # Get video properties
-        self.original_fps = cap.get(cv2.CAP_PROP_FPS)
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        duration = total_frames / self.original_fps
-        
-        print(f"  Original FPS: {self.original_fps:.2f}")
-        print(f"  Total frames: {total_frames}")
-        print(f"  Duration: {duration:.2f} seconds")
-        
-        # Calculate chunk parameters
-        frames_per_chunk = int(self.original_fps * self.chunk_duration)
-        self.total_chunks = int(np.ceil(total_frames / frames_per_chunk))
-        
-        print(f"  Frames per chunk: {frames_per_chunk}")
-        print(f"  Total chunks: {self.total_chunks}")
-        print()
-        
-        # Initialize storage for each resolution
-        for resolution in self.resolutions.keys():
-            self.chunks_storage[resolution] = []
-            res_dir = os.path.join(storage_dir, resolution)
-            os.makedirs(res_dir)
+        # Only rungs up to the source resolution exist
+        title.resolutions = preprocessor.resolutions
+        title.rendition_ids = rendition_ids(preprocessor.renditions)  # v2 packets carry these instead of names
+        title.initial_resolution = self.initial_resolution
+        if title.initial_resolution not in title.resolutions:
+            title.initial_resolution = ladder_order(title.resolutions)[0]
+            print(f"  Clients start at {title.initial_resolution}, the source is below {self.initial_resolution}")
         
-        # Process chunks
-        for chunk_id in range(self.total_chunks):
-            print(f"🔄 Processing chunk {chunk_id + 1}/{self.total_chunks}")
-            
-            # Read frames for this chunk
-            chunk_frames = []
-            for frame_idx in range(frames_per_chunk):
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                chunk_frames.append(frame)
-            
-            if not chunk_frames:
-                break
-            
-            # Store metadata
-            self.chunk_metadata[chunk_id] = {
-                'frame_count': len(chunk_frames),
-                'duration': len(chunk_frames) / self.original_fps
-            }
-            
-            # Process chunk for each resolution
-            for resolution, (width, height, quality) in self.resolutions.items():
-                chunk_file = os.path.join(storage_dir, resolution, f"chunk_{chunk_id:04d}.bin")
-                
-                # Resize and encode frames
-                encoded_frames = []
-                for frame in chunk_frames:
-                    # Resize frame
-                    resized_frame = cv2.resize(frame, (width, height))
-                    
-                    # Encode frame as JPEG
-                    encode_params = [cv2.IMWRITE_JPEG_QUALITY, quality]
-                    _, buffer = cv2.imencode('.jpg', resized_frame, encode_params)
-                    encoded_frames.append(buffer.tobytes())
-                
-                # Save chunk to file
-                with open(chunk_file, 'wb') as f:
-                    # Write number of frames
-                    f.write(struct.pack('!I', len(encoded_frames)))
-                    
-                    # Write each frame with its size
-                    for frame_data in encoded_frames:
-                        f.write(struct.pack('!I', len(frame_data)))
-                        f.write(frame_data)
-                
-                self.chunks_storage[resolution].append(chunk_file)
-        
-        cap.release()
-        print(f"✅ Video preprocessing complete! Created {self.total_chunks} chunks for {len(self.resolutions)} resolutions")
+        if self.progressive:
+            print("🚀 Progressive mode: chunks are served as soon as all resolutions are encoded")
+            preprocess_thread = threading.Thread(target=self.finish_preprocessing, args=(title,))
+            preprocess_thread.daemon = True
+            preprocess_thread.start()
+        else:
+            self.finish_preprocessing(title)
         return True
     
-    def load_chunk(self, resolution, chunk_id):
-        """Load a specific chunk from storage"""
-        if resolution not in self.chunks_storage or chunk_id >= len(self.chunks_storage[resolution]):
+    def finish_preprocessing(self, title):
+        """Encode a title's remaining chunks and publish the final chunk count"""
+        with self.encode_lock:
+            title.preprocessor.encode()
+        print(f"✅ Video preprocessing complete! Created {title.total_chunks} chunks for {len(title.resolutions)} resolutions")
+    
+    def load_chunk(self, title, resolution, chunk_id):
+        """Load a specific chunk of a title from storage as a list of frames (zero-copy memoryviews)"""
+        chunks_storage = title.preprocessor.chunks_storage
+        if resolution not in chunks_storage or chunk_id >= len(chunks_storage[resolution]):
             return None
         
-        chunk_file = self.chunks_storage[resolution][chunk_id]
-        if not os.path.exists(chunk_file):
+        try:
+            # Clients on the same chunk share one load
+            return self.chunk_cache.get(
+                (title.name, resolution, chunk_id), lambda: title.preprocessor.load_chunk(resolution, chunk_id)
+            )
+        except Exception as e:
+            print(f"Error loading chunk {chunk_id} for {resolution}: {e}")
+            return None
+    
+    def load_chunk_packets(self, title, resolution, chunk_id):
+        """Load a chunk as a PacketizedChunk, built once and shared through the chunk cache"""
+        chunks_storage = title.preprocessor.chunks_storage
+        if resolution not in chunks_storage or chunk_id >= len(chunks_storage[resolution]):
             return None
         
-        frames = []
         try:
-            with open(chunk_file, 'rb') as f:
-                # Read number of frames
-                frame_count = struct.unpack('!I', f.read(4))[0]
-                
-                # Read each frame
-                for _ in range(frame_count):
-                    frame_size = struct.unpack('!I', f.read(4))[0]
-                    frame_data = f.read(frame_size)
-                    frames.append(frame_data)
-            
-            return frames
+            # Same key as load_chunk: a server caches either frame lists or PacketizedChunks, never both
+            return self.chunk_cache.get(
+                (title.name, resolution, chunk_id), lambda: self.packetize_chunk(title, resolution, chunk_id)
+            )
         except Exception as e:
             print(f"Error loading chunk {chunk_id} for {resolution}: {e}")
             return None
     
+    def packetize_chunk(self, title, resolution, chunk_id):
+        """Cut every frame of a chunk into v2 packets with all header fields but sequence/timestamp filled in"""
+        frames = title.preprocessor.load_chunk(resolution, chunk_id)
+        rendition_id = title.rendition_ids[resolution]
+        # Without a reusable buffer every frame gets its own, so the packets can be kept
+        packets = [
+            self.create_chunk_packets(chunk_id, frame_index, resolution, frame_data, 0, PROTOCOL_V2, rendition_id)
+            for frame_index, frame_data in enumerate(frames)
+        ]
+        return PacketizedChunk(frames, packets, self.packet_size)
+    
+    def registration_ack(self, title, protocol, retransmit, registered):
+        """The acknowledgment of a new control connection
+
+        Clients that send no register message read the ack with a single
+        recv(1024), so they get the original four fields only.
+        """
+        ack = {
+            'type': 'registration_ack',
+            'status': 'success',
+            'total_chunks': title.total_chunks,
+            'chunk_duration': self.chunk_duration
+        }
+        if not registered:
+            return ack
+        preprocessor = title.preprocessor
+        ack.update({
+            'title': title.name,
+            'titles': self.catalog.names(),
+            'available_chunks': preprocessor.available_chunks,
+            'preprocessing_complete': preprocessor.is_complete,
+            'codec': title.chunk_format,
+            'fps': title.original_fps,
+            'send_fps': self.frame_rate,
+            'frame_rate_divisors': list(preprocessor.frame_rate_divisors),
+            # The actual ladder, smallest first: rungs above the source are not offered
+            'resolutions': {resolution: list(title.resolutions[resolution][:2])
+                            for resolution in reversed(ladder_order(title.resolutions))},
+            'resolution': title.initial_resolution,
+            'bitrates': preprocessor.bitrate_summary(),  # full per-chunk costs via manifest_request
+            'protocol': protocol,
+            'rendition_ids': title.rendition_ids,  # v2 packets name renditions by id
+            'clock_offset': clock_offset(),  # v2 timestamps are monotonic, add this for wall-clock time
+            'packet_size': self.packet_size,
+            'retransmit': retransmit  # lost fragments can be NACKed
+        })
+        return ack
+    
+    def read_ahead_chunk(self, title_name, resolution, chunk_id):
+        """Loader for the prefetcher: chunks that are not encoded yet are skipped"""
+        title = self.catalog.titles[title_name]
+        preprocessor = title.preprocessor
+        if resolution not in preprocessor.chunks_storage or chunk_id >= preprocessor.available_chunks:
+            return None
+        if self.prepacketize:
+            return self.packetize_chunk(title, resolution, chunk_id)
+        return preprocessor.load_chunk(resolution, chunk_id)
+    
     def start_server(self):
         """Start the chunk-based streaming server"""
-        # Pre-process video into chunks
-        if not self.preprocess_video():
+        if self.catalog_dir:
+            # Titles are opened (and encoded if needed) when a client first asks for them
+            print(f"📚 Catalog of {len(self.catalog.titles)} titles in {self.catalog_dir}: {', '.join(self.catalog.names())}")
+        elif not self.catalog.get(self.default_title):
+            # Pre-process video into chunks
             return
         
         try:
@@ -179,6 +291,7 @@ class ChunkBasedVideoServer:
             print(f"🎮 Control server listening on {self.host}:{self.control_port}")
             
             self.is_streaming = True
+            self.prefetcher.start()
             
             # Start control message handler
             control_thread = threading.Thread(target=self.handle_control_connections)
@@ -210,52 +323,153 @@ class ChunkBasedVideoServer:
     def handle_client_control(self, client_socket, addr):
         """Handle control messages from a specific client"""
         try:
+            # Clients name a title and their protocol versions in a register message;
+            # older clients send nothing and get the default title over v1
+            title_name = self.default_title
+            registered = False
+            protocol = PROTOCOL_V1
+            nack = False
+            repeat_markers = False  # clients that do not say they handle repeat markers get the frame repeated
+            client_socket.settimeout(self.registration_timeout)
+            try:
+                data = client_socket.recv(1024)
+                if not data:
+                    return
+                message = json.loads(data.decode())
+                if message.get('type') == 'register':
+                    registered = True
+                    title_name = message.get('title') or self.default_title
+                    protocol = negotiate(message.get('protocols'))
+                    nack = bool(message.get('nack'))
+                    repeat_markers = bool(message.get('repeat_markers'))
+            except socket.timeout:
+                pass
+            client_socket.settimeout(None)
+            
+            title = self.catalog.get(title_name) if title_name is not None else None
+            if title is None:
+                error = {
+                    'type': 'registration_ack',
+                    'status': 'error',
+                    'message': f"Unknown or unavailable title: {title_name}" if title_name else "No title requested",
+                    'titles': self.catalog.names()
+                }
+                client_socket.send(json.dumps(error).encode())
+                print(f"❌ Client {addr} asked for unavailable title {title_name!r}")
+                return
+            preprocessor = title.preprocessor
+            retransmit = self.retransmit and nack and protocol == PROTOCOL_V2
+            
             # Register client with default settings
             self.clients[addr] = {
-                'resolution': INITIAL_RESOLUTION,
+                'title': title,
+                'protocol': protocol,
+                'packet_size': self.packet_size,  # until a path-MTU probe says otherwise
+                'fec_parity': 0,       # parity fragments per FEC group, raised when the client reports loss
+                'loss': 0.0,           # smoothed fragment loss from loss reports (0-1)
+                'loss_counters': (0, 0),  # (packets, lost) at the last loss report
+                'sequence': 0,         # per-client packet sequence, so clients see their own loss only
+                'retransmit_buffer': RetransmitBuffer(self.retransmit_packets) if retransmit else None,
+                'repeat_markers': repeat_markers,
+                'resolution': title.initial_resolution,
                 'current_chunk': 0,
+                'start_frame': 0,      # source frame within current_chunk to start at
+                'position': (0, 0),    # (chunk_id, source frame) of the next frame to send
+                'restart': 0,          # bumped to interrupt the chunk being sent
                 'socket': client_socket
             }
             
-            print(f"📱 Client {addr} registered with default resolution: {INITIAL_RESOLUTION}")
+            print(f"📱 Client {addr} registered for '{title.name}' (protocol v{protocol}) "
+                  f"with default resolution: {title.initial_resolution}")
             
             # Send registration acknowledgment
-            ack = {
-                'type': 'registration_ack',
-                'status': 'success',
-                'total_chunks': self.total_chunks,
-                'chunk_duration': self.chunk_duration
-            }
+            ack = self.registration_ack(title, protocol, retransmit, registered)
             client_socket.send(json.dumps(ack).encode())
             
             # Handle control messages
+            pending = ''
             while self.is_streaming and addr in self.clients:
                 try:
                     data = client_socket.recv(1024)
                     if not data:
                         break
                         
-                    message = json.loads(data.decode())
-                    
-                    if message['type'] == 'resolution_request':
-                        new_resolution = message['resolution']
-                        if new_resolution in self.resolutions:
-                            self.clients[addr]['resolution'] = new_resolution
-                            print(f"🎯 Client {addr} changed resolution to {new_resolution}")
-                            
-                            # Send acknowledgment
-                            ack = {
-                                'type': 'resolution_ack',
-                                'resolution': new_resolution,
-                                'status': 'success'
+                    # Several messages can arrive in one read, or one message across two
+                    messages, pending = decode_messages(pending + data.decode())
+                    for message in messages:
+                        if message['type'] == 'resolution_request':
+                            # A (resolution, fps) pair: '360p' with fps_divisor 2, or the rendition name '360p@d2'
+                            new_resolution = variant_name(message['resolution'], message.get('fps_divisor', 1))
+                            if new_resolution in preprocessor.renditions:
+                                client_info = self.clients[addr]
+                                client_info['resolution'] = new_resolution
+                                if title.chunk_format == 'jpeg':
+                                    # Continue at the next frame in the new rendition instead of the next chunk
+                                    self.reposition(client_info, *client_info['position'])
+                                else:
+                                    # Segments can only be entered at a chunk's IDR frame
+                                    client_info['switch_request'] = (client_info['restart'], new_resolution, time.time())
+                                print(f"🎯 Client {addr} changed resolution to {new_resolution}")
+                                self.prefetcher.schedule((title.name, new_resolution), client_info['current_chunk'], title.total_chunks)
+                                
+                                # Send acknowledgment
+                                ack = {
+                                    'type': 'resolution_ack',
+                                    'resolution': new_resolution,
+                                    'status': 'success'
+                                }
+                                client_socket.send(json.dumps(ack).encode())
+                        
+                        elif message['type'] == 'chunk_request':
+                            # Seek to a chunk, optionally to a source frame within it
+                            chunk_id = message['chunk_id']
+                            frame_index = message.get('frame_index', 0)
+                            if 0 <= chunk_id < title.total_chunks and frame_index >= 0:
+                                self.reposition(self.clients[addr], chunk_id, frame_index)
+                                print(f"📦 Client {addr} requested chunk {chunk_id} frame {frame_index}")
+                        
+                        elif message['type'] == 'status_request':
+                            status = {
+                                'type': 'status',
+                                'title': title.name,
+                                'total_chunks': title.total_chunks,
+                                'available_chunks': preprocessor.available_chunks,
+                                'preprocessing_complete': preprocessor.is_complete,
+                                'progress': preprocessor.progress(),  # frames/sec, ETA, chunks per rendition
+                                'cache': self.chunk_cache.stats(),  # hit/miss/eviction counters, across all titles
+                                'open_titles': len(self.catalog.opened_titles()),
+                                'switch_latency': self.switch_latency_stats()
                             }
-                            client_socket.send(json.dumps(ack).encode())
-                    
-                    elif message['type'] == 'chunk_request':
-                        chunk_id = message['chunk_id']
-                        if 0 <= chunk_id < self.total_chunks:
-                            self.clients[addr]['current_chunk'] = chunk_id
-                            print(f"📦 Client {addr} requested chunk {chunk_id}")
+                            if self.clients[addr]['retransmit_buffer']:
+                                status['retransmit'] = self.clients[addr]['retransmit_buffer'].stats()
+                            client_socket.send(json.dumps(status).encode())
+                        
+                        elif message['type'] == 'manifest_request':
+                            # Per-chunk costs outgrow a single recv(), so the reply is length-prefixed
+                            manifest = json.dumps({'type': 'manifest', **preprocessor.chunk_costs()}).encode()
+                            client_socket.sendall(struct.pack('!I', len(manifest)) + manifest)
+                        
+                        elif message['type'] == 'mtu_probe_request':
+                            # Probes go to the video port; the client reports the largest that arrived
+                            sent = self.send_mtu_probes(addr)
+                            client_socket.send(json.dumps({'type': 'mtu_probe_sent', 'probes': sent}).encode())
+                        
+                        elif message['type'] == 'mtu_report':
+                            largest = message.get('packet_size')
+                            packet_size = reported_packet_size(largest, self.packet_size)
+                            self.clients[addr]['packet_size'] = packet_size
+                            print(f"📏 Client {addr} path MTU probe: {largest or 'no'} byte probes arrived, "
+                                  f"sending {packet_size} byte packets")
+                        
+                        elif message['type'] == 'loss_report':
+                            self.update_fec(addr, self.clients[addr], message)
+                        
+                        elif message['type'] == 'nack':
+                            self.resend_fragments(addr, self.clients[addr], message)
+                        
+                        elif message['type'] == 'catalog_request':
+                            catalog = {'type': 'catalog', 'titles': self.catalog.names()}
+                            client_socket.send(json.dumps(catalog).encode())
                             
                 except Exception as e:
                     print(f"Error handling control message from {addr}: {e}")
@@ -265,14 +479,122 @@ class ChunkBasedVideoServer:
             print(f"Error in client control handler for {addr}: {e}")
         finally:
             if addr in self.clients:
+                retransmit_buffer = self.clients[addr]['retransmit_buffer']
+                if retransmit_buffer and retransmit_buffer.requested:
+                    stats = retransmit_buffer.stats()
+                    print(f"🔁 Client {addr} NACKed {stats['requested']} fragments: {stats['resent']} resent, "
+                          f"{stats['expired']} past their deadline, {stats['evicted']} no longer buffered")
                 del self.clients[addr]
             client_socket.close()
             print(f"🔌 Client {addr} disconnected")
     
-    def create_chunk_packets(self, chunk_id, frame_index, resolution, frame_data, sequence_number):
-        """Create packets for chunk-based streaming with fragmentation support"""
-        max_packet_size = 60000  # Safe UDP packet size for Windows
+    def update_fec(self, addr, client_info, report):
+        """Fold a client's loss report into its smoothed loss and resize its FEC parity
+
+        Reports carry cumulative (packets, lost) counts; the loss since the
+        previous report is what gets smoothed.
+        """
+        packets, lost = report.get('packets', 0), report.get('lost', 0)
+        last_packets, last_lost = client_info['loss_counters']
+        client_info['loss_counters'] = (packets, lost)
+        if packets + lost <= last_packets + last_lost:
+            return
+        interval_loss = (lost - last_lost) / (packets + lost - last_packets - last_lost)
+        client_info['loss'] += LOSS_SMOOTHING * (interval_loss - client_info['loss'])
+        
+        if not self.fec or client_info['protocol'] != PROTOCOL_V2:
+            return
+        fec_parity = parity_count(client_info['loss'])
+        if fec_parity != client_info['fec_parity']:
+            client_info['fec_parity'] = fec_parity
+            print(f"🛡️  Client {addr} at {client_info['loss'] * 100:.1f}% fragment loss: "
+                  f"{fec_parity} parity per {FEC_GROUP_SIZE} fragments "
+                  f"(FEC recovered {report.get('fec_recovered', 0)}, unrecoverable {report.get('unrecoverable', 0)} frames)")
+    
+    def resend_fragments(self, addr, client_info, nack):
+        """Send the fragments a client NACKed again, as long as they can still arrive in time
+
+        NACK entries are [chunk id, frame index, base sequence, bitmap]. The
+        packets are resent unchanged, so they keep their sequence numbers.
+        """
+        retransmit_buffer = client_info['retransmit_buffer']
+        if retransmit_buffer is None:
+            return
+        for chunk_id, frame_index, base_sequence, bitmap in nack.get('frames', ()):
+            for fragment_index in nack_indices(bitmap):
+                packet = retransmit_buffer.lookup(base_sequence + fragment_index, chunk_id, frame_index)
+                if packet is None:
+                    continue
+                try:
+                    send_packet(self.video_socket, packet, (addr[0], self.video_port))
+                except Exception as e:
+                    print(f"Error resending packet to {addr}: {e}")
+    
+    def send_mtu_probes(self, addr):
+        """Send path-MTU probe datagrams to a client's video port, returns how many were sent
+
+        Probes larger than the local route allows fail with EMSGSIZE (DF is
+        set) and are skipped.
+        """
+        sent = 0
+        for probe in probe_packets(self.packet_size):
+            try:
+                self.probe_socket.sendto(probe, (addr[0], self.video_port))
+                sent += 1
+            except OSError:
+                pass
+        return sent
+    
+    def reposition(self, client_info, chunk_id, start_frame):
+        """Restart a client's stream at a source frame within a chunk
+
+        JPEG chunks can start at any frame. Segment chunks restart at frame 0,
+        the only IDR frame of the chunk.
+        """
+        if client_info['title'].chunk_format != 'jpeg':
+            start_frame = 0
+        with self.clients_lock:
+            client_info['current_chunk'] = chunk_id
+            client_info['start_frame'] = start_frame
+            client_info['restart'] += 1
+            # Latency is measured to the first frame sent for this (restart, resolution)
+            client_info['switch_request'] = (client_info['restart'], client_info['resolution'], time.time())
+    
+    def switch_latency_stats(self):
+        """Latency from seek/switch requests to the first frame sent at the new position, in ms"""
+        latencies = list(self.switch_latencies)
+        if not latencies:
+            return None
+        return {
+            'count': len(latencies),
+            'last_ms': round(latencies[-1] * 1000, 1),
+            'avg_ms': round(sum(latencies) / len(latencies) * 1000, 1),
+            'max_ms': round(max(latencies) * 1000, 1)
+        }
+    
+    def create_chunk_packets(self, chunk_id, frame_index, resolution, frame_data, sequence_number,
+                             protocol=PROTOCOL_V1, rendition_id=0, reuse_buffer=False, packet_size=None, fec_parity=0):
+        """Create packets for chunk-based streaming with fragmentation support
+
+        Frames are fragmented to packet_size (default: the server's) so no
+        datagram is IP-fragmented. Packets are (header, payload) pairs for
+        send_packet, the payload a view of frame_data. v2 headers are views
+        into one buffer per frame; with reuse_buffer the streaming loop's
+        send buffer is reused, so the packets are only valid until the next
+        call that reuses it. fec_parity adds that many v2 parity packets per
+        FEC_GROUP_SIZE data packets.
+        """
+        max_packet_size = packet_size or self.packet_size
+        if protocol == PROTOCOL_V2:
+            buffer, packets = pack_frame_v2(frame_data, rendition_id, sequence_number, chunk_id, frame_index,
+                                            max_packet_size, self.send_buffer if reuse_buffer else None,
+                                            FEC_GROUP_SIZE, fec_parity)
+            if reuse_buffer:
+                self.send_buffer = buffer
+            return packets
+        
         resolution_bytes = resolution.encode()
+        frame = memoryview(frame_data)
         
         # Calculate header size
         base_header_size = 4 + 8 + 4 + 4 + 1 + len(resolution_bytes) + 4 + 4 + 4  # Added fragment info
@@ -281,11 +603,12 @@ class ChunkBasedVideoServer:
         # Create packets with fragmentation
         packets = []
         total_fragments = (len(frame_data) + max_payload_size - 1) // max_payload_size
+        fragment_count = max(1, total_fragments)  # a repeat marker is one header-only packet, total_fragments = 0
         
-        for fragment_index in range(total_fragments):
+        for fragment_index in range(fragment_count):
             start_pos = fragment_index * max_payload_size
             end_pos = min(start_pos + max_payload_size, len(frame_data))
-            fragment_data = frame_data[start_pos:end_pos]
+            fragment_data = frame[start_pos:end_pos]
             
             # Create header with fragmentation info:
             # sequence(4) + timestamp(8) + chunk_id(4) + frame_index(4) + resolution_len(1) + resolution + 
@@ -300,17 +623,14 @@ class ChunkBasedVideoServer:
             header += struct.pack('!I', fragment_index)                 # current fragment index
             header += struct.pack('!I', len(fragment_data))             # fragment size
             
-            packet = header + fragment_data
-            packets.append(packet)
+            packets.append((header, fragment_data))  # sent with sendmsg, the payload is never copied
         
         return packets
     
     def stream_chunks(self):
         """Stream chunks to connected clients with improved chunk handling"""
         print("📡 Starting chunk streaming...")
-        sequence_number = 0
-        frame_rate = 30  # Target FPS
-        frame_duration = 1.0 / frame_rate
+        frame_duration = 1.0 / self.frame_rate
         
         while self.is_streaming:
             start_time = time.time()
@@ -318,39 +638,102 @@ class ChunkBasedVideoServer:
             try:
                 # Send frames to all connected clients
                 for addr, client_info in list(self.clients.items()):
-                    resolution = client_info['resolution']
-                    chunk_id = client_info['current_chunk']
+                    title = client_info['title']
+                    preprocessor = title.preprocessor
+                    protocol = client_info['protocol']
+                    packet_size = client_info['packet_size']
+                    fec_parity = client_info['fec_parity']
+                    with self.clients_lock:
+                        resolution = client_info['resolution']
+                        chunk_id = client_info['current_chunk']
+                        start_frame = client_info['start_frame']
+                        restart = client_info['restart']
                     
-                    # Load chunk frames
-                    frames = self.load_chunk(resolution, chunk_id)
+                    # Wait until every resolution of the chunk has been encoded
+                    if not preprocessor.wait_for_chunk(chunk_id, timeout=0.1):
+                        if preprocessor.is_complete:
+                            # Past the real end of the video, loop back to the beginning
+                            with self.clients_lock:
+                                client_info['current_chunk'] = 0
+                                client_info['start_frame'] = 0
+                        continue
+                    
+                    # Load chunk frames (with their packets pre-built when prepacketizing)
+                    if self.prepacketize:
+                        chunk = self.load_chunk_packets(title, resolution, chunk_id)
+                        frames = chunk.frames if chunk else None
+                    else:
+                        chunk = None
+                        frames = self.load_chunk(title, resolution, chunk_id)
+                    self.prefetcher.schedule((title.name, resolution), chunk_id, title.total_chunks)
+                    if chunk is not None and (protocol != PROTOCOL_V2 or (chunk.packet_size, fec_parity) != (packet_size, 0)):
+                        chunk = None  # v1 client, or pre-built for another path MTU or FEC level: build packets per send
+                    rendition_id = title.rendition_ids.get(resolution, 0)
+                    # Frame-rate variants hold every Nth frame, so each one is shown N times as long
+                    divisor = parse_variant(resolution)[1]
+                    variant_frame_duration = frame_duration * divisor
                     if frames:
-                        for frame_index, frame_data in enumerate(frames):
-                            if not self.is_streaming:
-                                break
+                        # First frame of this rendition at or after the requested source frame
+                        start_index = min(len(frames), -(-start_frame // divisor))
+                        for frame_index in range(start_index, len(frames)):
+                            if not self.is_streaming or client_info['restart'] != restart:
+                                break  # seek or rendition switch, start over at the new position
                             
-                            # Create packets for this frame
-                            packets = self.create_chunk_packets(
-                                chunk_id, frame_index, resolution, frame_data, sequence_number
-                            )
+                            frame_data = frames[frame_index]
+                            sequence_number = client_info['sequence']
+                            if not len(frame_data) and (frame_index == start_index or not client_info['repeat_markers']):
+                                # The client has not seen the frame this repeat marker stands for, or cannot
+                                # handle header-only markers
+                                packets = self.create_chunk_packets(
+                                    chunk_id, frame_index, resolution, reference_frame(frames, frame_index), sequence_number,
+                                    protocol, rendition_id, reuse_buffer=True, packet_size=packet_size, fec_parity=fec_parity
+                                )
+                            elif chunk is not None:
+                                # Only the sequence number and timestamp differ between sends
+                                packets = stamp_v2(chunk.packets[frame_index], sequence_number)
+                            else:
+                                # Create packets for this frame
+                                packets = self.create_chunk_packets(
+                                    chunk_id, frame_index, resolution, frame_data, sequence_number,
+                                    protocol, rendition_id, reuse_buffer=True, packet_size=packet_size, fec_parity=fec_parity
+                                )
                             
                             # Send all packets for this frame
                             for packet in packets:
                                 try:
-                                    self.video_socket.sendto(packet, (addr[0], self.video_port))
+                                    send_packet(self.video_socket, packet, (addr[0], self.video_port))
                                 except Exception as e:
                                     print(f"Error sending packet to {addr}: {e}")
                             
-                            sequence_number += len(packets)
+                            # Keep them for NACKs until the next frame replaces this one on screen
+                            retransmit_buffer = client_info['retransmit_buffer']
+                            if retransmit_buffer is not None:
+                                deadline = time.monotonic() + variant_frame_duration
+                                for fragment_index, packet in enumerate(packets):
+                                    retransmit_buffer.add(sequence_number + fragment_index, chunk_id, frame_index,
+                                                          packet, deadline)
+                            
+                            client_info['sequence'] = sequence_number + len(packets)
+                            client_info['position'] = (chunk_id, (frame_index + 1) * divisor)
+                            
+                            request = client_info.get('switch_request')
+                            if request and request[:2] == (restart, resolution):
+                                del client_info['switch_request']
+                                latency = time.time() - request[2]
+                                self.switch_latencies.append(latency)
+                                print(f"⏱️  Client {addr} at {resolution} chunk {chunk_id} frame {frame_index} "
+                                      f"{latency * 1000:.0f} ms after the request")
                             
                             # Frame timing
-                            time.sleep(frame_duration)
-                        
-                        # Auto-advance to next chunk
-                        if chunk_id + 1 < self.total_chunks:
-                            self.clients[addr]['current_chunk'] = chunk_id + 1
+                            time.sleep(variant_frame_duration)
                         else:
-                            # Loop back to beginning
-                            self.clients[addr]['current_chunk'] = 0
+                            # Auto-advance to next chunk (it may still be encoding), unless a seek came in
+                            with self.clients_lock:
+                                if client_info['restart'] == restart:
+                                    next_chunk = chunk_id + 1 if chunk_id + 1 < title.total_chunks else 0
+                                    client_info['current_chunk'] = next_chunk
+                                    client_info['start_frame'] = 0
+                                    client_info['position'] = (next_chunk, 0)
                 
                 # Maintain loop timing
                 elapsed = time.time() - start_time
@@ -370,12 +753,23 @@ class ChunkBasedVideoServer:
         
         if self.control_socket:
             self.control_socket.close()
+        self.probe_socket.close()
+        
+        self.prefetcher.stop()
+        cache = self.chunk_cache.stats()
+        print(f"🗃️  Chunk cache: {cache['hits']} hits, {cache['misses']} misses, {cache['coalesced']} coalesced, "
+              f"{cache['evictions']} evictions, {cache['size_bytes'] / 1024 / 1024:.1f}/"
+              f"{cache['budget_bytes'] / 1024 / 1024:.0f} MB")
+        print(f"💤 Streaming waited on chunk I/O {cache['io_waits']} times ({cache['io_wait_seconds'] * 1000:.0f} ms), "
+              f"{cache['prefetched']} chunks read ahead, {self.prefetcher.dropped} stale read-aheads dropped")
+        self.chunk_cache.clear()
+        self.catalog.close()
         
         print("🧹 Chunk server cleanup completed")
 
 def main():
-    # Get video file path
-    video_file = input("📁 Enter video file path: ").strip()
+    # Get video file path, or a directory of videos to serve as a catalog
+    video_file = input("📁 Enter video file or directory path: ").strip()
     if not video_file:
         print("❌ No video file provided")
         return
@@ -387,7 +781,10 @@ def main():
     print(f"🌐 Starting chunk-based server on IP: {SERVER_IP}")
     print("📱 Clients should connect from configured CLIENT_IP")
     
-    server = ChunkBasedVideoServer(video_file_path=video_file)
+    if os.path.isdir(video_file):
+        server = ChunkBasedVideoServer(catalog_dir=video_file, progressive=True)
+    else:
+        server = ChunkBasedVideoServer(video_file_path=video_file, progressive=True)
     try:
         server.start_server()
     except KeyboardInterrupt:
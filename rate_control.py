@@ -0,0 +1,96 @@
+"""
+JPEG rate control for chunk preprocessing
+Instead of a fixed quality per rung, each rendition of a chunk gets a byte
+budget derived from a target bitrate. Every frame is encoded at the highest
+quality that fits its share of what is left of the chunk budget, found by
+bisection around the previous frame's quality. Probe encodes are cached per
+frame, so the chosen quality is never encoded twice.
+"""
+
+MIN_QUALITY = 20
+MAX_QUALITY = 95
+SEARCH_WINDOW = 4  # initial quality step searched up or down from the previous frame's quality
+
+
+class QualityController:
+    """Pick a JPEG quality per frame so a chunk rendition meets its byte budget"""
+
+    def __init__(self, target_bitrate, fps, frame_count, initial_quality=75,
+                 min_quality=MIN_QUALITY, max_quality=MAX_QUALITY):
+        self.target_bitrate = target_bitrate
+        self.budget = target_bitrate / 8 * frame_count / fps  # bytes for the whole chunk
+        self.frames_left = frame_count
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.quality = max(min_quality, min(max_quality, initial_quality))
+
+        self.spent = 0
+        self.probes = 0
+        self.qualities = []
+        self.repeats = 0
+
+    def encode(self, encoder, frame):
+        """Encode one frame at the highest quality that fits its budget"""
+        # Frames that come in under budget leave more for the rest of the chunk
+        frame_budget = (self.budget - self.spent) / max(1, self.frames_left)
+        cache = {}
+
+        def fits(quality):
+            if quality not in cache:
+                cache[quality] = encoder.encode(frame, quality)
+                self.probes += 1
+            return len(cache[quality]) <= frame_budget
+
+        # Bracket the answer next to the previous quality: afterwards low fits (or is the
+        # floor) and high does not fit (or is the ceiling), widening the window as needed
+        window = SEARCH_WINDOW
+        if fits(self.quality):
+            low, high = self.quality, min(self.max_quality, self.quality + window)
+        else:
+            low, high = max(self.min_quality, self.quality - window), self.quality
+        while True:
+            if low > self.min_quality and not fits(low):
+                low, high = max(self.min_quality, low - window), low
+            elif high < self.max_quality and fits(high):
+                low, high = high, min(self.max_quality, high + window)
+            else:
+                break
+            window *= 2
+
+        if fits(high):
+            quality = high
+        else:
+            # Largest quality in [low, high) that fits
+            while low < high - 1:
+                middle = (low + high) // 2
+                if fits(middle):
+                    low = middle
+                else:
+                    high = middle
+            quality = low
+
+        fits(quality)  # the floor may not have been probed yet
+        data = cache[quality]
+        self.quality = quality
+        self.qualities.append(quality)
+        self.spent += len(data)
+        self.frames_left -= 1
+        return data
+
+    def repeat(self):
+        """Account for a frame stored as a repeat marker, which costs no bytes"""
+        self.repeats += 1
+        self.frames_left -= 1
+
+    def stats(self, fps):
+        """Achieved vs target bitrate and the qualities used, for the manifest"""
+        frame_count = len(self.qualities) + self.repeats
+        achieved = self.spent * 8 * fps / frame_count if frame_count else 0
+        return {
+            'target_bitrate': int(self.target_bitrate),
+            'achieved_bitrate': int(achieved),
+            'quality_min': min(self.qualities, default=0),
+            'quality_max': max(self.qualities, default=0),
+            'quality_avg': round(sum(self.qualities) / len(self.qualities), 1) if self.qualities else 0,
+            'probes_per_frame': round(self.probes / len(self.qualities), 2) if self.qualities else 0
+        }
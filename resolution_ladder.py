@@ -0,0 +1,128 @@
+"""
+Resolution ladder helpers
+Builds every rendition of a frame by cascading each rung from the next-higher
+already-resized rung (1080p -> 720p -> 480p -> 360p -> 240p) instead of
+resizing each one from the full-resolution source. Rungs can also have
+frame-rate variants that keep every 2nd or 3rd frame ('360p@d2').
+Rungs above the source resolution are dropped by fit_ladder(), so no
+upscaled rendition is ever encoded or offered to clients.
+"""
+
+import time
+
+import cv2
+
+FRAME_RATE_DIVISORS = (1, 2, 3)  # full, 1/2 and 1/3 of the source frame rate
+
+
+class ResizeTimings:
+    """Accumulates per-rung resize time for a timing breakdown"""
+
+    def __init__(self):
+        self.seconds = {}  # {resolution: total seconds}
+        self.frames = {}   # {resolution: frames resized}
+
+    def add(self, resolution, seconds, frames=1):
+        self.seconds[resolution] = self.seconds.get(resolution, 0.0) + seconds
+        self.frames[resolution] = self.frames.get(resolution, 0) + frames
+
+    def merge(self, other):
+        """Merge timings from another ResizeTimings or its as_dict() form"""
+        if isinstance(other, ResizeTimings):
+            other = other.as_dict()
+        for resolution, (seconds, frames) in other.items():
+            self.add(resolution, seconds, frames)
+
+    def as_dict(self):
+        """Picklable {resolution: (seconds, frames)} form for returning from workers"""
+        return {resolution: (self.seconds[resolution], self.frames[resolution]) for resolution in self.seconds}
+
+    def summary(self):
+        """One line per rung with the average resize cost per frame"""
+        total = sum(self.seconds.values())
+        lines = []
+        for resolution, seconds in sorted(self.seconds.items(), key=lambda item: -item[1]):
+            ms_per_frame = seconds * 1000 / max(1, self.frames[resolution])
+            share = seconds / total * 100 if total > 0 else 0.0
+            lines.append(f"{resolution}: {ms_per_frame:.2f} ms/frame ({share:.0f}%)")
+        return lines
+
+
+def variant_name(resolution, divisor):
+    """Rendition name for a rung at 1/divisor of the source frame rate ('360p', '360p@d2')"""
+    return resolution if divisor == 1 else f"{resolution}@d{divisor}"
+
+
+def parse_variant(name):
+    """Split a rendition name into (resolution, frame rate divisor)"""
+    resolution, _, divisor = name.partition('@d')
+    return resolution, int(divisor) if divisor else 1
+
+
+def ladder_order(rungs):
+    """Rung names from largest to smallest output size"""
+    return sorted(rungs, key=lambda resolution: rungs[resolution][0] * rungs[resolution][1], reverse=True)
+
+
+def fit_ladder(rungs, source_size):
+    """Ladder for a source of source_size (width, height) that never upscales
+
+    Rungs that fit inside the source are kept as they are. The next rung
+    above them is capped to the source size (keeping the rung's aspect ratio)
+    when that still adds a larger rendition, so a 1280x536 source gets a
+    952x536 '720p' rung. Every larger rung is dropped. A source smaller than
+    the smallest rung keeps that rung, capped.
+    """
+    source_width, source_height = source_size
+    fitted = {}
+    top = None  # (width, height) of the largest rung kept so far
+    for resolution in reversed(ladder_order(rungs)):
+        width, height = rungs[resolution][:2]
+        if width <= source_width and height <= source_height:
+            fitted[resolution] = rungs[resolution]
+            top = (width, height)
+            continue
+
+        scale = min(source_width / width, source_height / height)
+        capped = (max(2, int(width * scale) & ~1), max(2, int(height * scale) & ~1))  # even, for 4:2:0 codecs
+        if top is None or (capped[0] > top[0] and capped[1] > top[1]):
+            fitted[resolution] = capped + tuple(rungs[resolution][2:])
+        break
+
+    # Keep the caller's order
+    return {resolution: fitted[resolution] for resolution in rungs if resolution in fitted}
+
+
+def build_ladder(frame, rungs, timings=None):
+    """Resize a frame to every rung, deriving each rung from the next-higher one
+
+    rungs maps resolution name to (width, height, ...); extra tuple fields such
+    as quality are ignored. INTER_AREA is used when shrinking and INTER_LINEAR
+    when a rung is larger than its input. Returns {resolution: image}.
+    """
+    source_height, source_width = frame.shape[:2]
+    ladder = {}
+    previous = frame
+
+    for resolution in ladder_order(rungs):
+        width, height = rungs[resolution][:2]
+        input_frame = previous
+        if width > input_frame.shape[1] or height > input_frame.shape[0]:
+            # Never cascade from an upscaled rung, go back to the source
+            input_frame = frame
+
+        start_time = time.perf_counter()
+        if (width, height) == (input_frame.shape[1], input_frame.shape[0]):
+            resized = input_frame
+        else:
+            shrinking = width <= input_frame.shape[1] and height <= input_frame.shape[0]
+            interpolation = cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR
+            resized = cv2.resize(input_frame, (width, height), interpolation=interpolation)
+        if timings is not None:
+            timings.add(resolution, time.perf_counter() - start_time)
+
+        ladder[resolution] = resized
+        if width <= source_width and height <= source_height:
+            previous = resized
+
+    return ladder
@@ -0,0 +1,62 @@
+"""
+Retransmit buffer for selective NACKs
+The server keeps the packets it recently sent to a client in a fixed-size
+ring, indexed by sequence number. When the client reports missing fragments
+(see chunk_protocol.nack_bitmap) only those packets are sent again, with
+their original header, and only while they can still be shown: a frame is
+replaced on screen by the next one, so each packet carries the time the
+next frame goes out as its deadline.
+"""
+
+import time
+
+RETRANSMIT_RING_PACKETS = 1024  # per client: a few frames of MTU-sized packets, about 1.4 MB
+
+
+class RetransmitBuffer:
+    """The last capacity packets sent to one client, looked up by sequence number
+
+    Only a packet's header is copied, since it lives in the streaming loop's
+    reused send buffer or is stamped in place on the next send. The
+    payload is kept as sent: a view of the frame, which keeps the frame's
+    data alive even after the chunk cache drops it. One thread adds packets
+    while the control thread looks them up. Slots are replaced whole, so no
+    lock is needed.
+    """
+
+    def __init__(self, capacity=RETRANSMIT_RING_PACKETS):
+        self.capacity = capacity
+        self.slots = [None] * capacity  # (sequence, chunk id, frame index, deadline, packet)
+
+        # Statistics
+        self.requested = 0  # fragments asked for in NACKs
+        self.resent = 0
+        self.expired = 0    # asked for after their frame's deadline
+        self.evicted = 0    # asked for after the ring had moved past them
+
+    def add(self, sequence_number, chunk_id, frame_index, packet, deadline):
+        """Keep a sent (header, payload) packet until capacity newer ones have been sent; deadline is time.monotonic()"""
+        header, payload = packet
+        self.slots[sequence_number % self.capacity] = (sequence_number, chunk_id, frame_index, deadline, (bytes(header), payload))
+
+    def lookup(self, sequence_number, chunk_id, frame_index):
+        """The (header, payload) packet to send again for a NACKed fragment, or None if it is gone or too late"""
+        self.requested += 1
+        entry = self.slots[sequence_number % self.capacity]
+        if entry is None or entry[:3] != (sequence_number, chunk_id, frame_index):
+            self.evicted += 1
+            return None
+        if time.monotonic() >= entry[3]:
+            self.expired += 1
+            return None
+        self.resent += 1
+        return entry[4]
+
+    def stats(self):
+        return {
+            'requested': self.requested,
+            'resent': self.resent,
+            'expired': self.expired,
+            'evicted': self.evicted,
+            'capacity': self.capacity
+        }
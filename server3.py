@@ -8,9 +8,12 @@ import subprocess
 import os
 from typing import Dict, List, Tuple
 import numpy as np
+from frame_encoders import create_encoder
+from resolution_ladder import ResizeTimings, build_ladder
 
 class VideoStreamingServer:
-    def __init__(self, host='10.177.60.18', video_port=8888, control_port=8889, video_file_path=None):
+    def __init__(self, host='10.177.60.18', video_port=8888, control_port=8889, video_file_path=None,
+                 encoder='opencv', encoder_options=None):
         self.host = host
         self.video_port = video_port
         self.control_port = control_port
@@ -31,6 +34,8 @@ class VideoStreamingServer:
         self.video_source = None
         self.is_streaming = False
         self.original_fps = 30  # Default FPS
+        self.resize_timings = ResizeTimings()  # per-rung resize cost
+        self.encoder = create_encoder(encoder, **(encoder_options or {}))  # JPEG backend, see frame_encoders
         
         # Socket setup
         self.video_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -161,14 +166,16 @@ class VideoStreamingServer:
     
     def resize_frame(self, frame, resolution_key):
         """Resize frame according to resolution settings"""
-        width, height, _ = self.resolutions[resolution_key]
-        return cv2.resize(frame, (width, height))
+        return self.resize_ladder(frame, [resolution_key])[resolution_key]
+    
+    def resize_ladder(self, frame, resolution_keys):
+        """Resize frame to several resolutions, cascading each from the next-higher rung"""
+        rungs = {key: self.resolutions[key] for key in resolution_keys}
+        return build_ladder(frame, rungs, self.resize_timings)
     
     def encode_frame(self, frame, quality=80):
         """Encode frame as JPEG with specified quality"""
-        encode_params = [cv2.IMWRITE_JPEG_QUALITY, quality]
-        _, buffer = cv2.imencode('.jpg', frame, encode_params)
-        return buffer.tobytes()
+        return bytes(self.encoder.encode(frame, quality))
     
     def create_packet(self, frame_data, sequence_number, resolution):
         """Create a packet with header information"""
@@ -210,10 +217,15 @@ class VideoStreamingServer:
                 # Debug: Log client status every 30 frames (1 second at 30fps)
                 if sequence_number % 30 == 0:
                     print(f"[DEBUG] Frame #{sequence_number}: {len(self.clients)} clients, resolutions: {active_resolutions}")
+                    if self.resize_timings.seconds:
+                        print(f"[DEBUG] Resize per rung: {', '.join(self.resize_timings.summary())}")
+                
+                # Resize once per active resolution, cascading down the ladder
+                ladder = self.resize_ladder(frame, active_resolutions)
                 
                 for resolution in active_resolutions:
-                    # Resize and encode frame
-                    resized_frame = self.resize_frame(frame, resolution)
+                    # Encode frame
+                    resized_frame = ladder[resolution]
                     
                     # Adjust quality based on resolution
                     quality_map = {
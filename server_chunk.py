@@ -1,17 +1,18 @@
 import socket
 import threading
 import time
-import cv2
 import json
 import struct
 import os
-import shutil
 from typing import Dict, List, Tuple
-import numpy as np
+from chunk_cache import DEFAULT_CACHE_MB, ChunkCache, ChunkPrefetcher
+from chunk_preprocessor import ChunkPreprocessor
+from chunk_protocol import send_packet
 from config import INITIAL_RESOLUTION
 
 class ChunkBasedVideoServer:
-    def __init__(self, host='127.0.0.1', video_port=8888, control_port=8889, video_file_path=None):
+    def __init__(self, host='127.0.0.1', video_port=8888, control_port=8889, video_file_path=None, preprocess_workers=None,
+                 encoder='opencv', encoder_options=None, chunk_cache_mb=DEFAULT_CACHE_MB, prefetch_depth=2):
         self.host = host
         self.video_port = video_port
         self.control_port = control_port
@@ -32,6 +33,12 @@ class ChunkBasedVideoServer:
         self.chunk_metadata = {}   # {chunk_id: {duration, frame_count, etc}}
         self.total_chunks = 0
         self.original_fps = 30
+        self.preprocess_workers = preprocess_workers  # None = one worker per CPU core
+        self.encoder = encoder  # JPEG backend: 'opencv' or 'turbojpeg'
+        self.encoder_options = encoder_options  # e.g. {'fast_dct': True, 'subsampling': '420'} for turbojpeg
+        self.preprocessor = None  # serves chunks from the store once preprocessing is done
+        self.chunk_cache = ChunkCache(chunk_cache_mb * 1024 * 1024)  # shared by every client, LRU over the byte budget
+        self.prefetcher = ChunkPrefetcher(self.chunk_cache, self.read_ahead_chunk, prefetch_depth)  # 0 = no read-ahead
         
         # Client tracking
         self.clients = {}  # {addr: {resolution, current_chunk}}
@@ -53,119 +60,47 @@ class ChunkBasedVideoServer:
         print(f"📁 Pre-processing video: {os.path.basename(self.video_file_path)}")
         print(f"⏱️  Using 2-second chunks for better streaming control")
         
-        # Create storage directory
-        storage_dir = "video_chunks"
-        if os.path.exists(storage_dir):
-            shutil.rmtree(storage_dir)
-        os.makedirs(storage_dir)
-        
-        # Open video file
-        cap = cv2.VideoCapture(self.video_file_path)
-        if not cap.isOpened():
-            print("Error: Could not open video file")
+        # Fan (chunk_id, resolution) encode jobs out to a process pool
+        self.preprocessor = ChunkPreprocessor(
+            self.video_file_path,
+            self.resolutions,
+            chunk_duration=self.chunk_duration,
+            max_workers=self.preprocess_workers,
+            encoder=self.encoder,
+            encoder_options=self.encoder_options
+        )
+        if not self.preprocessor.run():
             return False
         
-        # Get video properties
-        self.original_fps = cap.get(cv2.CAP_PROP_FPS)
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        duration = total_frames / self.original_fps
-        
-        print(f"  Original FPS: {self.original_fps:.2f}")
-        print(f"  Total frames: {total_frames}")
-        print(f"  Duration: {duration:.2f} seconds")
-        
-        # Calculate chunk parameters
-        frames_per_chunk = int(self.original_fps * self.chunk_duration)
-        self.total_chunks = int(np.ceil(total_frames / frames_per_chunk))
-        
-        print(f"  Frames per chunk: {frames_per_chunk}")
-        print(f"  Total chunks: {self.total_chunks}")
-        print()
-        
-        # Initialize storage for each resolution
-        for resolution in self.resolutions.keys():
-            self.chunks_storage[resolution] = []
-            res_dir = os.path.join(storage_dir, resolution)
-            os.makedirs(res_dir)
-        
-        # Process chunks
-        for chunk_id in range(self.total_chunks):
-            print(f"🔄 Processing chunk {chunk_id + 1}/{self.total_chunks}")
-            
-            # Read frames for this chunk
-            chunk_frames = []
-            for frame_idx in range(frames_per_chunk):
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                chunk_frames.append(frame)
-            
-            if not chunk_frames:
-                break
-            
-            # Store metadata
-            self.chunk_metadata[chunk_id] = {
-                'frame_count': len(chunk_frames),
-                'duration': len(chunk_frames) / self.original_fps
-            }
-            
-            # Process chunk for each resolution
-            for resolution, (width, height, quality) in self.resolutions.items():
-                chunk_file = os.path.join(storage_dir, resolution, f"chunk_{chunk_id:04d}.bin")
-                
-                # Resize and encode frames
-                encoded_frames = []
-                for frame in chunk_frames:
-                    # Resize frame
-                    resized_frame = cv2.resize(frame, (width, height))
-                    
-                    # Encode frame as JPEG
-                    encode_params = [cv2.IMWRITE_JPEG_QUALITY, quality]
-                    _, buffer = cv2.imencode('.jpg', resized_frame, encode_params)
-                    encoded_frames.append(buffer.tobytes())
-                
-                # Save chunk to file
-                with open(chunk_file, 'wb') as f:
-                    # Write number of frames
-                    f.write(struct.pack('!I', len(encoded_frames)))
-                    
-                    # Write each frame with its size
-                    for frame_data in encoded_frames:
-                        f.write(struct.pack('!I', len(frame_data)))
-                        f.write(frame_data)
-                
-                self.chunks_storage[resolution].append(chunk_file)
+        self.resolutions = self.preprocessor.resolutions  # rungs above the source are skipped
+        self.original_fps = self.preprocessor.original_fps
+        self.total_chunks = self.preprocessor.total_chunks
+        self.chunks_storage = self.preprocessor.chunks_storage
+        self.chunk_metadata = self.preprocessor.chunk_metadata
         
-        cap.release()
         print(f"✅ Video preprocessing complete! Created {self.total_chunks} chunks for {len(self.resolutions)} resolutions")
         return True
     
     def load_chunk(self, resolution, chunk_id):
-        """Load a specific chunk from storage"""
+        """Load a specific chunk from storage as a list of frames (zero-copy memoryviews)"""
         if resolution not in self.chunks_storage or chunk_id >= len(self.chunks_storage[resolution]):
             return None
         
-        chunk_file = self.chunks_storage[resolution][chunk_id]
-        if not os.path.exists(chunk_file):
-            return None
-        
-        frames = []
         try:
-            with open(chunk_file, 'rb') as f:
-                # Read number of frames
-                frame_count = struct.unpack('!I', f.read(4))[0]
-                
-                # Read each frame
-                for _ in range(frame_count):
-                    frame_size = struct.unpack('!I', f.read(4))[0]
-                    frame_data = f.read(frame_size)
-                    frames.append(frame_data)
-            
-            return frames
+            # Clients on the same chunk share one load
+            return self.chunk_cache.get(
+                (resolution, chunk_id), lambda: self.preprocessor.load_chunk(resolution, chunk_id)
+            )
         except Exception as e:
             print(f"Error loading chunk {chunk_id} for {resolution}: {e}")
             return None
     
+    def read_ahead_chunk(self, resolution, chunk_id):
+        """Loader for the prefetcher: chunks that are not encoded yet are skipped"""
+        if resolution not in self.chunks_storage or chunk_id >= self.preprocessor.available_chunks:
+            return None
+        return self.preprocessor.load_chunk(resolution, chunk_id)
+    
     def start_server(self):
         """Start the chunk-based streaming server"""
         # Pre-process video into chunks
@@ -179,6 +114,7 @@ class ChunkBasedVideoServer:
             print(f"🎮 Control server listening on {self.host}:{self.control_port}")
             
             self.is_streaming = True
+            self.prefetcher.start()
             
             # Start control message handler
             control_thread = threading.Thread(target=self.handle_control_connections)
@@ -245,6 +181,7 @@ class ChunkBasedVideoServer:
                             old_resolution = self.clients[addr]['resolution']
                             self.clients[addr]['resolution'] = requested_resolution
                             print(f"🎯 Client {addr} resolution: {old_resolution} → {requested_resolution}")
+                            self.prefetcher.schedule((requested_resolution,), self.clients[addr]["current_chunk"], self.total_chunks)
                             
                             # Send acknowledgment
                             response = {
@@ -273,9 +210,14 @@ class ChunkBasedVideoServer:
                 print(f"👋 Client {addr} disconnected")
     
     def create_chunk_packets(self, frame_data, sequence_number, chunk_id, frame_index, resolution):
-        """Create packets for chunk-based streaming with fragmentation support"""
+        """Create packets for chunk-based streaming with fragmentation support
+
+        Packets are (header, payload) pairs, the payload a view of frame_data,
+        so a fragment is never copied to put a header in front of it.
+        """
         timestamp = time.time()
         resolution_bytes = resolution.encode()
+        frame = memoryview(frame_data)
         
         # Calculate maximum payload size (leaving room for headers)
         max_packet_size = 60000  # Safe UDP packet size for Windows
@@ -288,7 +230,7 @@ class ChunkBasedVideoServer:
         for fragment_index in range(total_fragments):
             start_pos = fragment_index * max_payload_size
             end_pos = min(start_pos + max_payload_size, len(frame_data))
-            fragment_data = frame_data[start_pos:end_pos]
+            fragment_data = frame[start_pos:end_pos]
             
             # Create header with fragmentation info:
             # sequence(4) + timestamp(8) + chunk_id(4) + frame_index(4) + resolution_len(1) + resolution + 
@@ -303,7 +245,7 @@ class ChunkBasedVideoServer:
             header += struct.pack('!I', fragment_index)                  # current fragment index
             header += struct.pack('!I', len(fragment_data))              # fragment data length
             
-            packets.append(header + fragment_data)
+            packets.append((header, fragment_data))
         
         return packets
     
@@ -325,6 +267,7 @@ class ChunkBasedVideoServer:
                     
                     # Load chunk if needed
                     chunk_frames = self.load_chunk(resolution, chunk_id)
+                    self.prefetcher.schedule((resolution,), chunk_id, self.total_chunks)
                     if chunk_frames is None:
                         # Move to next chunk or loop back to beginning
                         if chunk_id >= self.total_chunks - 1:
@@ -346,7 +289,7 @@ class ChunkBasedVideoServer:
                         for packet in packets:
                             try:
                                 client_address = (addr[0], 8890)  # Assuming client video port
-                                self.video_socket.sendto(packet, client_address)
+                                send_packet(self.video_socket, packet, client_address)
                             except Exception as e:
                                 print(f"Error sending fragment to {addr}: {e}")
                                 break
@@ -395,6 +338,17 @@ class ChunkBasedVideoServer:
             except:
                 pass
         
+        self.prefetcher.stop()
+        cache = self.chunk_cache.stats()
+        print(f"🗃️  Chunk cache: {cache['hits']} hits, {cache['misses']} misses, {cache['coalesced']} coalesced, "
+              f"{cache['evictions']} evictions, {cache['size_bytes'] / 1024 / 1024:.1f}/"
+              f"{cache['budget_bytes'] / 1024 / 1024:.0f} MB")
+        print(f"💤 Streaming waited on chunk I/O {cache['io_waits']} times ({cache['io_wait_seconds'] * 1000:.0f} ms), "
+              f"{cache['prefetched']} chunks read ahead")
+        self.chunk_cache.clear()
+        if self.preprocessor:
+            self.preprocessor.close()
+        
         print("🧹 Server cleanup completed")
 
 def main():
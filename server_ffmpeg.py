@@ -14,6 +14,7 @@ import os
 import sys
 from typing import Dict, Optional
 import signal
+from chunk_protocol import send_packet
 
 class FFmpegVideoServer:
     def __init__(self, host='localhost', video_port=8890, control_port=8889, video_file_path=None):
@@ -257,7 +258,7 @@ class FFmpegVideoServer:
                 self.ffmpeg_process.wait()
     
     def create_packet(self, data):
-        """Create packet with header information"""
+        """Create packet with header information, as (header, data) so the data is sent without a copy"""
         timestamp = time.time()
         quality_bytes = self.current_quality.encode()
         
@@ -269,7 +270,7 @@ class FFmpegVideoServer:
         header += struct.pack('!I', len(data))  # data length
         
         self.sequence_number += 1
-        return header + data
+        return header, data
     
     def broadcast_packet(self, packet):
         """Send packet to all connected clients"""
@@ -278,7 +279,7 @@ class FFmpegVideoServer:
             
         for client_addr in list(self.client_addresses):  # Copy to avoid modification during iteration
             try:
-                self.video_socket.sendto(packet, client_addr)
+                send_packet(self.video_socket, packet, client_addr)
             except Exception as e:
                 # Remove failed client
                 print(f"[ERROR] Failed to send to {client_addr}, removing: {e}")
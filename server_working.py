@@ -8,9 +8,11 @@ import subprocess
 import os
 from typing import Dict, List, Tuple
 import numpy as np
+from frame_encoders import create_encoder
 
 class VideoStreamingServer:
-    def __init__(self, host='10.177.60.65', video_port=8888, control_port=8889, video_file_path=None):
+    def __init__(self, host='10.177.60.65', video_port=8888, control_port=8889, video_file_path=None,
+                 encoder='opencv', encoder_options=None):
         self.host = host
         self.video_port = video_port
         self.control_port = control_port
@@ -31,6 +33,7 @@ class VideoStreamingServer:
         self.video_source = None
         self.is_streaming = False
         self.original_fps = 30  # Default FPS
+        self.encoder = create_encoder(encoder, **(encoder_options or {}))  # JPEG backend, see frame_encoders
         
         # Socket setup
         self.video_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -157,9 +160,7 @@ class VideoStreamingServer:
     
     def encode_frame(self, frame, quality=80):
         """Encode frame as JPEG with specified quality"""
-        encode_params = [cv2.IMWRITE_JPEG_QUALITY, quality]
-        _, buffer = cv2.imencode('.jpg', frame, encode_params)
-        return buffer.tobytes()
+        return bytes(self.encoder.encode(frame, quality))
     
     def create_packet(self, frame_data, sequence_number, resolution):
         """Create a packet with header information"""
@@ -0,0 +1,111 @@
+import threading
+import time
+
+import pytest
+
+from chunk_cache import ChunkCache, ChunkPrefetcher
+
+
+def test_hit_after_miss():
+    cache = ChunkCache(1000)
+    calls = []
+    loader = lambda: calls.append(1) or [b'abc']
+    assert cache.get('a', loader) == [b'abc']
+    assert cache.get('a', loader) == [b'abc']
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['size_bytes']) == (1, 1, 3)
+
+
+def test_concurrent_misses_share_one_load():
+    cache = ChunkCache(1000)
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow_loader():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return [b'frame']
+
+    results = []
+    first = threading.Thread(target=lambda: results.append(cache.get('a', slow_loader)))
+    first.start()
+    started.wait(5)
+    waiters = [threading.Thread(target=lambda: results.append(cache.get('a', slow_loader))) for _ in range(3)]
+    for waiter in waiters:
+        waiter.start()
+    while cache.stats()['coalesced'] < 3:
+        pass
+    release.set()
+    for thread in [first] + waiters:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert results == [[b'frame']] * 4
+    assert cache.stats()['coalesced'] == 3
+
+
+def test_failed_load_is_not_cached():
+    cache = ChunkCache(1000)
+
+    def failing_loader():
+        raise OSError("disk gone")
+
+    with pytest.raises(OSError):
+        cache.get('a', failing_loader)
+    assert cache.get('a', lambda: [b'ok']) == [b'ok']
+    assert cache.get('b', lambda: None) is None
+    assert cache.stats()['entries'] == 1
+
+
+def test_evicts_least_recently_used_over_budget():
+    cache = ChunkCache(10)
+    cache.get('a', lambda: [b'x' * 4])
+    cache.get('b', lambda: [b'x' * 4])
+    cache.get('a', lambda: None)  # touch a, b is now least recently used
+    cache.get('c', lambda: [b'x' * 4])
+    assert list(cache.entries) == ['a', 'c']
+    assert cache.stats()['evictions'] == 1
+
+
+def test_entries_larger_than_budget_are_not_cached():
+    cache = ChunkCache(10)
+    assert cache.get('a', lambda: [b'x' * 20]) == [b'x' * 20]
+    assert cache.stats()['entries'] == 0
+
+
+def test_prefetch_skips_cached_keys():
+    cache = ChunkCache(1000)
+    cache.get('a', lambda: [b'x'])
+    cache.prefetch('a', lambda: pytest.fail("cached key loaded again"))
+    cache.prefetch('b', lambda: [b'y'])
+    assert cache.get('b', lambda: None) == [b'y']
+    assert cache.stats()['prefetched'] == 1
+
+
+def test_prefetcher_queue_is_bounded_and_deduplicated():
+    prefetcher = ChunkPrefetcher(ChunkCache(1000), lambda *key: [b'x'], depth=2, max_queued=3)
+    prefetcher.running = True  # queue without the I/O thread draining it
+    prefetcher.schedule(('720p',), 0, 10)
+    prefetcher.schedule(('720p',), 0, 10)
+    assert list(prefetcher.pending) == [('720p', 1), ('720p', 2)]
+    prefetcher.schedule(('720p',), 2, 10)
+    assert list(prefetcher.pending) == [('720p', 2), ('720p', 3), ('720p', 4)]
+    assert prefetcher.dropped == 1
+
+
+def test_prefetcher_loads_into_cache():
+    cache = ChunkCache(1000)
+    prefetcher = ChunkPrefetcher(cache, lambda resolution, chunk_id: [bytes([chunk_id])], depth=2)
+    prefetcher.start()
+    try:
+        prefetcher.schedule(('720p',), 0, 3)
+        deadline = time.monotonic() + 5
+        while cache.stats()['prefetched'] < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        prefetcher.stop()
+    assert cache.get(('720p', 2), lambda: None) == [b'\x02']
+    assert cache.stats()['prefetched'] == 2
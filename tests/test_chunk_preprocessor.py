@@ -0,0 +1,18 @@
+import time
+
+from chunk_preprocessor import ChunkPreprocessor
+
+
+def test_progress_stops_the_clock_when_encoding_ends(tmp_path):
+    preprocessor = ChunkPreprocessor('missing.mp4', {'240p': (426, 240, 60)}, storage_dir=str(tmp_path))
+    assert preprocessor.progress()['frames_per_sec'] == 0.0
+
+    now = time.time()
+    preprocessor.encode_start_time = now - 2.0
+    preprocessor.frames_to_encode = preprocessor.frames_encoded = 120
+    preprocessor.encode_end_time = now - 1.0
+    preprocessor.is_complete = True
+    progress = preprocessor.progress()
+    assert progress['elapsed'] == 1.0
+    assert progress['frames_per_sec'] == 120.0
+    assert progress['eta'] is None
@@ -0,0 +1,69 @@
+import base64
+
+from chunk_protocol import (HEADER_V2, MIN_PACKET_SIZE, PROTOCOL_V1, PROTOCOL_V2, nack_bitmap, nack_indices, negotiate,
+                            pack_frame_v2, rendition_ids, reported_packet_size, stamp_v2, unpack_v2)
+
+
+def test_negotiate_picks_highest_common_version():
+    assert negotiate([1, 2]) == PROTOCOL_V2
+    assert negotiate([1]) == PROTOCOL_V1
+    assert negotiate([3, 1]) == PROTOCOL_V1
+    assert negotiate(None) == PROTOCOL_V1
+
+
+def test_rendition_ids_follow_rendition_order():
+    assert rendition_ids(['240p', '240p@d2', '360p']) == {'240p': 0, '240p@d2': 1, '360p': 2}
+
+
+def test_pack_unpack_round_trip():
+    frame = bytes(range(256)) * 20
+    _, packets = pack_frame_v2(frame, 3, 100, 7, 12, 1400)
+    assert all(len(header) + len(payload) <= 1400 for header, payload in packets)
+
+    payloads = {}
+    for sequence, (header, payload) in enumerate(packets, 100):
+        fields = unpack_v2(bytes(header) + bytes(payload))
+        rendition_id, sequence_number, _, chunk_id, frame_index, total_fragments, fragment_index, data, _, _ = fields
+        assert (rendition_id, sequence_number, chunk_id, frame_index) == (3, sequence, 7, 12)
+        assert total_fragments == len(packets)
+        payloads[fragment_index] = bytes(data)
+    assert b''.join(payloads[i] for i in range(len(packets))) == frame
+
+
+def test_repeat_marker_is_one_header_only_packet():
+    _, packets = pack_frame_v2(b'', 0, 5, 1, 2, 1400)
+    assert len(packets) == 1
+    header, payload = packets[0]
+    assert len(header) == HEADER_V2.size and not len(payload)
+    assert unpack_v2(bytes(header))[5] == 0
+
+
+def test_stamp_v2_patches_only_sequence_and_timestamp():
+    frame = b'x' * 3000
+    _, packets = pack_frame_v2(frame, 1, 0, 4, 9, 1400)
+    before = [unpack_v2(bytes(header) + bytes(payload)) for header, payload in packets]
+    stamp_v2(packets, 500)
+    for fragment_index, ((header, payload), old) in enumerate(zip(packets, before)):
+        new = unpack_v2(bytes(header) + bytes(payload))
+        assert new[1] == 500 + fragment_index
+        assert new[2] >= old[2]
+        assert (new[0],) + new[3:7] == (old[0],) + old[3:7]
+        assert bytes(new[7]) == bytes(old[7])
+
+
+def test_reported_packet_size_is_clamped():
+    assert reported_packet_size(1350, 1400) == 1350
+    assert reported_packet_size(65000, 1400) == 1400
+    assert reported_packet_size(548, 1400) == MIN_PACKET_SIZE
+    for bogus in (None, 0, -5, '1400', 1400.5, True):
+        assert reported_packet_size(bogus, 1400) == MIN_PACKET_SIZE
+
+
+def test_nack_bitmap_round_trip():
+    for missing in ([0], [7], [8], [1, 2, 3, 200], list(range(0, 1000, 3)), [65534]):
+        assert nack_indices(nack_bitmap(missing)) == missing
+    assert nack_indices(nack_bitmap([9, 2, 2])) == [2, 9]
+
+
+def test_nack_bitmap_is_lsb_first():
+    assert base64.b64decode(nack_bitmap([0, 9])) == bytes([0b00000001, 0b00000010])
@@ -0,0 +1,66 @@
+import os
+
+from chunk_store import ChunkManifest, ChunkWriter
+
+
+def write_chunk(manifest, resolution, chunk_id, frames):
+    os.makedirs(os.path.join(manifest.store_dir, resolution), exist_ok=True)
+    writer = ChunkWriter(manifest.chunk_file(resolution, chunk_id))
+    for frame in frames:
+        writer.write_frame(frame)
+    return writer.close()
+
+
+def test_recover_adopts_complete_unrecorded_chunk(tmp_path):
+    manifest = ChunkManifest(str(tmp_path), 'key')
+    manifest.original_fps = 30
+    size = write_chunk(manifest, '240p', 0, [b'a' * 10, b'b' * 20])
+
+    assert manifest.recover('240p', 0, 2, 2)
+    info = manifest.chunks[0]['renditions']['240p']
+    assert info['size'] == size
+    assert info['frame_sizes'] == [10, 20]
+    assert manifest.is_valid('240p', 0)
+
+
+def test_recover_rejects_wrong_frame_count(tmp_path):
+    manifest = ChunkManifest(str(tmp_path), 'key')
+    write_chunk(manifest, '240p', 0, [b'a' * 10])
+    assert not manifest.recover('240p', 0, 2, 2)
+    assert 0 not in manifest.chunks
+
+
+def test_recover_rejects_truncated_chunk(tmp_path):
+    manifest = ChunkManifest(str(tmp_path), 'key')
+    write_chunk(manifest, '240p', 0, [b'a' * 10, b'b' * 20])
+    chunk_file = manifest.chunk_file('240p', 0)
+    with open(chunk_file, 'r+b') as f:
+        f.truncate(os.path.getsize(chunk_file) - 5)
+    assert not manifest.recover('240p', 0, 2, 2)
+
+
+def test_recover_missing_file(tmp_path):
+    manifest = ChunkManifest(str(tmp_path), 'key')
+    assert not manifest.recover('240p', 3, 2, 2)
+
+
+def test_recovered_chunks_survive_save_and_load(tmp_path):
+    manifest = ChunkManifest(str(tmp_path), 'key')
+    manifest.original_fps = 30
+    write_chunk(manifest, '240p', 0, [b'a' * 10, b'b' * 20])
+    manifest.recover('240p', 0, 2, 2)
+    manifest.save()
+
+    reloaded = ChunkManifest(str(tmp_path), 'key')
+    assert reloaded.load()
+    assert reloaded.is_valid('240p', 0)
+    assert not ChunkManifest(str(tmp_path), 'other key').load()
+
+
+def test_remove_partial_files(tmp_path):
+    manifest = ChunkManifest(str(tmp_path), 'key')
+    write_chunk(manifest, '240p', 0, [b'a'])
+    open(manifest.chunk_file('240p', 1) + '.tmp', 'wb').close()
+    open(os.path.join(str(tmp_path), '240p.pack.tmp'), 'wb').close()
+    assert manifest.remove_partial_files() == 2
+    assert os.path.exists(manifest.chunk_file('240p', 0))
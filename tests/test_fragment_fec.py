@@ -0,0 +1,49 @@
+import itertools
+import random
+
+from fragment_fec import MAX_FEC_PARITY, encode_parity, group_layout, parity_count, recover
+
+
+def make_group(count, size=100, seed=0):
+    generator = random.Random(seed)
+    # The last fragment of a frame is usually short
+    return [generator.randbytes(size if index < count - 1 else size // 3) for index in range(count)]
+
+
+def test_any_k_fragments_rebuild_the_group():
+    data = make_group(6)
+    parity = encode_parity(data, 3)
+    fragments = dict(enumerate(data + parity))
+    for lost in itertools.combinations(range(9), 3):
+        received = {row: payload for row, payload in fragments.items() if row not in lost}
+        recovered = recover(6, 3, received)
+        assert recovered == {row: data[row] for row in lost if row < 6}
+
+
+def test_single_parity_is_xor():
+    data = make_group(4, size=8)
+    parity, = encode_parity(data, 1)
+    rows = [len(fragment).to_bytes(2, 'big') + fragment.ljust(8, b'\0') for fragment in data]
+    expected = bytes(a ^ b ^ c ^ d for a, b, c, d in zip(*rows))
+    assert parity == expected
+    assert recover(4, 1, {0: data[0], 1: data[1], 3: data[3], 4: parity}) == {2: data[2]}
+
+
+def test_too_few_fragments_cannot_recover():
+    data = make_group(5)
+    parity = encode_parity(data, 2)
+    assert recover(5, 2, {0: data[0], 1: data[1], 2: data[2], 5: parity[0]}) is None
+    assert recover(5, 2, {0: data[0], 1: data[1], 2: data[2], 3: data[3]}) is None  # no parity yet
+    assert recover(5, 2, dict(enumerate(data))) == {}
+
+
+def test_group_layout_covers_every_fragment():
+    assert group_layout(35, 16) == [(0, 16), (16, 16), (32, 3)]
+    assert group_layout(0, 16) == []
+
+
+def test_parity_count_grows_with_loss():
+    assert parity_count(0) == 0
+    counts = [parity_count(loss / 100) for loss in range(1, 50)]
+    assert counts == sorted(counts)
+    assert counts[0] >= 1 and counts[-1] == MAX_FEC_PARITY
@@ -0,0 +1,39 @@
+import numpy as np
+
+from frame_dedup import StaticFrameDetector, frame_luma, reference_frame
+
+
+def frame_with_square(x, size=4, level=200):
+    frame = np.full((720, 1280, 3), 40, dtype=np.uint8)
+    frame[300:300 + size, x:x + size] = level
+    return frame
+
+
+def test_identical_frames_are_repeats():
+    detector = StaticFrameDetector()
+    frame = frame_with_square(100)
+    assert not detector.is_repeat(frame_luma(frame))
+    assert detector.is_repeat(frame_luma(frame.copy()))
+    assert detector.repeats == 1
+
+
+def test_small_moving_object_is_not_a_repeat():
+    detector = StaticFrameDetector()
+    results = [detector.is_repeat(frame_luma(frame_with_square(100 + 6 * step))) for step in range(10)]
+    assert not any(results)
+
+
+def test_sensor_noise_below_threshold_is_a_repeat():
+    detector = StaticFrameDetector()
+    frame = frame_with_square(100)
+    noisy = frame.copy()
+    noisy[::7, ::5] += 2
+    assert not detector.is_repeat(frame_luma(frame))
+    assert detector.is_repeat(frame_luma(noisy))
+
+
+def test_reference_frame_skips_back_over_markers():
+    frames = [b'first', b'', b'', b'fourth', b'']
+    assert reference_frame(frames, 2) == b'first'
+    assert reference_frame(frames, 4) == b'fourth'
+    assert reference_frame(frames, 3) == b'fourth'
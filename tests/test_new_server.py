@@ -0,0 +1,78 @@
+import json
+import socket
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from new_server import ChunkBasedVideoServer
+from video_catalog import VideoCatalog
+
+BASELINE_ACK_FIELDS = {'type', 'status', 'total_chunks', 'chunk_duration'}
+
+
+def open_title(title):
+    """A title with a full ladder of frame-rate variants, without encoding anything"""
+    resolutions = {'240p': (426, 240, 60), '360p': (640, 360, 65), '480p': (854, 480, 70),
+                   '720p': (1280, 720, 75), '1080p': (1920, 1080, 85)}
+    renditions = [f"{resolution}@d{divisor}" if divisor > 1 else resolution
+                  for resolution in resolutions for divisor in (1, 2, 3)]
+    title.resolutions = resolutions
+    title.rendition_ids = {rendition: rendition_id for rendition_id, rendition in enumerate(renditions)}
+    title.initial_resolution = '480p'
+    title.chunk_format = 'jpeg'
+    title.preprocessor = SimpleNamespace(
+        total_chunks=120, available_chunks=120, is_complete=True, frame_rate_divisors=(1, 2, 3),
+        bitrate_summary=lambda: {rendition: 1234567 for rendition in renditions}, close=lambda: None
+    )
+    return True
+
+
+@pytest.fixture
+def server():
+    server = ChunkBasedVideoServer(host='127.0.0.1', registration_timeout=0.2)
+    server.catalog = VideoCatalog({'movie': None}, open_title)
+    server.default_title = 'movie'
+    yield server
+    server.cleanup()
+
+
+def handshake(server, register=None):
+    """Run one control connection; returns everything the server sent before hanging up"""
+    client_socket, server_socket = socket.socketpair()
+    client_socket.settimeout(5)
+    handler = threading.Thread(target=server.handle_client_control, args=(server_socket, ('127.0.0.1', 40000)))
+    handler.start()  # not streaming, so the handler hangs up right after the ack
+    if register is not None:
+        client_socket.send(json.dumps(register).encode())
+    data = client_socket.recv(1024)  # how clients without a register message read the ack
+    handler.join(5)
+    while True:
+        more = client_socket.recv(65536)
+        if not more:
+            break
+        data += more
+    client_socket.close()
+    return data
+
+
+def test_unregistered_client_gets_the_original_ack(server):
+    data = handshake(server)
+    assert len(data) <= 1024
+    ack = json.loads(data)
+    assert set(ack) == BASELINE_ACK_FIELDS
+    assert (ack['status'], ack['total_chunks'], ack['chunk_duration']) == ('success', 120, 2.0)
+
+
+def test_registered_client_gets_the_extended_ack(server):
+    register = {'type': 'register', 'protocols': [2, 1], 'nack': True}
+    ack = json.loads(handshake(server, register))
+    assert BASELINE_ACK_FIELDS < set(ack)
+    assert ack['protocol'] == 2 and ack['retransmit'] is True
+    assert ack['frame_rate_divisors'] == [1, 2, 3]
+    assert list(ack['resolutions']) == ['240p', '360p', '480p', '720p', '1080p']
+
+
+def test_unknown_title_is_refused(server):
+    ack = json.loads(handshake(server, {'type': 'register', 'title': 'nope'}))
+    assert ack['status'] == 'error' and ack['titles'] == ['movie']
@@ -0,0 +1,57 @@
+from rate_control import MAX_QUALITY, MIN_QUALITY, QualityController
+
+
+class SizedEncoder:
+    """Fake encoder whose output is 100 bytes per quality step, and counts its calls"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, frame, quality):
+        self.calls += 1
+        return bytes(quality * 100)
+
+
+def controller(frame_budget, frame_count=10, **kwargs):
+    # target_bitrate / 8 / fps bytes per frame
+    return QualityController(frame_budget * 8 * 30, 30, frame_count, **kwargs)
+
+
+def test_picks_highest_quality_within_budget():
+    quality_control = controller(5050)
+    data = quality_control.encode(SizedEncoder(), None)
+    assert len(data) == 5000
+    assert quality_control.quality == 50
+
+
+def test_clamps_to_quality_range():
+    low = controller(100)
+    assert len(low.encode(SizedEncoder(), None)) == MIN_QUALITY * 100
+    high = controller(1_000_000)
+    assert len(high.encode(SizedEncoder(), None)) == MAX_QUALITY * 100
+
+
+def test_search_starts_near_previous_quality():
+    quality_control = controller(6000, initial_quality=60)
+    encoder = SizedEncoder()
+    quality_control.encode(encoder, None)
+    first_calls = encoder.calls
+    quality_control.encode(encoder, None)
+    assert quality_control.qualities == [60, 60]
+    assert encoder.calls - first_calls <= 4  # 60, 64, 62, 61 instead of bisecting all of 20-95
+
+
+def test_underspent_budget_carries_over():
+    quality_control = controller(5050, frame_count=2)
+    quality_control.encode(SizedEncoder(), None)  # spends 5000 of 5050
+    quality_control.encode(SizedEncoder(), None)  # 5100 left for the last frame
+    assert quality_control.qualities == [50, 51]
+
+
+def test_repeats_cost_nothing():
+    quality_control = controller(5000, frame_count=2)
+    quality_control.repeat()
+    quality_control.encode(SizedEncoder(), None)  # the whole chunk budget is left for one frame
+    assert quality_control.qualities == [MAX_QUALITY]
+    stats = quality_control.stats(30)
+    assert stats['achieved_bitrate'] == MAX_QUALITY * 100 * 8 * 30 // 2
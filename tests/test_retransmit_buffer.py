@@ -0,0 +1,27 @@
+import time
+
+from retransmit_buffer import RetransmitBuffer
+
+
+def test_lookup_returns_the_packet_as_sent():
+    buffer = RetransmitBuffer(8)
+    header = bytearray(b'head')
+    payload = memoryview(b'frame data')[2:7]
+    buffer.add(5, 1, 2, (header, payload), time.monotonic() + 10)
+    header[:] = b'next'  # the send buffer is reused for the next frame
+    resent_header, resent_payload = buffer.lookup(5, 1, 2)
+    assert (resent_header, bytes(resent_payload)) == (b'head', b'ame d')
+    assert buffer.stats()['resent'] == 1
+
+
+def test_late_and_overwritten_packets_are_not_resent():
+    buffer = RetransmitBuffer(4)
+    buffer.add(0, 1, 0, (b'h', b'old'), time.monotonic() - 1)
+    assert buffer.lookup(0, 1, 0) is None
+    buffer.add(1, 1, 1, (b'h', b'a'), time.monotonic() + 10)
+    buffer.add(5, 1, 2, (b'h', b'b'), time.monotonic() + 10)  # same slot as sequence 1
+    assert buffer.lookup(1, 1, 1) is None
+    assert buffer.lookup(5, 1, 3) is None  # same sequence, another frame: a stale NACK
+    assert buffer.lookup(7, 1, 2) is None  # never sent
+    stats = buffer.stats()
+    assert (stats['requested'], stats['expired'], stats['evicted'], stats['resent']) == (4, 1, 3, 0)
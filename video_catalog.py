@@ -0,0 +1,82 @@
+"""
+Video catalog for the chunk server
+A catalog maps title names to source videos, either a single file or every
+video in a directory. A title's chunk store is only opened (and, if it was
+never preprocessed, encoded) when the first client asks for it, so a
+server can offer a whole library while holding only the titles in use.
+"""
+
+import os
+import threading
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm')
+
+
+class VideoTitle:
+    """One source video and, once opened, the preprocessor serving its chunk store"""
+
+    def __init__(self, name, video_file_path):
+        self.name = name
+        self.video_file_path = video_file_path
+        self.lock = threading.Lock()  # serializes the first open
+        self.opened = False
+
+        # Filled in when the title is opened, see ChunkBasedVideoServer.preprocess_video
+        self.preprocessor = None
+        self.resolutions = {}          # ladder fitted to the source
+        self.rendition_ids = {}        # {rendition: one-byte id used in v2 packets}
+        self.initial_resolution = None
+        self.chunk_format = None
+        self.original_fps = 30
+
+    @property
+    def total_chunks(self):
+        return self.preprocessor.total_chunks if self.preprocessor else 0
+
+    def close(self):
+        if self.preprocessor:
+            self.preprocessor.close()
+
+
+class VideoCatalog:
+    """Titles served by one chunk server, opened lazily on first request"""
+
+    def __init__(self, sources, open_title):
+        # sources: {title name: video file path}; open_title(title) prepares a title and returns True on success
+        self.titles = {name: VideoTitle(name, path) for name, path in sources.items()}
+        self.open_title = open_title
+
+    @classmethod
+    def from_directory(cls, directory, open_title):
+        """Catalog of every video file in a directory, named after the file without its extension"""
+        sources = {}
+        for file_name in sorted(os.listdir(directory)):
+            name, extension = os.path.splitext(file_name)
+            if extension.lower() in VIDEO_EXTENSIONS:
+                sources[name] = os.path.join(directory, file_name)
+        return cls(sources, open_title)
+
+    def names(self):
+        return sorted(self.titles)
+
+    def get(self, name):
+        """The opened title, or None if it is unknown or cannot be opened
+
+        Clients asking for a title that is still being opened wait for that
+        open instead of starting their own.
+        """
+        title = self.titles.get(name)
+        if title is None:
+            return None
+        with title.lock:
+            if not title.opened:
+                print(f"📂 Opening title '{name}'")
+                title.opened = self.open_title(title)
+        return title if title.opened else None
+
+    def opened_titles(self):
+        return [title for title in self.titles.values() if title.opened]
+
+    def close(self):
+        for title in self.opened_titles():
+            title.close()
@@ -0,0 +1,167 @@
+"""
+H.264/HEVC segment chunks
+In segment mode every chunk_NNNN.bin holds one closed-GOP segment instead of
+independent JPEGs. The segment is produced by ffmpeg (libx264/libx265),
+starts with an IDR frame and has no B-frames, and is stored in the usual
+chunk layout with one access unit per frame. Frame indices, frame counts and
+fragmentation therefore work exactly as for MJPEG chunks, and resolution
+switches at chunk boundaries always land on an IDR frame.
+PyAV is only needed on the client, to decode the access units.
+"""
+
+import os
+import subprocess
+
+import numpy as np
+
+from chunk_store import ChunkWriter
+
+try:
+    import av
+except ImportError:
+    av = None
+
+SEGMENT_CODECS = {
+    # codec: (ffmpeg encoder, metadata bitstream filter, elementary stream format)
+    'h264': ('libx264', 'h264_metadata', 'h264'),
+    'hevc': ('libx265', 'hevc_metadata', 'hevc'),
+}
+CHUNK_FORMATS = ('jpeg',) + tuple(SEGMENT_CODECS)
+DEFAULT_PRESET = 'veryfast'
+
+
+def quality_to_crf(quality):
+    """Map the ladder's JPEG quality (60-85) onto a comparable CRF (28-20)"""
+    return int(round(47 - quality * 0.32))
+
+
+def is_access_unit_delimiter(codec, nal_header):
+    """Check the first NAL header byte for an access unit delimiter"""
+    if codec == 'h264':
+        return nal_header & 0x1F == 9
+    return (nal_header >> 1) & 0x3F == 35
+
+
+def split_access_units(codec, stream):
+    """Split an Annex B elementary stream into access units
+
+    The encoder inserts an access unit delimiter in front of every frame, so
+    each access unit starts at a delimiter's start code.
+    """
+    boundaries = []
+    position = stream.find(b'\x00\x00\x01')
+    while position != -1:
+        if position + 3 < len(stream) and is_access_unit_delimiter(codec, stream[position + 3]):
+            # Keep the leading zero byte of a four-byte start code with its access unit
+            boundaries.append(position - 1 if position > 0 and stream[position - 1] == 0 else position)
+        position = stream.find(b'\x00\x00\x01', position + 3)
+
+    return [stream[start:end] for start, end in zip(boundaries, boundaries[1:] + [len(stream)])]
+
+
+class SegmentWriter:
+    """Encode raw frames of one rendition into a closed-GOP segment chunk
+
+    Frames are piped to ffmpeg as they are decoded; on close() the segment is
+    split into access units and written through ChunkWriter, so the chunk
+    file keeps the standard layout.
+    """
+
+    def __init__(self, chunk_file, codec, width, height, fps, quality, frame_count, preset=DEFAULT_PRESET, threads=None):
+        encoder, metadata_filter, stream_format = SEGMENT_CODECS[codec]
+        self.chunk_file = chunk_file
+        self.codec = codec
+        self.frame_size = (height, width)
+        self.frame_count = 0
+        self.frame_sizes = []  # access unit sizes, filled in by close()
+        self.segment_file = chunk_file + f".{stream_format}.tmp"
+
+        cmd = ['ffmpeg', '-v', 'error', '-nostdin', '-y',
+               '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f"{width}x{height}", '-r', f"{fps:.6f}", '-i', '-',
+               '-c:v', encoder, '-preset', preset, '-tune', 'zerolatency', '-crf', str(quality_to_crf(quality)),
+               '-pix_fmt', 'yuv420p', '-bf', '0']
+        if threads:
+            cmd += ['-threads', str(threads)]
+        # One GOP per chunk: only the first frame is a keyframe, so every chunk starts with an IDR
+        gop = max(1, frame_count)
+        if codec == 'h264':
+            cmd += ['-g', str(gop), '-keyint_min', str(gop), '-sc_threshold', '0']
+        else:
+            cmd += ['-x265-params', f"keyint={gop}:min-keyint={gop}:scenecut=0:bframes=0:log-level=error"]
+        cmd += ['-bsf:v', f"{metadata_filter}=aud=insert", '-f', stream_format, self.segment_file]
+
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def write_frame(self, frame):
+        """Pipe one BGR frame to the encoder"""
+        # Rungs of the ffmpeg ingest canvas are row-strided views and need packing first
+        self.process.stdin.write(np.ascontiguousarray(frame).data)
+        self.frame_count += 1
+
+    def close(self):
+        """Finish the segment, store one access unit per frame and return the file size"""
+        self.process.stdin.close()
+        returncode = self.process.wait()
+        try:
+            if returncode != 0:
+                raise RuntimeError(f"ffmpeg {self.codec} encoder exited with status {returncode}")
+            with open(self.segment_file, 'rb') as f:
+                access_units = split_access_units(self.codec, f.read())
+        finally:
+            if os.path.exists(self.segment_file):
+                os.remove(self.segment_file)
+
+        if len(access_units) != self.frame_count:
+            raise RuntimeError(f"{self.codec} segment has {len(access_units)} access units for {self.frame_count} frames")
+
+        writer = ChunkWriter(self.chunk_file)
+        for access_unit in access_units:
+            writer.write_frame(access_unit)
+        self.frame_sizes = writer.frame_sizes
+        return writer.close()
+
+
+class SegmentDecoder:
+    """Client-side decoder for segment chunks (requires PyAV)
+
+    Decoding restarts at frame 0 of every chunk, which is always an IDR frame.
+    After a lost or out-of-order frame the rest of the chunk cannot be decoded
+    correctly, so frames are skipped until the next chunk starts.
+    """
+
+    def __init__(self, codec):
+        if av is None:
+            raise RuntimeError(f"PyAV is required to decode {codec} chunks (pip install av)")
+        if codec not in SEGMENT_CODECS:
+            raise ValueError(f"Unknown segment codec: {codec}")
+        self.codec = codec
+        self.context = None
+        self.position = None  # (chunk_id, frame_index) of the last decoded frame
+        self.frames_skipped = 0
+
+    def reset(self):
+        """Start a fresh decoder, needed when the rendition (and so the SPS) changes"""
+        self.context = av.CodecContext.create(self.codec, 'r')
+        self.context.thread_type = 'SLICE'  # frame threading would delay output by several frames
+
+    def decode(self, chunk_id, frame_index, data):
+        """Decode one access unit, returning a BGR frame or None if it cannot be shown"""
+        if frame_index == 0:
+            self.reset()
+        elif self.position != (chunk_id, frame_index - 1):
+            # The reference chain is broken, wait for the next chunk's IDR
+            self.position = None
+            self.frames_skipped += 1
+            return None
+
+        try:
+            frames = self.context.decode(av.Packet(data))
+        except av.error.FFmpegError:
+            self.position = None
+            self.frames_skipped += 1
+            return None
+
+        self.position = (chunk_id, frame_index)
+        if not frames:
+            return None
+        return frames[-1].to_ndarray(format='bgr24')